@@ -4,12 +4,21 @@ PosterGenMaster - 企业级批量海报生成工具
 """
 import streamlit as st
 import pandas as pd
-import zipfile
 import io
 import os
+import uuid
+import hashlib
 from PIL import Image
-from core.drawer import PosterDrawer
+from core import metrics, tracing
+from core.batch_job import (
+    STATUS_RUNNING, BatchJob, input_digest, list_jobs, prepare_templates, prune_jobs_from_env, templates_signature
+)
+from core.batch_manifest import MANIFEST_FILENAME, diff_manifest, dumps_manifest, load_manifest
+from core.drawer import OUTPUT_SIZE, PosterDrawer
+from core.progress import ProgressReporter, failures_csv, format_progress
+from core.scheduler import get_scheduler, warm_from_env
 from core.template_manager import TemplateManager
+from core.text_parser import parse_text
 
 
 # 页面配置
@@ -22,10 +31,24 @@ st.set_page_config(
 # 页面标题
 st.title("🏆 PosterGenMaster - 自动海报生成工具")
 
+# 运行指标（设置环境变量 POSTERGEN_METRICS_PORT 或 POSTERGEN_METRICS_FILE 启用，每个服务进程只启动一次）
+metrics.serve_from_env()
+
 # 初始化模板管理器
 if 'template_manager' not in st.session_state:
     st.session_state.template_manager = TemplateManager()
 
+# 会话标识（渲染调度器按会话公平分配渲染进程）
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# 性能追踪（设置环境变量 POSTERGEN_TRACE=1 启用）：从上传数据到打包 ZIP 的区间记录在会话的追踪器中，
+# 每个任务结束时写出一个追踪文件，然后重新开始记录
+if tracing.env_enabled() and 'tracer' not in st.session_state:
+    st.session_state.tracer = tracing.Tracer({'session_id': st.session_state.session_id})
+tracing.activate(st.session_state.get('tracer'))
+script_span = tracing.span('script_run')
+
 # 初始化默认模板（如果不存在）
 if 'templates_initialized' not in st.session_state:
     templates = st.session_state.template_manager.load_templates()
@@ -36,6 +59,10 @@ if 'templates_initialized' not in st.session_state:
     else:
         st.session_state.templates_initialized = True
 
+# 预热渲染进程池（设置环境变量 POSTERGEN_WARM_POOL=1 启用）：服务启动后第一次运行脚本时在后台启动渲染进程，
+# 预先加载字体和默认模板，第一个批次不再等待渲染进程启动（每个服务进程只预热一次）
+warm_from_env(st.session_state.template_manager, 'assets/NotoSansSC-Regular.ttf', 'assets/NotoSansSC-Bold.ttf')
+
 # 初始化当前模板ID
 if 'current_template_id' not in st.session_state:
     default_template = st.session_state.template_manager.get_default_template()
@@ -53,7 +80,7 @@ if st.session_state.current_template_id:
 if 'drawer' not in st.session_state or st.session_state.get('drawer_template_id') != st.session_state.current_template_id:
     if current_template:
         # 获取模板背景图的完整路径
-        template_bg_path = st.session_state.template_manager.get_template_background_path(current_template)
+        template_bg_path = st.session_state.template_manager.get_template_render_path(current_template)
         if template_bg_path:
             template_config = {
                 'background_path': template_bg_path,
@@ -120,7 +147,7 @@ if templates:
         st.session_state.current_template_id = selected_template_id
         current_template = st.session_state.template_manager.get_template(selected_template_id)
         if current_template:
-            template_bg_path = st.session_state.template_manager.get_template_background_path(current_template)
+            template_bg_path = st.session_state.template_manager.get_template_render_path(current_template)
             if template_bg_path:
                 template_config = {
                     'background_path': template_bg_path,
@@ -139,7 +166,8 @@ if templates:
                     f'up_size_city_{selected_template_id}', f'up_size_desc_{selected_template_id}',
                     f'up_size_amount_{selected_template_id}', f'up_size_unit_{selected_template_id}',
                     f'up_y_city_{selected_template_id}', f'up_y_desc_{selected_template_id}',
-                    f'up_y_amount_{selected_template_id}', f'up_offset_{selected_template_id}'
+                    f'up_y_amount_{selected_template_id}', f'up_offset_{selected_template_id}',
+                    f'up_auto_fit_{selected_template_id}', f'up_font_fallbacks_{selected_template_id}'
                 ]
                 for key in update_keys_to_clear:
                     if key in st.session_state:
@@ -191,9 +219,9 @@ def _build_config_from_params(drawer, size_adj, y_adj, unit_offset_y_val):
         }
     }
 
-def _build_config_from_values(base_config, template_text='', template_text_size=100, template_text_y=200, city_name_size=120, city_name_y=415, desc_size=50, desc_y=620, amount_size=220, amount_y=750, unit_size=80, unit_offset_y=60):
+def _build_config_from_values(base_config, template_text='', template_text_size=100, template_text_y=200, city_name_size=120, city_name_y=415, desc_size=50, desc_y=620, amount_size=220, amount_y=750, unit_size=80, unit_offset_y=60, auto_fit=False, font_fallbacks=None):
     """从实际数值构建配置（用于更新模板时直接保存）"""
-    return {
+    config = {
         'layers': {
             'template_text': {
                 'text': template_text,
@@ -237,6 +265,26 @@ def _build_config_from_values(base_config, template_text='', template_text_size=
             }
         }
     }
+    # 超宽文字自动缩小字号（最大宽度为画布宽度减去两侧边距）
+    if auto_fit:
+        for layer_name in ('city_name', 'desc', 'amount'):
+            config['layers'][layer_name]['max_width'] = 'auto'
+    # 回退字体（首选字体缺字时使用），未指定时沿用原配置
+    if font_fallbacks is None:
+        font_fallbacks = base_config.get('font_fallbacks')
+    if font_fallbacks:
+        config['font_fallbacks'] = list(font_fallbacks)
+    return config
+
+
+def _parse_font_fallbacks(text):
+    """解析回退字体输入框（每行一个字体文件路径）"""
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def _layer_slider(label, min_value, max_value, value, **kwargs):
+    """图层参数滑块：保存的值超出滑块范围时（如其他工具写入的配置）限制到范围内显示，避免页面报错"""
+    return st.slider(label, min_value, max_value, min(max(int(value), min_value), max_value), **kwargs)
 
 # 创建新模板
 with st.sidebar.expander("➕ 创建新模板", expanded=False):
@@ -255,9 +303,9 @@ with st.sidebar.expander("➕ 创建新模板", expanded=False):
     create_template_text = st.text_input("模板文字内容", value=drawer_template_text.get('text', ''), key="create_template_text", placeholder="如：喜签嘉年华", help="模板固定显示的文字内容")
     col_template_text = st.columns(2)
     with col_template_text[0]:
-        create_template_text_size = st.slider("模板文字字号", 40, 200, int(drawer_template_text.get('size', 100)), key="create_template_text_size", help=f"当前值: {drawer_template_text.get('size', 100)}")
+        create_template_text_size = _layer_slider("模板文字字号", 40, 200, int(drawer_template_text.get('size', 100)), key="create_template_text_size", help=f"当前值: {drawer_template_text.get('size', 100)}")
     with col_template_text[1]:
-        create_template_text_y = st.slider("模板文字Y", 50, 500, int(drawer_template_text.get('y', 200)), key="create_template_text_y", help=f"当前值: {drawer_template_text.get('y', 200)}")
+        create_template_text_y = _layer_slider("模板文字Y", 50, 500, int(drawer_template_text.get('y', 200)), key="create_template_text_y", help=f"当前值: {drawer_template_text.get('y', 200)}")
     
     st.markdown("**参数微调（文字大小和位置）**")
     drawer_city = drawer_layers.get('city_name', {})
@@ -267,15 +315,17 @@ with st.sidebar.expander("➕ 创建新模板", expanded=False):
     
     col1, col2 = st.columns(2)
     with col1:
-        create_city_name_size = st.slider("城市+姓名字号", 60, 180, int(drawer_city.get('size', 120)), key="create_city_name_size", help=f"当前值: {drawer_city.get('size', 120)}")
-        create_desc_size = st.slider("描述字号", 30, 100, int(drawer_desc.get('size', 50)), key="create_desc_size", help=f"当前值: {drawer_desc.get('size', 50)}")
-        create_amount_size = st.slider("金额字号", 120, 320, int(drawer_amount.get('size', 220)), key="create_amount_size", help=f"当前值: {drawer_amount.get('size', 220)}")
-        create_unit_size = st.slider("单位字号", 50, 120, int(drawer_unit.get('size', 80)), key="create_unit_size", help=f"当前值: {drawer_unit.get('size', 80)}")
+        create_city_name_size = _layer_slider("城市+姓名字号", 60, 180, int(drawer_city.get('size', 120)), key="create_city_name_size", help=f"当前值: {drawer_city.get('size', 120)}")
+        create_desc_size = _layer_slider("描述字号", 30, 100, int(drawer_desc.get('size', 50)), key="create_desc_size", help=f"当前值: {drawer_desc.get('size', 50)}")
+        create_amount_size = _layer_slider("金额字号", 120, 320, int(drawer_amount.get('size', 220)), key="create_amount_size", help=f"当前值: {drawer_amount.get('size', 220)}")
+        create_unit_size = _layer_slider("单位字号", 50, 120, int(drawer_unit.get('size', 80)), key="create_unit_size", help=f"当前值: {drawer_unit.get('size', 80)}")
     with col2:
-        create_city_name_y = st.slider("城市+姓名Y", 200, 600, int(drawer_city.get('y', 415)), key="create_city_name_y", help=f"当前值: {drawer_city.get('y', 415)}")
-        create_desc_y = st.slider("描述Y", 400, 800, int(drawer_desc.get('y', 620)), key="create_desc_y", help=f"当前值: {drawer_desc.get('y', 620)}")
-        create_amount_y = st.slider("金额Y", 500, 900, int(drawer_amount.get('y', 750)), key="create_amount_y", help=f"当前值: {drawer_amount.get('y', 750)}")
-        create_unit_offset_y = st.slider("单位Y偏移", -100, 150, int(drawer_unit.get('offset_y', 60)), key="create_unit_offset_y", help=f"当前值: {drawer_unit.get('offset_y', 60)}")
+        create_city_name_y = _layer_slider("城市+姓名Y", 200, 600, int(drawer_city.get('y', 415)), key="create_city_name_y", help=f"当前值: {drawer_city.get('y', 415)}")
+        create_desc_y = _layer_slider("描述Y", 400, 800, int(drawer_desc.get('y', 620)), key="create_desc_y", help=f"当前值: {drawer_desc.get('y', 620)}")
+        create_amount_y = _layer_slider("金额Y", 500, 900, int(drawer_amount.get('y', 750)), key="create_amount_y", help=f"当前值: {drawer_amount.get('y', 750)}")
+        create_unit_offset_y = _layer_slider("单位Y偏移", -100, 150, int(drawer_unit.get('offset_y', 60)), key="create_unit_offset_y", help=f"当前值: {drawer_unit.get('offset_y', 60)}")
+    create_auto_fit = st.checkbox("超宽文字自动缩小", value=bool(drawer_city.get('max_width')), key="create_auto_fit", help="城市+姓名、描述、金额超出画布宽度时自动缩小字号")
+    create_font_fallbacks = st.text_area("回退字体（每行一个字体文件路径）", value='\n'.join(st.session_state.drawer.config.get('font_fallbacks', [])), key="create_font_fallbacks", placeholder="如：assets/fonts/NotoSansCJK-Regular.ttc", help="首选字体缺少的字符（如生僻字）按顺序使用这些字体绘制")
     
     if st.button("创建模板", key="create_template_btn"):
         if not new_template_name:
@@ -290,7 +340,8 @@ with st.sidebar.expander("➕ 创建新模板", expanded=False):
                     base_config, create_template_text, create_template_text_size, create_template_text_y,
                     create_city_name_size, create_city_name_y,
                     create_desc_size, create_desc_y, create_amount_size, create_amount_y,
-                    create_unit_size, create_unit_offset_y
+                    create_unit_size, create_unit_offset_y, auto_fit=create_auto_fit,
+                    font_fallbacks=_parse_font_fallbacks(create_font_fallbacks)
                 )
                 
                 new_template = st.session_state.template_manager.create_template(
@@ -305,7 +356,8 @@ with st.sidebar.expander("➕ 创建新模板", expanded=False):
                     'new_template_name', 'new_template_image',
                     'create_template_text', 'create_template_text_size', 'create_template_text_y',
                     'create_city_name_size', 'create_desc_size', 'create_amount_size', 'create_unit_size',
-                    'create_city_name_y', 'create_desc_y', 'create_amount_y', 'create_unit_offset_y'
+                    'create_city_name_y', 'create_desc_y', 'create_amount_y', 'create_unit_offset_y',
+                    'create_auto_fit', 'create_font_fallbacks'
                 ]
                 for key in keys_to_clear:
                     if key in st.session_state:
@@ -313,7 +365,7 @@ with st.sidebar.expander("➕ 创建新模板", expanded=False):
                 # 重新加载模板列表和当前模板
                 current_template = st.session_state.template_manager.get_template(new_template['id'])
                 if current_template:
-                    template_bg_path = st.session_state.template_manager.get_template_background_path(current_template)
+                    template_bg_path = st.session_state.template_manager.get_template_render_path(current_template)
                     if template_bg_path:
                         template_config = {
                             'background_path': template_bg_path,
@@ -363,10 +415,10 @@ if current_template:
         col_template_text = st.columns(2)
         with col_template_text[0]:
             template_text_size_val = int(template_text_cfg.get('size', 100))
-            update_template_text_size = st.slider("模板文字字号", 40, 200, template_text_size_val, key=f"up_template_text_size_{tid}", help=f"当前值: {template_text_size_val}")
+            update_template_text_size = _layer_slider("模板文字字号", 40, 200, template_text_size_val, key=f"up_template_text_size_{tid}", help=f"当前值: {template_text_size_val}")
         with col_template_text[1]:
             template_text_y_val = int(template_text_cfg.get('y', 200))
-            update_template_text_y = st.slider("模板文字Y", 50, 500, template_text_y_val, key=f"up_template_text_y_{tid}", help=f"当前值: {template_text_y_val}")
+            update_template_text_y = _layer_slider("模板文字Y", 50, 500, template_text_y_val, key=f"up_template_text_y_{tid}", help=f"当前值: {template_text_y_val}")
         
         st.markdown(f"**参数微调（文字大小和位置）**")
         # 从模板配置中读取当前值
@@ -381,15 +433,17 @@ if current_template:
         
         col1, col2 = st.columns(2)
         with col1:
-            update_city_name_size = st.slider("城市+姓名字号", 60, 180, city_size_val, key=f"up_size_city_{tid}", help=f"当前值: {city_size_val}")
-            update_desc_size = st.slider("描述字号", 30, 100, desc_size_val, key=f"up_size_desc_{tid}", help=f"当前值: {desc_size_val}")
-            update_amount_size = st.slider("金额字号", 120, 320, amount_size_val, key=f"up_size_amount_{tid}", help=f"当前值: {amount_size_val}")
-            update_unit_size = st.slider("单位字号", 50, 120, unit_size_val, key=f"up_size_unit_{tid}", help=f"当前值: {unit_size_val}")
+            update_city_name_size = _layer_slider("城市+姓名字号", 60, 180, city_size_val, key=f"up_size_city_{tid}", help=f"当前值: {city_size_val}")
+            update_desc_size = _layer_slider("描述字号", 30, 100, desc_size_val, key=f"up_size_desc_{tid}", help=f"当前值: {desc_size_val}")
+            update_amount_size = _layer_slider("金额字号", 120, 320, amount_size_val, key=f"up_size_amount_{tid}", help=f"当前值: {amount_size_val}")
+            update_unit_size = _layer_slider("单位字号", 50, 120, unit_size_val, key=f"up_size_unit_{tid}", help=f"当前值: {unit_size_val}")
         with col2:
-            update_city_name_y = st.slider("城市+姓名Y", 200, 600, city_y_val, key=f"up_y_city_{tid}", help=f"当前值: {city_y_val}")
-            update_desc_y = st.slider("描述Y", 400, 800, desc_y_val, key=f"up_y_desc_{tid}", help=f"当前值: {desc_y_val}")
-            update_amount_y = st.slider("金额Y", 500, 900, amount_y_val, key=f"up_y_amount_{tid}", help=f"当前值: {amount_y_val}")
-            update_unit_offset_y = st.slider("单位Y偏移", -100, 150, unit_offset_val, key=f"up_offset_{tid}", help=f"当前值: {unit_offset_val}")
+            update_city_name_y = _layer_slider("城市+姓名Y", 200, 600, city_y_val, key=f"up_y_city_{tid}", help=f"当前值: {city_y_val}")
+            update_desc_y = _layer_slider("描述Y", 400, 800, desc_y_val, key=f"up_y_desc_{tid}", help=f"当前值: {desc_y_val}")
+            update_amount_y = _layer_slider("金额Y", 500, 900, amount_y_val, key=f"up_y_amount_{tid}", help=f"当前值: {amount_y_val}")
+            update_unit_offset_y = _layer_slider("单位Y偏移", -100, 150, unit_offset_val, key=f"up_offset_{tid}", help=f"当前值: {unit_offset_val}")
+        update_auto_fit = st.checkbox("超宽文字自动缩小", value=bool(city_cfg.get('max_width')), key=f"up_auto_fit_{tid}", help="城市+姓名、描述、金额超出画布宽度时自动缩小字号")
+        update_font_fallbacks = st.text_area("回退字体（每行一个字体文件路径）", value='\n'.join(current_template.get('config', {}).get('font_fallbacks', [])), key=f"up_font_fallbacks_{tid}", placeholder="如：assets/fonts/NotoSansCJK-Regular.ttc", help="首选字体缺少的字符（如生僻字）按顺序使用这些字体绘制")
         
         if st.button("保存当前配置", key="update_template_btn"):
             try:
@@ -400,7 +454,8 @@ if current_template:
                     base, update_template_text, update_template_text_size, update_template_text_y,
                     update_city_name_size, update_city_name_y,
                     update_desc_size, update_desc_y, update_amount_size, update_amount_y,
-                    update_unit_size, update_unit_offset_y
+                    update_unit_size, update_unit_offset_y, auto_fit=update_auto_fit,
+                    font_fallbacks=_parse_font_fallbacks(update_font_fallbacks)
                 )
                 
                 update_kwargs = {'config': current_config}
@@ -468,7 +523,7 @@ if current_template:
                                 if default_template:
                                     st.session_state.current_template_id = default_template['id']
                                     # 重新加载drawer
-                                    template_bg_path = st.session_state.template_manager.get_template_background_path(default_template)
+                                    template_bg_path = st.session_state.template_manager.get_template_render_path(default_template)
                                     if template_bg_path:
                                         template_config = {
                                             'background_path': template_bg_path,
@@ -486,7 +541,7 @@ if current_template:
                                     if remaining_templates:
                                         st.session_state.current_template_id = remaining_templates[0]['id']
                                         remaining_template = remaining_templates[0]
-                                        template_bg_path = st.session_state.template_manager.get_template_background_path(remaining_template)
+                                        template_bg_path = st.session_state.template_manager.get_template_render_path(remaining_template)
                                         if template_bg_path:
                                             template_config = {
                                                 'background_path': template_bg_path,
@@ -532,15 +587,38 @@ if current_template:
             except Exception as e:
                 st.sidebar.error(f"❌ 设置失败: {str(e)}")
 
+# 每个服务进程缓存的模板预览图数量
+PREVIEW_CACHE_ENTRIES = 32
+
+
+@st.cache_data(show_spinner=False, max_entries=PREVIEW_CACHE_ENTRIES)
+def load_template_preview(path, mtime):
+    """
+    读取模板预览图（按路径和修改时间缓存）
+
+    Returns:
+        (data, size): 文件内容和图片尺寸
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as preview_img:
+        return data, preview_img.size
+
+
 # 显示当前模板预览
 if current_template:
-    template_bg_path = st.session_state.template_manager.get_template_background_path(current_template)
-    if template_bg_path and os.path.exists(template_bg_path):
+    template_preview_path = st.session_state.template_manager.get_template_preview_path(current_template)
+    if template_preview_path and os.path.exists(template_preview_path):
         try:
-            preview_img = Image.open(template_bg_path)
+            # 直接显示预览图文件内容（不在每次重新运行时解码再编码）
+            preview_data, preview_size = load_template_preview(
+                template_preview_path, os.path.getmtime(template_preview_path)
+            )
+            # 优先显示底图的实际尺寸（预览图可能是缩略图）
+            background_size = current_template.get('assets', {}).get('background', {}).get('size') or preview_size
             st.sidebar.subheader("模板预览")
-            st.sidebar.info(f"模板: {current_template['name']}\n尺寸: {preview_img.size[0]}x{preview_img.size[1]}")
-            st.sidebar.image(preview_img, caption="当前模板", use_container_width=True)
+            st.sidebar.info(f"模板: {current_template['name']}\n尺寸: {background_size[0]}x{background_size[1]}")
+            st.sidebar.image(preview_data, caption="当前模板", use_container_width=True)
         except Exception as e:
             st.sidebar.warning(f"无法加载模板预览: {str(e)}")
 
@@ -552,6 +630,182 @@ if current_template:
 else:
     dynamic_config = st.session_state.drawer.config
 
+# CSV 必需的列
+REQUIRED_COLUMNS = ['分公司', '业务员姓名', '预收规保', '缴费期间']
+
+# 每个服务进程缓存的上传数据份数（不同会话上传相同内容时共用）
+DATA_CACHE_ENTRIES = 16
+
+
+@st.cache_data(show_spinner=False, max_entries=DATA_CACHE_ENTRIES)
+def load_csv(csv_digest, _csv_data, filename):
+    """
+    读取并整理上传的 CSV（按文件内容摘要缓存）
+
+    Args:
+        csv_digest: 文件内容的 SHA-256 摘要（缓存键）
+        _csv_data: 文件内容（不参与缓存键）
+        filename: 文件名（写入追踪区间）
+
+    Returns:
+        (df, columns, row_count, missing_columns): 整理后的数据（缺少必需的列或没有符合条件的记录时为 None）、
+        读取到的列名、读取到的行数、缺少的必需列
+
+    Raises:
+        ValueError: 无法读取 CSV 文件
+    """
+    # 读取 CSV 文件（支持多种分隔符和编码）
+    df = None
+    encodings = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig', 'latin1']
+    # 优先尝试制表符（根据用户提供的列名，很可能是制表符分隔）
+    separators = ['\t', ',', ';', None]  # None 表示让 pandas 自动检测
+    last_error = None
+
+    # 尝试不同的分隔符和编码组合
+    sniff_span = tracing.span('csv_sniff', filename=filename, bytes=len(_csv_data))
+    for sep in separators:
+        for encoding in encodings:
+            try:
+                # 构建 read_csv 参数
+                read_params = {
+                    'encoding': encoding,
+                    'on_bad_lines': 'skip',
+                    'engine': 'python'  # 使用 python 引擎更兼容
+                }
+                if sep is not None:
+                    read_params['sep'] = sep
+
+                df = pd.read_csv(io.BytesIO(_csv_data), **read_params)
+
+                # 检查是否成功读取到数据，且列数大于1（避免只有1列的情况）
+                if df is not None and len(df.columns) > 1:
+                    break
+            except Exception as e:
+                last_error = str(e)
+                continue
+
+        # 如果成功读取且列数大于1，跳出外层循环
+        if df is not None and len(df.columns) > 1:
+            break
+
+    sniff_span.end()
+
+    if df is None or len(df.columns) == 0:
+        error_msg = "无法读取 CSV 文件。"
+        if last_error:
+            error_msg += f" 错误信息: {last_error}"
+        error_msg += "\n\n请检查：\n1. 文件是否为有效的 CSV 格式\n2. 文件编码（建议使用 UTF-8 或 GBK）\n3. 文件是否包含表头行\n4. 文件分隔符（支持制表符、逗号、分号）"
+        raise ValueError(error_msg)
+
+    # 如果只有 1 列，可能是分隔符检测失败，尝试重新解析
+    if len(df.columns) == 1:
+        first_col_name = str(df.columns[0])
+        # 检查第一列名是否包含多个字段（用制表符或逗号分隔）
+        if '\t' in first_col_name:
+            # 重新读取，强制使用制表符分隔
+            for encoding in encodings:
+                try:
+                    df = pd.read_csv(io.BytesIO(_csv_data), sep='\t', encoding=encoding, on_bad_lines='skip', engine='python')
+                    if len(df.columns) > 1:
+                        break
+                except:
+                    continue
+        elif ',' in first_col_name:
+            # 重新读取，强制使用逗号分隔
+            for encoding in encodings:
+                try:
+                    df = pd.read_csv(io.BytesIO(_csv_data), sep=',', encoding=encoding, on_bad_lines='skip', engine='python')
+                    if len(df.columns) > 1:
+                        break
+                except:
+                    continue
+
+    columns = [str(col) for col in df.columns]
+    row_count = len(df)
+
+    # 检查必需的列
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing_columns:
+        return None, columns, row_count, missing_columns
+
+    # 数据转换和过滤
+    normalize_span = tracing.span('normalize', rows=len(df))
+    # 1. 将预收规保（元）转换为万元，并过滤小于10万元的记录
+    df['预收规保_万元'] = pd.to_numeric(df['预收规保'], errors='coerce') / 10000
+    df = df[df['预收规保_万元'] >= 10].copy()
+
+    if len(df) == 0:
+        df = None
+    else:
+        # 2. 生成描述字段
+        def generate_desc(row):
+            payment_period = pd.to_numeric(row['缴费期间'], errors='coerce')
+            if pd.isna(payment_period) or payment_period == 0:
+                return "喜签趸交保单"
+            else:
+                return f"喜签{int(payment_period)}年期保单"
+
+        df['描述'] = df.apply(generate_desc, axis=1)
+
+        # 3. 字段映射：转换为绘制器需要的格式
+        df['城市'] = df['分公司'].astype(str)
+        df['姓名'] = df['业务员姓名'].astype(str)
+        df['金额'] = df['预收规保_万元'].apply(lambda x: str(int(x)))
+        df['单位'] = '万'
+
+        # 4. 按规保金额从大到小排序
+        df = df.sort_values('预收规保_万元', ascending=False).reset_index(drop=True)
+    normalize_span.end(kept_rows=0 if df is None else len(df))
+    return df, columns, row_count, []
+
+
+@st.cache_data(show_spinner=False, max_entries=DATA_CACHE_ENTRIES)
+def parse_text_input(text):
+    """解析文本输入（按文本内容缓存），返回值同 parse_text()"""
+    with tracing.span('parse_text', chars=len(text)):
+        return parse_text(text)
+
+
+@st.cache_resource(show_spinner=False, max_entries=DATA_CACHE_ENTRIES)
+def prepare_rows(data_key, _df):
+    """
+    数据 -> 生成用的行列表和输入摘要（按数据来源和内容缓存，1 万行的 to_dict 和摘要计算约需 0.2 秒）
+
+    Args:
+        data_key: 数据来源和内容摘要，如 ('csv', SHA-256)
+        _df: 整理后的数据（不参与缓存键）
+
+    Returns:
+        (rows, digest): 行字典列表（多个会话共用，只读）和 input_digest(rows)
+    """
+    rows = _df.to_dict('records')
+    return rows, input_digest(rows)
+
+
+# 未完成任务的查找结果缓存多少秒（每次重新运行页面不必重新扫描任务目录）
+RESUME_SCAN_TTL = 10
+
+# 生成时会话中保存多少张海报用于预览（其余海报只在任务目录中）
+SESSION_PREVIEW_POSTERS = 1
+
+
+@st.cache_data(show_spinner=False, ttl=RESUME_SCAN_TTL)
+def find_resumable_job(data_digest):
+    """
+    查找输入数据与当前一致、没有在其他会话中生成的未完成任务
+
+    Args:
+        data_digest: 当前输入数据的摘要
+
+    Returns:
+        (job_dir, done, total): 最新的可以继续的任务目录和进度，没有时为 None
+    """
+    for job in list_jobs(status=STATUS_RUNNING, include_live=False):
+        if job.spec['input_digest'] == data_digest:
+            return (job.job_dir, *job.progress())
+    return None
+
+
 # 主区域
 st.header("📤 数据输入")
 
@@ -559,13 +813,19 @@ st.header("📤 数据输入")
 tab1, tab2 = st.tabs(["📁 CSV 文件上传", "✏️ 文本输入"])
 
 # 初始化 session state
+# 会话中只保留少量海报用于预览，以及文件名列表；完整结果在任务目录的 ZIP 中，下载时从文件读取
 if 'generated_images' not in st.session_state:
     st.session_state.generated_images = []
-if 'zip_buffer' not in st.session_state:
-    st.session_state.zip_buffer = None
+if 'generated_files' not in st.session_state:
+    st.session_state.generated_files = []
+if 'zip_path' not in st.session_state:
+    st.session_state.zip_path = None
+if 'batch_manifest' not in st.session_state:
+    st.session_state.batch_manifest = None
 
-# 用于存储处理后的数据
+# 用于存储处理后的数据（data_key 为数据来源和内容摘要，用作生成行列表的缓存键）
 df = None
+data_key = None
 
 # 标签页1：CSV文件上传
 with tab1:
@@ -577,113 +837,20 @@ with tab1:
     
     if uploaded_file is not None:
         try:
-            # 读取 CSV 文件（支持多种分隔符和编码）
-            # Streamlit 文件对象需要特殊处理
-            df = None
-            encodings = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig', 'latin1']
-            # 优先尝试制表符（根据用户提供的列名，很可能是制表符分隔）
-            separators = ['\t', ',', ';', None]  # None 表示让 pandas 自动检测
-            last_error = None
-            
-            # 尝试不同的分隔符和编码组合
-            for sep in separators:
-                for encoding in encodings:
-                    try:
-                        uploaded_file.seek(0)  # 重置文件指针
-                        
-                        # 构建 read_csv 参数
-                        read_params = {
-                            'encoding': encoding,
-                            'on_bad_lines': 'skip',
-                            'engine': 'python'  # 使用 python 引擎更兼容
-                        }
-                        if sep is not None:
-                            read_params['sep'] = sep
-                        
-                        df = pd.read_csv(uploaded_file, **read_params)
-                        
-                        # 检查是否成功读取到数据，且列数大于1（避免只有1列的情况）
-                        if df is not None and len(df.columns) > 1:
-                            break
-                    except Exception as e:
-                        last_error = str(e)
-                        continue
-                
-                # 如果成功读取且列数大于1，跳出外层循环
-                if df is not None and len(df.columns) > 1:
-                    break
-            
-            if df is None or len(df.columns) == 0:
-                error_msg = "无法读取 CSV 文件。"
-                if last_error:
-                    error_msg += f" 错误信息: {last_error}"
-                error_msg += "\n\n请检查：\n1. 文件是否为有效的 CSV 格式\n2. 文件编码（建议使用 UTF-8 或 GBK）\n3. 文件是否包含表头行\n4. 文件分隔符（支持制表符、逗号、分号）"
-                raise ValueError(error_msg)
-            
-            # 如果只有 1 列，可能是分隔符检测失败，尝试重新解析
-            if len(df.columns) == 1:
-                first_col_name = str(df.columns[0])
-                # 检查第一列名是否包含多个字段（用制表符或逗号分隔）
-                if '\t' in first_col_name:
-                    # 重新读取，强制使用制表符分隔
-                    for encoding in encodings:
-                        try:
-                            uploaded_file.seek(0)
-                            df = pd.read_csv(uploaded_file, sep='\t', encoding=encoding, on_bad_lines='skip', engine='python')
-                            if len(df.columns) > 1:
-                                break
-                        except:
-                            continue
-                elif ',' in first_col_name:
-                    # 重新读取，强制使用逗号分隔
-                    for encoding in encodings:
-                        try:
-                            uploaded_file.seek(0)
-                            df = pd.read_csv(uploaded_file, sep=',', encoding=encoding, on_bad_lines='skip', engine='python')
-                            if len(df.columns) > 1:
-                                break
-                        except:
-                            continue
+            # 按文件内容摘要缓存读取和整理结果，操作其他控件触发的重新运行不再重复解析
+            csv_data = uploaded_file.getvalue()
+            csv_digest = hashlib.sha256(csv_data).hexdigest()
+            df, csv_columns, csv_row_count, missing_columns = load_csv(csv_digest, csv_data, uploaded_file.name)
+            data_key = ('csv', csv_digest)
             
             # 显示读取到的列名（用于调试）
-            st.info(f"📋 成功读取文件，共 {len(df.columns)} 列，{len(df)} 行数据。列名: {', '.join(df.columns.tolist()[:10])}{'...' if len(df.columns) > 10 else ''}")
-            
-            # 检查必需的列
-            required_columns = ['分公司', '业务员姓名', '预收规保', '缴费期间']
-            missing_columns = [col for col in required_columns if col not in df.columns]
+            st.info(f"📋 成功读取文件，共 {len(csv_columns)} 列，{csv_row_count} 行数据。列名: {', '.join(csv_columns[:10])}{'...' if len(csv_columns) > 10 else ''}")
             
             if missing_columns:
                 st.error(f"❌ CSV 文件缺少必需的列: {', '.join(missing_columns)}")
                 st.info("请确保 CSV 文件包含以下列：分公司、业务员姓名、预收规保、缴费期间")
-                df = None
-            else:
-                # 数据转换和过滤
-                # 1. 将预收规保（元）转换为万元，并过滤小于10万元的记录
-                df['预收规保_万元'] = pd.to_numeric(df['预收规保'], errors='coerce') / 10000
-                df = df[df['预收规保_万元'] >= 10].copy()
-                
-                if len(df) == 0:
-                    st.warning("⚠️ 没有符合条件的记录（所有记录的预收规保都小于10万元）")
-                    df = None
-                else:
-                    # 2. 生成描述字段
-                    def generate_desc(row):
-                        payment_period = pd.to_numeric(row['缴费期间'], errors='coerce')
-                        if pd.isna(payment_period) or payment_period == 0:
-                            return "喜签趸交保单"
-                        else:
-                            return f"喜签{int(payment_period)}年期保单"
-                    
-                    df['描述'] = df.apply(generate_desc, axis=1)
-                    
-                    # 3. 字段映射：转换为绘制器需要的格式
-                    df['城市'] = df['分公司'].astype(str)
-                    df['姓名'] = df['业务员姓名'].astype(str)
-                    df['金额'] = df['预收规保_万元'].apply(lambda x: str(int(x)))
-                    df['单位'] = '万'
-                    
-                    # 4. 按规保金额从大到小排序
-                    df = df.sort_values('预收规保_万元', ascending=False).reset_index(drop=True)
+            elif df is None:
+                st.warning("⚠️ 没有符合条件的记录（所有记录的预收规保都小于10万元）")
         
         except Exception as e:
             st.error(f"❌ 读取 CSV 文件时出错: {str(e)}")
@@ -710,77 +877,20 @@ with tab2:
     
     if text_input and text_input.strip():
         try:
-            # 解析文本输入
-            lines = [line.strip() for line in text_input.strip().split('\n') if line.strip()]
-            parsed_data = []
-            
-            import re
-            for line in lines:
-                # 解析每一行
-                parts = line.split()
-                if len(parts) < 3:
-                    continue
-                
-                city = parts[0]
-                name = parts[1]
-                
-                # 解析金额和缴费期间（可能在同一字段，如"20万x6年"）
-                amount_str = parts[2]
-                payment_period = 0
-                
-                # 检查金额字段是否包含缴费期间信息（格式：20万x6年）
-                if 'x' in amount_str or 'X' in amount_str:
-                    # 提取金额（去掉"万"和"x年"部分）
-                    amount_match = re.search(r'(\d+(?:\.\d+)?)', amount_str)
-                    if amount_match:
-                        try:
-                            amount = float(amount_match.group(1))
-                        except:
-                            continue
-                    # 提取缴费期间（x后面的数字）
-                    period_match = re.search(r'[xX](\d+)年', amount_str)
-                    if period_match:
-                        payment_period = int(period_match.group(1))
-                else:
-                    # 普通格式：只包含金额
-                    amount_str_clean = amount_str.replace('万', '').strip()
-                    try:
-                        amount = float(amount_str_clean)
-                    except:
-                        continue
-                    
-                    # 如果有第四个字段，解析缴费期间
-                    if len(parts) >= 4:
-                        # 格式1：趸交
-                        if '趸交' in parts[3]:
-                            payment_period = 0
-                        # 格式2：x年 或 x年期
-                        elif '年' in parts[3]:
-                            period_match = re.search(r'(\d+)', parts[3])
-                            if period_match:
-                                payment_period = int(period_match.group(1))
-                
-                # 检查金额是否大于等于10万
-                if amount >= 10:
-                    parsed_data.append({
-                        '城市': city,
-                        '姓名': name,
-                        '金额': str(int(amount)),
-                        '单位': '万',
-                        '缴费期间': payment_period,
-                        '描述': "喜签趸交保单" if payment_period == 0 else f"喜签{payment_period}年期保单"
-                    })
+            # 解析文本输入（一次遍历，返回数据和被拒绝的行；按文本内容缓存）
+            parsed_df, rejected_lines = parse_text_input(text_input)
             
-            if parsed_data:
-                df = pd.DataFrame(parsed_data)
-                # 按规保金额从大到小排序（将金额字符串转换为数值后排序）
-                df['金额_数值'] = pd.to_numeric(df['金额'], errors='coerce')
-                df = df.sort_values('金额_数值', ascending=False).reset_index(drop=True)
-                df = df.drop('金额_数值', axis=1)  # 删除临时列
+            if len(parsed_df) > 0:
+                df = parsed_df
+                data_key = ('text', hashlib.sha256(text_input.encode('utf-8')).hexdigest())
                 st.success(f"✅ 成功解析 {len(df)} 条数据")
             else:
                 st.warning("⚠️ 未能解析出有效数据，请检查输入格式")
                 df = None
+            
+            if rejected_lines:
+                with st.expander(f"⚠️ {len(rejected_lines)} 行未能解析或被过滤", expanded=df is None):
+                    st.dataframe(pd.DataFrame(rejected_lines), use_container_width=True, hide_index=True)
                 
         except Exception as e:
             st.error(f"❌ 解析文本时出错: {str(e)}")
@@ -796,94 +906,272 @@ if df is not None and len(df) > 0:
     
     st.info(f"✅ 共读取 {len(df)} 条有效数据")
     
+    rows, current_input_digest = prepare_rows(data_key, df)
+    
+    # 多模板批量生成：同一份数据一次渲染多个模板（共用进程池、字体和文字测量）
+    all_templates = st.session_state.template_manager.load_templates()
+    template_names = {t['id']: t['name'] for t in all_templates}
+    selected_template_ids = st.multiselect(
+        "生成使用的模板（可多选）",
+        options=list(template_names),
+        default=[current_template['id']] if current_template else [],
+        format_func=lambda tid: template_names[tid],
+        help="选择多个模板时，同一份数据按每个模板各生成一套海报，ZIP 中按模板分文件夹存放"
+    )
+    
+    # 额外输出尺寸：每张海报只绘制一次，再缩小为这些尺寸，ZIP 中按尺寸分文件夹存放
+    extra_size_options = {
+        (540, 960): "540x960（朋友圈预览）",
+        (270, 480): "270x480（缩略图）",
+    }
+    extra_output_sizes = st.multiselect(
+        "额外输出尺寸（可选）",
+        options=list(extra_size_options),
+        format_func=lambda size: extra_size_options[size],
+        help=f"主海报尺寸为 {OUTPUT_SIZE[0]}x{OUTPUT_SIZE[1]}，额外尺寸从同一次绘制的结果缩小得到"
+    )
+    
+    # 排版预检查：只计算排版，不绘制，快速找出超出画布、图层重叠、缺少字形的行
+    # （检查与生成使用相同的模板底图和合并后的配置）
+    if st.button("🔍 排版预检查", use_container_width=True):
+        try:
+            check_templates, check_folders, _ = prepare_templates(
+                st.session_state.template_manager, st.session_state.drawer, selected_template_ids
+            )
+            check_names = [template_names[tid] for tid in selected_template_ids] or check_folders
+            layout_issues = []
+            shrunk_rows = []
+            for template_name, (background, config) in zip(check_names, check_templates):
+                for issue in st.session_state.drawer.validate_batch(rows, config, background):
+                    layout_issues.append({'模板': template_name, **issue})
+                for item in st.session_state.drawer.fit_report(rows, config, background):
+                    shrunk_rows.append({'模板': template_name, **item})
+            if len(check_templates) == 1:
+                for item in layout_issues + shrunk_rows:
+                    del item['模板']
+            
+            if layout_issues:
+                st.warning(f"⚠️ 发现 {len(layout_issues)} 个排版问题，涉及 {len({i['行号'] for i in layout_issues})} 行")
+                st.dataframe(pd.DataFrame(layout_issues), use_container_width=True, hide_index=True)
+            else:
+                st.success("✅ 排版检查通过：没有超出画布、重叠或缺字的文字")
+            
+            if shrunk_rows:
+                st.info(f"ℹ️ {len({i['行号'] for i in shrunk_rows})} 行文字超宽，已自动缩小字号")
+                st.dataframe(pd.DataFrame(shrunk_rows), use_container_width=True, hide_index=True)
+        except (FileNotFoundError, ValueError) as e:
+            st.error(f"❌ {str(e)}")
+    
+    # 增量生成：上传上一批次 ZIP 中的 manifest.json，只生成新增或内容有变化的行
+    previous_manifest_file = st.file_uploader(
+        "上一批次清单（可选，增量生成）",
+        type=['json'],
+        key="previous_manifest",
+        help=f"上传上一批次 ZIP 中的 {MANIFEST_FILENAME}，只生成新增或有变化的行；ZIP 中包含本次生成的海报和更新后的完整清单"
+    )
+    
+    # 未完成的任务：输入数据与当前数据一致时可以继续，跳过已完成的行
+    # （正在其他会话中生成的任务持有租约，不会列出）
+    resume_job = None
+    resumable = find_resumable_job(current_input_digest)
+    if resumable:
+        resumable_dir, resumable_done, resumable_total = resumable
+        st.warning(
+            f"⏯️ 发现与当前数据一致的未完成任务 {os.path.basename(resumable_dir)}"
+            f"（已完成 {resumable_done}/{resumable_total}）"
+        )
+        if st.button("⏯️ 继续未完成的任务", use_container_width=True):
+            try:
+                resume_job = BatchJob(resumable_dir)
+            except FileNotFoundError:
+                find_resumable_job.clear()
+                st.error("❌ 任务已被清理，请重新生成")
+    
+    # 服务器上所有会话共用一个渲染调度器，其他用户正在生成时新任务需要排队
+    scheduler = get_scheduler()
+    scheduler_status = scheduler.status()
+    if scheduler_status['running_jobs'] or scheduler_status['queued_jobs']:
+        st.caption(
+            f"🖥️ 服务器当前有 {scheduler_status['running_jobs']} 个任务正在生成，"
+            f"{scheduler_status['queued_jobs']} 个任务排队（共 {scheduler_status['max_workers']} 个渲染进程）"
+        )
+    
     # 生成按钮
-    if st.button("🚀 开始生成", type="primary", use_container_width=True):
+    if st.button("🚀 开始生成", type="primary", use_container_width=True) or resume_job is not None:
         # 清空之前的结果
         st.session_state.generated_images = []
+        st.session_state.generated_files = []
+        st.session_state.batch_manifest = None
+        st.session_state.zip_path = None
         
-        # 创建进度条
+        # 创建进度条（进度报告器限制更新频率，每秒最多刷新几次页面）
         progress_bar = st.progress(0)
         status_text = st.empty()
         
-        # 生成所有海报
-        # 使用 enumerate 获取从 0 开始的连续索引，避免使用 DataFrame 的原始索引
-        for current_idx, (original_idx, row) in enumerate(df.iterrows()):
-            try:
-                # 使用 PosterDrawer 绘制海报
-                poster_image = st.session_state.drawer.draw(row, dynamic_config)
-                
-                # 保存到 session state
-                img_buffer = io.BytesIO()
-                poster_image.save(img_buffer, format='PNG')
-                img_buffer.seek(0)
-                
-                # 生成文件名：城市-姓名-金额万-缴费期间年期-保单（或趸交）
-                # 清理文件名中的特殊字符（Windows 和 Unix 系统不支持的字符）
-                def clean_filename(text):
-                    if pd.isna(text):
-                        return ""
-                    # 替换不支持的字符为下划线
-                    invalid_chars = ['/', '\\', ':', '*', '?', '"', '<', '>', '|', '\n', '\r', '\t']
-                    text = str(text).strip()
-                    for char in invalid_chars:
-                        text = text.replace(char, '_')
-                    return text
-                
-                city = clean_filename(row.get('城市', ''))
-                name = clean_filename(row.get('姓名', ''))
-                amount = clean_filename(row.get('金额', ''))
-                
-                # 处理缴费期间：如果为0显示"趸交"，否则显示"{缴费期间}年期"
-                payment_period_raw = row.get('缴费期间', 0)
-                try:
-                    payment_period_num = pd.to_numeric(payment_period_raw, errors='coerce')
-                    if pd.isna(payment_period_num) or payment_period_num == 0:
-                        payment_period_str = "趸交"
-                    else:
-                        payment_period_str = f"{int(payment_period_num)}年期"
-                except:
-                    payment_period_str = "趸交"
-                
-                # 组合文件名：城市-姓名-金额万-缴费期间-保单
-                filename = f"{city}-{name}-{amount}万-{payment_period_str}-保单.png"
+        def show_progress(snapshot):
+            if snapshot['fraction'] is not None:
+                progress_bar.progress(snapshot['fraction'])
+            status_text.text(format_progress(snapshot, unit='行'))
+        
+        # 启用内存分析时，在阶段边界和每 N 行采样内存，同时监视会话中缓存的预览海报的字节数
+        # （只在生成时导入，内存分析模块会加载 psutil）
+        from core import memory_profile
+        profiler = None
+        if memory_profile.env_enabled():
+            profiler = memory_profile.MemoryProfiler(
+                memory_profile.env_sample_every(),
+                watch={
+                    'generated_images': lambda: sum(
+                        item['buffer'].getbuffer().nbytes for item in st.session_state.generated_images
+                    ),
+                },
+                metadata={'session_id': st.session_state.session_id, 'rows': len(rows)}
+            )
+        
+        job_span = tracing.span('job', rows=len(rows), templates=len(selected_template_ids))
+        reporter = ProgressReporter(show_progress, profiler=profiler)
+        reporter.stage("准备")
+        job = None
+        trace_data = None
+        memory_report = None
+        
+        try:
+            if resume_job is None:
+                # 每个选中的模板：(底图, 配置) 和 ZIP 中的文件夹名；只选一个模板时文件直接放在 ZIP 根目录
+                with tracing.span('prepare_templates'):
+                    render_templates, folder_names, background_ids = prepare_templates(
+                        st.session_state.template_manager, st.session_state.drawer, selected_template_ids
+                    )
+                output_sizes = [OUTPUT_SIZE, *extra_output_sizes] if extra_output_sizes else None
+                signature = templates_signature(
+                    st.session_state.drawer, render_templates, folder_names, background_ids, output_sizes
+                )
                 
-                st.session_state.generated_images.append({
-                    'image': poster_image,
-                    'buffer': img_buffer,
-                    'filename': filename
-                })
+                # 与上一批次清单比较（渲染设置变化时所有行都重新生成）
+                prior_manifest = load_manifest(previous_manifest_file.getvalue()) if previous_manifest_file else None
+                with tracing.span('diff_manifest', incremental=prior_manifest is not None):
+                    batch_diff = diff_manifest(prior_manifest, rows, signature)
+                carried_entries = {}
+                if prior_manifest is None:
+                    render_indices = None
+                else:
+                    render_indices = sorted(batch_diff['new'] + batch_diff['changed'])
+                    for row_index in batch_diff['unchanged']:
+                        key = batch_diff['keys'][row_index]
+                        carried_entries[key] = prior_manifest['rows'][key]
+                    st.info(
+                        f"🔁 增量生成：新增 {len(batch_diff['new'])} 行，变化 {len(batch_diff['changed'])} 行，"
+                        f"未变化 {len(batch_diff['unchanged'])} 行（跳过），上一批次中已删除 {len(batch_diff['removed'])} 行"
+                        + ("（渲染设置已变化，全部重新生成）" if batch_diff['signature_changed'] else "")
+                    )
                 
-                # 更新进度（使用连续索引计算，确保值在 0.0 到 1.0 之间）
-                progress = (current_idx + 1) / len(df)
-                # 确保进度值不超过 1.0
-                progress = min(progress, 1.0)
-                progress_bar.progress(progress)
-                status_text.text(f"正在生成第 {current_idx + 1}/{len(df)} 张海报...")
+                # 海报和进度检查点边生成边写入任务目录，中断后可以继续；
+                # 创建前按保留时间和大小上限清理旧任务
+                prune_jobs_from_env()
+                job = BatchJob.create(
+                    rows, st.session_state.drawer, selected_template_ids, signature,
+                    batch_diff['keys'], batch_diff['hashes'], render_indices, carried_entries, output_sizes
+                )
+            else:
+                # 继续任务前校验模板和输入数据与任务一致
+                job = resume_job
+                with tracing.span('prepare_templates'):
+                    render_templates, folder_names, background_ids = prepare_templates(
+                        st.session_state.template_manager, st.session_state.drawer, job.spec['template_ids']
+                    )
+                job.verify(
+                    templates_signature(st.session_state.drawer, render_templates, folder_names,
+                                        background_ids, job.spec['output_sizes']),
+                    rows
+                )
+            
+            done_count, total_count = job.progress()
+            if done_count:
+                st.info(f"⏯️ 继续任务 {job.job_id}：跳过已完成的 {done_count} 行")
+            reporter.stage("生成", total_count, done_count)
+            
+            # 排队时显示排队位置，轮到本任务后开始逐行显示进度
+            renderer = scheduler.session_renderer(
+                st.session_state.session_id,
+                on_queue=lambda position: status_text.text(f"⏳ 排队中（第 {position} 位），其他用户的任务完成后自动开始...")
+            )
+            # 生成和打包期间持有任务租约，其他会话不能继续同一个任务
+            with job.lease():
+                job_rows = job.load_rows()
+                for row_index, files, errors in job.run(
+                        st.session_state.drawer, render_templates, folder_names, build_zip=False, renderer=renderer):
+                    # 失败的行集中记录，生成结束后汇总显示
+                    for folder_name, error in errors:
+                        reporter.fail(row_index, job_rows[row_index], error, folder_name)
+                    
+                    # 会话中只保存前几张海报的字节用于预览，其余海报只记录文件名
+                    for path, image_bytes in files:
+                        if len(st.session_state.generated_images) < SESSION_PREVIEW_POSTERS:
+                            st.session_state.generated_images.append({
+                                'buffer': io.BytesIO(image_bytes),
+                                'filename': path
+                            })
+                        st.session_state.generated_files.append(path)
+                    reporter.advance()
                 
-            except FileNotFoundError as e:
-                st.error(f"❌ {str(e)}")
-                break
-            except Exception as e:
-                st.warning(f"⚠️ 第 {current_idx + 1} 行数据生成失败: {str(e)}")
-                continue
+                # ZIP 包含本任务的全部海报（包括继续之前已完成的）和完整清单
+                reporter.stage("打包")
+                job.finish()
+            with tracing.span('download_prepare') as download_span:
+                st.session_state.zip_path = job.zip_path
+                st.session_state.batch_manifest = dumps_manifest(job.manifest())
+                download_span.set(bytes=os.path.getsize(job.zip_path))
+            if not total_count:
+                st.success("✅ 没有新增或变化的行，无需生成海报（仍可下载更新后的清单）")
+        except FileNotFoundError as e:
+            st.error(f"❌ {str(e)}")
+        except ValueError as e:
+            # 上一批次清单无效、任务的模板/输入数据不一致、任务正在其他会话中生成，或超过了每个会话的行数限制
+            st.error(f"❌ {str(e)}")
+        except Exception as e:
+            # 其他错误（如磁盘已满、渲染进程异常退出）：显示错误，仍然结束进度和追踪区间；
+            # 已完成的行保存在任务目录中，可以继续任务
+            st.error(f"❌ 生成失败: {str(e)}")
+            st.exception(e)
+        reporter.finish()
+        job_span.end()
+        find_resumable_job.clear()
+        
+        # 写出本任务的追踪文件（写在任务目录中），之后的区间记录到新的追踪器
+        if tracing.enabled():
+            if job is not None:
+                st.session_state.tracer.metadata['job_id'] = job.job_id
+                st.session_state.tracer.write(os.path.join(job.job_dir, tracing.TRACE_FILENAME))
+            trace_data = st.session_state.tracer.dumps()
+            st.session_state.tracer = tracing.Tracer({'session_id': st.session_state.session_id})
+            tracing.activate(st.session_state.tracer)
+        
+        # 写出本任务的内存分析报告（写在任务目录中）
+        if profiler is not None:
+            if job is not None:
+                profiler.metadata['job_id'] = job.job_id
+                profiler.write(job.job_dir)
+            memory_report = profiler.report()
         
         # 完成提示
-        if st.session_state.generated_images:
+        if st.session_state.zip_path is not None:
             progress_bar.progress(1.0)
-            status_text.text(f"✅ 成功生成 {len(st.session_state.generated_images)} 张海报！")
-            
-            # 创建 ZIP 压缩包
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for item in st.session_state.generated_images:
-                    zip_file.writestr(
-                        item['filename'],
-                        item['buffer'].getvalue()
-                    )
-            zip_buffer.seek(0)
-            st.session_state.zip_buffer = zip_buffer
+            status_text.text(f"✅ 成功生成 {len(st.session_state.generated_files)} 张海报！（{reporter.summary()}）")
             
-            st.success("🎉 所有海报生成完成！")
+            if reporter.failures:
+                # 失败的行汇总为一张表格，并可下载错误 CSV 修改数据后重新生成
+                failed_rows = len({failure['行号'] for failure in reporter.failures})
+                st.warning(f"⚠️ {failed_rows} 行数据生成失败，失败的行未包含在 ZIP 中")
+                st.dataframe(pd.DataFrame(reporter.failures), use_container_width=True, hide_index=True)
+                st.download_button(
+                    label="⬇️ 下载错误列表 (.csv)",
+                    data=failures_csv(reporter.failures),
+                    file_name="errors.csv",
+                    mime="text/csv",
+                    use_container_width=True
+                )
+            elif st.session_state.generated_files:
+                st.success("🎉 所有海报生成完成！")
             
             # 显示生成结果
             if st.session_state.generated_images:
@@ -892,27 +1180,58 @@ if df is not None and len(df) > 0:
                 
                 # 预览第一张图片
                 st.subheader("预览（第1张海报）")
-                preview_image = st.session_state.generated_images[0]['image']
+                preview_image = st.session_state.generated_images[0]['buffer'].getvalue()
                 st.image(preview_image, use_container_width=True, caption="预览图")
-                
-                # 下载按钮
-                st.subheader("📥 下载")
-                if st.session_state.zip_buffer:
-                    st.download_button(
-                        label="⬇️ 下载所有海报 (.zip)",
-                        data=st.session_state.zip_buffer.getvalue(),
-                        file_name="posters.zip",
-                        mime="application/zip",
-                        type="primary",
-                        use_container_width=True
-                    )
-                
+            
+            # 下载按钮（继续的任务中，ZIP 也包含之前已完成的海报）；直接从任务目录的 ZIP 文件读取
+            st.subheader("📥 下载")
+            with open(st.session_state.zip_path, 'rb') as zip_file:
+                st.download_button(
+                    label="⬇️ 下载所有海报 (.zip)",
+                    data=zip_file,
+                    file_name="posters.zip",
+                    mime="application/zip",
+                    type="primary",
+                    use_container_width=True
+                )
+            
+            if st.session_state.generated_files:
                 # 显示所有生成的文件名
                 st.subheader("📋 生成的文件列表")
-                file_list = [item['filename'] for item in st.session_state.generated_images]
+                file_list = st.session_state.generated_files
                 st.write(f"共 {len(file_list)} 个文件：")
                 for filename in file_list:
                     st.write(f"- {filename}")
+            
+            # 单独下载本批次清单（下次增量生成时上传）
+            if st.session_state.batch_manifest:
+                st.download_button(
+                    label=f"⬇️ 下载本批次清单 ({MANIFEST_FILENAME})",
+                    data=st.session_state.batch_manifest,
+                    file_name=MANIFEST_FILENAME,
+                    mime="application/json",
+                    use_container_width=True
+                )
+            
+            # 性能追踪文件（在 chrome://tracing 或 ui.perfetto.dev 中打开）
+            if trace_data:
+                st.download_button(
+                    label=f"⬇️ 下载性能追踪 ({tracing.TRACE_FILENAME})",
+                    data=trace_data,
+                    file_name=tracing.TRACE_FILENAME,
+                    mime="application/json",
+                    use_container_width=True
+                )
+            
+            # 内存分析报告
+            if memory_report:
+                st.download_button(
+                    label=f"⬇️ 下载内存分析报告 ({memory_profile.REPORT_FILENAME})",
+                    data=memory_report.encode('utf-8'),
+                    file_name=memory_profile.REPORT_FILENAME,
+                    mime="text/plain",
+                    use_container_width=True
+                )
     
 elif df is None:
     st.info("👆 请上传 CSV 文件或输入文本数据开始使用")
@@ -953,3 +1272,6 @@ st.markdown("""
    - 预览第一张生成的海报
    - 点击"下载所有海报"按钮获取 ZIP 压缩包
 """)
+
+# 本次脚本运行结束
+script_span.end()
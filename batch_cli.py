@@ -0,0 +1,316 @@
+"""
+批量任务命令行工具
+列出任务目录中的批量生成任务，或继续一个被中断的任务；
+也可以将任务打包为任务规格，拆分为多个分片在多台机器上分别生成，再合并为一个 ZIP
+
+用法：
+    python batch_cli.py list
+    python batch_cli.py prune [--max-age-hours H] [--max-mb MB]   （清理旧任务）
+    python batch_cli.py resume <任务ID或任务目录> [--workers N]
+    python batch_cli.py spec --input <数据文件> --out <任务规格目录> [--template ID ...] [--size WxH ...]
+    python batch_cli.py shard <任务规格目录> <分片序号> <分片总数> --out <分片输出目录> [--by range|hash]
+    python batch_cli.py merge <任务规格目录> <分片输出目录...> --out <ZIP 路径>
+    python batch_cli.py run-local <任务规格目录> --shards N --out <目录>   （本机多进程运行所有分片并合并）
+
+    在子命令之前加 --trace 记录性能追踪，加 --memory-profile [N] 分析内存（每 N 行采样一次）
+"""
+import argparse
+import os
+import json
+import sys
+import time
+import subprocess
+import pandas as pd
+
+from core import metrics, tracing
+from core.memory_profile import DEFAULT_SAMPLE_EVERY, REPORT_FILENAME, MemoryProfiler
+from core.batch_job import (
+    DEFAULT_JOB_MAX_AGE_HOURS, DEFAULT_JOBS_MAX_MB, ENV_JOB_MAX_AGE_HOURS, ENV_JOBS_MAX_MB, JOBS_DIR,
+    BatchJob, JobMismatchError, list_jobs, prepare_templates, prune_jobs_from_env, templates_signature
+)
+from core.drawer import OUTPUT_SIZE, PosterDrawer
+from core.job_spec import SHARD_BY_RANGE, SHARD_METHODS, create_spec, load_spec, merge_shards, open_shard, spec_templates
+from core.progress import ProgressReporter, format_progress
+from core.template_manager import TemplateManager
+from core.text_parser import parse_text
+
+
+# 命令行进度输出的最短间隔（秒）
+PRINT_INTERVAL = 5
+
+
+def _print_progress(snapshot):
+    print(format_progress(snapshot, unit='行'))
+
+
+def _write_trace(job):
+    """启用了 --trace 时，把追踪文件写到任务目录"""
+    tracer = tracing.current_tracer()
+    if tracer is not None:
+        tracer.metadata['job_id'] = job.job_id
+        print(f"追踪文件: {tracer.write(os.path.join(job.job_dir, tracing.TRACE_FILENAME))}")
+
+
+def _memory_profiler(args, job):
+    """启用了 --memory-profile 时创建内存分析器"""
+    if args.memory_profile is None:
+        return None
+    return MemoryProfiler(args.memory_profile, metadata={'command': args.command, 'job_id': job.job_id})
+
+
+def _write_memory_profile(profiler, job):
+    """启用了 --memory-profile 时，把内存分析报告写到任务目录"""
+    if profiler is not None:
+        print(f"内存分析报告: {profiler.write(job.job_dir)}")
+
+
+def _open_job(job, jobs_dir):
+    """按任务ID或任务目录打开任务"""
+    job_dir = job if os.path.isdir(job) else os.path.join(jobs_dir, job)
+    return BatchJob(job_dir)
+
+
+def cmd_list(args):
+    """列出任务"""
+    jobs = list_jobs(args.jobs_dir)
+    if not jobs:
+        print("没有批量任务")
+        return 0
+    for job in jobs:
+        done, total = job.progress()
+        live = "  （正在生成）" if job.is_live() else ""
+        print(f"{job.job_id}  {job.status:<9}  {done}/{total}  创建于 {job.spec['created_at']}{live}")
+    return 0
+
+
+def cmd_prune(args):
+    """按保留时间和大小上限清理任务目录（未指定时使用环境变量或默认值）"""
+    removed = prune_jobs_from_env(args.jobs_dir, max_age_hours=args.max_age_hours, max_mb=args.max_mb)
+    for job_id in removed:
+        print(f"已删除: {job_id}")
+    print(f"清理完成：删除 {len(removed)} 个任务")
+    return 0
+
+
+def cmd_resume(args):
+    """继续被中断的任务：校验模板和输入数据一致后，跳过已完成的行继续生成"""
+    try:
+        job = _open_job(args.job, args.jobs_dir)
+    except FileNotFoundError as e:
+        print(f"错误: {e}")
+        return 1
+    holder = job.lease_holder()
+    if holder is not None:
+        print(f"错误: 任务 {job.job_id} 正在生成（{holder.get('host')} 进程 {holder.get('pid')}）")
+        return 1
+
+    drawer = PosterDrawer(font_path=job.spec['font_path'], bold_font_path=job.spec['bold_font_path'])
+    template_manager = TemplateManager()
+    try:
+        templates, folder_names, background_ids = prepare_templates(
+            template_manager, drawer, job.spec['template_ids']
+        )
+        job.verify(templates_signature(drawer, templates, folder_names, background_ids, job.spec['output_sizes']))
+        job.load_rows()
+    except (JobMismatchError, FileNotFoundError) as e:
+        print(f"错误: {e}")
+        return 1
+
+    done, total = job.progress()
+    print(f"继续任务 {job.job_id}：已完成 {done}/{total}")
+
+    profiler = _memory_profiler(args, job)
+    reporter = ProgressReporter(_print_progress, min_interval=PRINT_INTERVAL, profiler=profiler)
+    reporter.stage("生成", total, done)
+    rendered = failed = 0
+    for row_index, _, errors in job.run(drawer, templates, folder_names, workers=args.workers, build_zip=False):
+        rendered += 1
+        if errors:
+            failed += 1
+            for folder_name, error in errors:
+                print(f"警告: {folder_name + ' ' if folder_name else ''}第 {row_index + 1} 行生成失败: {error}")
+        reporter.advance()
+    reporter.stage("打包")
+    job.finish()
+    reporter.finish()
+
+    print(f"完成：本次生成 {rendered} 行，失败 {failed} 行（{reporter.summary()}）")
+    print(f"ZIP: {job.zip_path}")
+    _write_trace(job)
+    _write_memory_profile(profiler, job)
+    return 0
+
+
+def _read_rows(path):
+    """读取输入数据文件（.json 行列表、.csv、.xlsx/.xls 或每行一条记录的 .txt）"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    if extension == '.txt':
+        with open(path, 'r', encoding='utf-8') as f:
+            df, rejected_lines = parse_text(f.read())
+        for line in rejected_lines:
+            print(f"警告: 无法解析的行: {line}")
+    elif extension == '.csv':
+        df = pd.read_csv(path)
+    elif extension in ('.xlsx', '.xls'):
+        df = pd.read_excel(path)
+    else:
+        raise ValueError(f"不支持的数据文件格式: {extension}")
+    return df.to_dict('records')
+
+
+def _parse_size(text):
+    """'宽x高' -> (宽, 高)"""
+    try:
+        width, height = text.lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"尺寸格式应为 宽x高: {text}")
+
+
+def cmd_spec(args):
+    """将输入数据和模板打包为任务规格目录"""
+    try:
+        rows = _read_rows(args.input)
+        drawer = PosterDrawer()
+        output_sizes = None
+        if args.size:
+            output_sizes = [OUTPUT_SIZE] + [size for size in args.size if size != OUTPUT_SIZE]
+        spec = create_spec(args.out, rows, TemplateManager(), drawer, args.template or [], output_sizes)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}")
+        return 1
+    print(f"任务规格已创建: {args.out}（{spec['row_count']} 行，{len(spec['templates'])} 个模板）")
+    return 0
+
+
+def cmd_shard(args):
+    """生成一个分片（输出目录已存在时继续被中断的分片）"""
+    try:
+        spec = load_spec(args.spec)
+        drawer, templates, folder_names = spec_templates(args.spec, spec)
+        job = open_shard(args.spec, spec, args.index, args.count, args.out, args.by, drawer)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}")
+        return 1
+
+    done, total = job.progress()
+    print(f"分片 {args.index + 1}/{args.count}：已完成 {done}/{total}")
+    profiler = _memory_profiler(args, job)
+    reporter = ProgressReporter(_print_progress, min_interval=PRINT_INTERVAL, profiler=profiler)
+    reporter.stage("生成", total, done)
+    failed = 0
+    for row_index, _, errors in job.run(drawer, templates, folder_names, workers=args.workers, build_zip=False):
+        if errors:
+            failed += 1
+            for folder_name, error in errors:
+                print(f"警告: {folder_name + ' ' if folder_name else ''}第 {row_index + 1} 行生成失败: {error}")
+        reporter.advance()
+    reporter.finish()
+    print(f"分片 {args.index + 1}/{args.count} 完成：失败 {failed} 行（{reporter.summary()}）")
+    _write_trace(job)
+    _write_memory_profile(profiler, job)
+    return 0
+
+
+def cmd_merge(args):
+    """合并所有分片为一个 ZIP 和清单"""
+    try:
+        spec = load_spec(args.spec)
+        result = merge_shards(args.spec, spec, args.shards, args.out)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}")
+        return 1
+    print(f"合并完成：{result['posters']} 行，失败 {len(result['failed'])} 行")
+    print(f"ZIP: {args.out}")
+    return 0
+
+
+def cmd_run_local(args):
+    """在本机以独立进程运行所有分片，然后合并（验证分片流程用）"""
+    shard_dirs = [os.path.join(args.out, f"shard-{index:03d}") for index in range(args.shards)]
+    start = time.time()
+    # 启用了 --trace / --memory-profile 时，每个分片各自把追踪文件和内存分析报告写到分片输出目录
+    options = ['--trace'] if tracing.enabled() else []
+    if args.memory_profile is not None:
+        options += ['--memory-profile', str(args.memory_profile)]
+    processes = [
+        subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), *options, 'shard', args.spec, str(index), str(args.shards),
+            '--out', shard_dir, '--by', args.by, '--workers', '1'
+        ])
+        for index, shard_dir in enumerate(shard_dirs)
+    ]
+    if any(process.wait() != 0 for process in processes):
+        print("错误: 有分片生成失败")
+        return 1
+    print(f"所有分片完成，耗时 {time.time() - start:.1f} 秒")
+    return cmd_merge(argparse.Namespace(spec=args.spec, shards=shard_dirs, out=os.path.join(args.out, 'posters.zip')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PosterGenMaster 批量任务工具")
+    parser.add_argument('--jobs-dir', default=JOBS_DIR, help=f"任务目录的根目录（默认 {JOBS_DIR}）")
+    parser.add_argument('--trace', action='store_true',
+                        help=f"记录性能追踪，写到任务目录的 {tracing.TRACE_FILENAME}（Chrome trace / Perfetto 格式）")
+    parser.add_argument('--memory-profile', type=int, nargs='?', const=DEFAULT_SAMPLE_EVERY, default=None,
+                        metavar='N',
+                        help=f"分析内存（每 N 行采样一次，默认 {DEFAULT_SAMPLE_EVERY}），报告写到任务目录的 {REPORT_FILENAME}")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help="列出批量任务")
+
+    prune_parser = subparsers.add_parser('prune', help="清理旧任务（正在生成的任务不会删除）")
+    prune_parser.add_argument('--max-age-hours', type=float, default=None,
+                              help=f"删除超过多少小时没有活动的任务，0 表示不限制（默认 {ENV_JOB_MAX_AGE_HOURS} 或 {DEFAULT_JOB_MAX_AGE_HOURS}）")
+    prune_parser.add_argument('--max-mb', type=float, default=None,
+                              help=f"所有任务的总大小上限 MB，0 表示不限制（默认 {ENV_JOBS_MAX_MB} 或 {DEFAULT_JOBS_MAX_MB}）")
+
+    resume_parser = subparsers.add_parser('resume', help="继续被中断的任务")
+    resume_parser.add_argument('job', help="任务ID或任务目录")
+    resume_parser.add_argument('--workers', type=int, default=None, help="渲染进程数（默认自动）")
+
+    spec_parser = subparsers.add_parser('spec', help="创建任务规格（输入数据 + 模板快照 + 输出设置）")
+    spec_parser.add_argument('--input', required=True, help="数据文件（.json / .csv / .xlsx / .txt）")
+    spec_parser.add_argument('--out', required=True, help="任务规格目录")
+    spec_parser.add_argument('--template', action='append', help="模板ID（可重复，默认使用默认底图和配置）")
+    spec_parser.add_argument('--size', action='append', type=_parse_size, help="额外输出尺寸 宽x高（可重复）")
+
+    shard_parser = subparsers.add_parser('shard', help="生成一个分片")
+    shard_parser.add_argument('spec', help="任务规格目录")
+    shard_parser.add_argument('index', type=int, help="分片序号（从 0 开始）")
+    shard_parser.add_argument('count', type=int, help="分片总数")
+    shard_parser.add_argument('--out', required=True, help="分片输出目录")
+    shard_parser.add_argument('--by', choices=SHARD_METHODS, default=SHARD_BY_RANGE, help="分片方式（默认按行范围）")
+    shard_parser.add_argument('--workers', type=int, default=None, help="渲染进程数（默认自动）")
+
+    merge_parser = subparsers.add_parser('merge', help="合并分片为一个 ZIP 和清单")
+    merge_parser.add_argument('spec', help="任务规格目录")
+    merge_parser.add_argument('shards', nargs='+', help="所有分片的输出目录")
+    merge_parser.add_argument('--out', required=True, help="ZIP 路径")
+
+    local_parser = subparsers.add_parser('run-local', help="在本机以独立进程运行所有分片并合并")
+    local_parser.add_argument('spec', help="任务规格目录")
+    local_parser.add_argument('--shards', type=int, required=True, help="分片总数")
+    local_parser.add_argument('--out', required=True, help="输出目录（分片目录和合并后的 ZIP）")
+    local_parser.add_argument('--by', choices=SHARD_METHODS, default=SHARD_BY_RANGE, help="分片方式（默认按行范围）")
+
+    args = parser.parse_args(argv)
+    tracing.activate(tracing.Tracer({'command': args.command}) if args.trace else None)
+    metrics.serve_from_env()
+    commands = {
+        'list': cmd_list,
+        'prune': cmd_prune,
+        'resume': cmd_resume,
+        'spec': cmd_spec,
+        'shard': cmd_shard,
+        'merge': cmd_merge,
+        'run-local': cmd_run_local,
+    }
+    return commands[args.command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
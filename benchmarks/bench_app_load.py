@@ -0,0 +1,307 @@
+"""
+多用户并发负载测试
+在一个进程中用 streamlit.testing.v1.AppTest 无界面运行 app.py，模拟 N 个用户同时上传 CSV 并生成海报
+（与 Streamlit 服务器一样，所有会话在同一个进程中运行，共享渲染调度器和渲染进程）。
+测量每个会话的首张海报时间（预览图就绪）和 ZIP 就绪时间，以及整机 CPU 占用和内存（含渲染进程），
+依次运行每个并发数，输出随用户数变化的曲线报告
+
+用法：
+    python benchmarks/bench_app_load.py [--users 1,2,4,8] [--rows 20] [--out 报告目录]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import threading
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from core.memory_profile import MB, process_rss  # noqa: E402
+
+try:
+    import psutil
+except ImportError:  # psutil 是可选依赖，没有时从 /proc/stat 读取 CPU 占用
+    psutil = None
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT_DIR, 'app.py')
+JOBS_PATH = os.path.join(ROOT_DIR, 'jobs')
+
+CITIES = ['湖北', '广东', '深圳', '上海', '北京', '浙江', '江苏', '四川']
+NAMES = ['朱玉珍', '罗天颖', '白利丹', '刘保珍', '朱秀娟', '张三', '李四']
+
+# 资源采样间隔（秒）
+SAMPLE_INTERVAL = 0.5
+
+# 会话状态的轮询间隔（秒），用于记录首张海报的时间
+POLL_INTERVAL = 0.05
+
+
+# AppTest 每次运行都重新编译脚本，多个线程同时编译时 CPython 3.11 的 AST 构造器会出错；
+# 真实服务器只编译一次并缓存，这里把编译串行化，不影响测量
+_compile_lock = threading.Lock()
+_get_bytecode = ScriptCache.get_bytecode
+
+
+def _locked_get_bytecode(self, script_path):
+    with _compile_lock:
+        return _get_bytecode(self, script_path)
+
+
+ScriptCache.get_bytecode = _locked_get_bytecode
+
+# 打开页面和上传数据不计入测量，逐个会话进行（AppTest 并发运行时，控件的测试数据可能记录到其他会话中）
+_prepare_lock = threading.Lock()
+
+
+def build_csv(row_count, seed=0):
+    """生成模拟的导出 CSV（预收规保都不小于 10 万元，全部行都会生成海报）"""
+    rng = random.Random(seed)
+    lines = ['分公司,业务员姓名,预收规保,缴费期间']
+    for i in range(row_count):
+        lines.append(
+            f"{rng.choice(CITIES)},{rng.choice(NAMES)}{i},{rng.randint(10, 300) * 10000},{rng.choice([0, 3, 5, 6, 10])}"
+        )
+    return '\n'.join(lines).encode('utf-8')
+
+
+def _cpu_times():
+    """整机 CPU 时间：(忙碌, 总计)"""
+    if psutil is not None:
+        times = psutil.cpu_times()
+        idle = times.idle + getattr(times, 'iowait', 0)
+        return sum(times) - idle, sum(times)
+    with open('/proc/stat', 'r') as f:
+        values = [int(value) for value in f.readline().split()[1:]]
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    return sum(values) - idle, sum(values)
+
+
+class ResourceSampler:
+    """后台线程定期采样整机 CPU 占用和本进程（含渲染进程）的 RSS"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.cpu = []
+        self.rss = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        busy, total = _cpu_times()
+        while not self._stop.wait(self.interval):
+            new_busy, new_total = _cpu_times()
+            if new_total > total:
+                self.cpu.append((new_busy - busy) / (new_total - total) * 100)
+            busy, total = new_busy, new_total
+            rss, children_rss = process_rss()
+            if rss is not None:
+                self.rss.append(rss + (children_rss or 0))
+
+
+def run_session(user_index, csv_bytes, start_event, result, timeout):
+    """
+    模拟一个用户：打开页面、上传 CSV，所有用户就绪后同时点击生成
+
+    Args:
+        user_index: 用户序号
+        csv_bytes: 上传的 CSV 内容
+        start_event: 所有用户就绪后设置的事件
+        result: 写入测量结果的字典
+        timeout: 脚本运行超时（秒）
+    """
+    try:
+        with _prepare_lock:
+            at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+            at.run()
+            at.file_uploader[0].set_value((f"user{user_index}.csv", csv_bytes, 'text/csv'))
+            at.run()
+            next(b for b in at.button if '开始生成' in b.label).click()
+    except Exception as e:
+        result['error'] = f"准备失败: {e}"
+        return
+    finally:
+        result['ready_event'].set()
+
+    start_event.wait()
+    start = time.perf_counter()
+    session_state = at.session_state
+    finished = threading.Event()
+
+    def watch_first_poster():
+        # 生成过程中海报逐张加入会话状态，第一张就是页面上的预览图
+        while not finished.wait(POLL_INTERVAL):
+            try:
+                if session_state['generated_images']:
+                    result['first_poster'] = time.perf_counter() - start
+                    return
+            except (KeyError, RuntimeError):
+                pass
+
+    watcher = threading.Thread(target=watch_first_poster, daemon=True)
+    watcher.start()
+    try:
+        at.run()
+    except Exception as e:
+        result['error'] = f"生成失败: {e}"
+    finished.set()
+    watcher.join()
+    result['zip'] = time.perf_counter() - start
+    if 'error' not in result:
+        if at.exception:
+            result['error'] = at.exception[0].value
+        elif session_state['zip_path'] is None:
+            result['error'] = '; '.join(e.value for e in at.error) or '没有生成 ZIP'
+        else:
+            result['posters'] = len(session_state['generated_files'])
+            result.setdefault('first_poster', result['zip'])
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run_level(users, rows, timeout):
+    """
+    运行一个并发数：所有用户都上传完数据后同时开始生成
+
+    Returns:
+        dict: 本并发数的测量结果
+    """
+    start_event = threading.Event()
+    results = [{'ready_event': threading.Event()} for _ in range(users)]
+    threads = [
+        threading.Thread(
+            target=run_session, args=(index, build_csv(rows, seed=index), start_event, results[index], timeout)
+        )
+        for index in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for result in results:
+        result['ready_event'].wait()
+
+    with ResourceSampler() as sampler:
+        start = time.perf_counter()
+        start_event.set()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+
+    succeeded = [result for result in results if 'posters' in result]
+    errors = [result['error'] for result in results if 'error' in result]
+    first_posters = [result['first_poster'] for result in succeeded]
+    zips = [result['zip'] for result in succeeded]
+    posters = sum(result['posters'] for result in succeeded)
+    return {
+        'users': users,
+        'rows': rows,
+        'succeeded': len(succeeded),
+        'errors': errors,
+        'wall': wall,
+        'posters': posters,
+        'throughput': posters / wall if wall > 0 else 0,
+        'first_poster_p50': statistics.median(first_posters) if first_posters else None,
+        'first_poster_p95': _percentile(first_posters, 0.95) if first_posters else None,
+        'zip_p50': statistics.median(zips) if zips else None,
+        'zip_p95': _percentile(zips, 0.95) if zips else None,
+        'zip_max': max(zips) if zips else None,
+        'cpu_avg': statistics.mean(sampler.cpu) if sampler.cpu else None,
+        'cpu_max': max(sampler.cpu) if sampler.cpu else None,
+        'rss_peak': max(sampler.rss) if sampler.rss else None,
+    }
+
+
+def _fmt(value, unit='s'):
+    if value is None:
+        return '-'
+    if unit == 'MB':
+        return f"{value / MB:.0f}"
+    if unit == '%':
+        return f"{value:.0f}"
+    return f"{value:.1f}"
+
+
+def format_report(levels, rows):
+    """并发数 -> 测量结果的表格"""
+    lines = [
+        f"PosterGenMaster 并发负载测试（每个用户 {rows} 行，CPU {os.cpu_count()} 核）",
+        "",
+        f"{'用户':>4}{'成功':>6}{'首张 p50':>10}{'首张 p95':>10}{'ZIP p50':>10}{'ZIP p95':>10}{'ZIP 最慢':>10}"
+        f"{'吞吐 张/秒':>11}{'CPU 平均%':>10}{'CPU 峰值%':>10}{'RSS 峰值MB':>11}",
+    ]
+    for level in levels:
+        lines.append(
+            f"{level['users']:>4}{level['succeeded']:>6}{_fmt(level['first_poster_p50']):>10}"
+            f"{_fmt(level['first_poster_p95']):>10}{_fmt(level['zip_p50']):>10}{_fmt(level['zip_p95']):>10}"
+            f"{_fmt(level['zip_max']):>10}{level['throughput']:>11.2f}{_fmt(level['cpu_avg'], '%'):>10}"
+            f"{_fmt(level['cpu_max'], '%'):>10}{_fmt(level['rss_peak'], 'MB'):>11}"
+        )
+    for level in levels:
+        for error in level['errors']:
+            lines.append(f"警告: {level['users']} 个用户时有会话失败: {error}")
+    lines.append("")
+    lines.append("时间单位为秒，从所有用户同时点击生成开始计时；首张 = 首张海报生成（预览图就绪），ZIP = 可以下载")
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PosterGenMaster 多用户并发负载测试")
+    parser.add_argument('--users', default='1,2,4,8', help="逗号分隔的并发用户数（默认 1,2,4,8）")
+    parser.add_argument('--rows', type=int, default=20, help="每个用户上传的 CSV 行数（默认 20）")
+    parser.add_argument('--timeout', type=float, default=1800, help="每次脚本运行的超时秒数（默认 1800）")
+    parser.add_argument('--out', default=None, help="报告目录（写出 load_report.txt 和 load_report.json）")
+    parser.add_argument('--keep-jobs', action='store_true', help="保留测试生成的任务目录（默认删除）")
+    args = parser.parse_args()
+    user_counts = [int(value) for value in args.users.split(',') if value.strip()]
+
+    # 应用使用相对路径读取资源和写任务目录
+    os.chdir(ROOT_DIR)
+    existing_jobs = set(os.listdir(JOBS_PATH)) if os.path.isdir(JOBS_PATH) else set()
+
+    # 先运行一个小任务预热（启动渲染进程、加载字体和底图），不计入结果
+    print("预热...")
+    run_level(1, 2, args.timeout)
+
+    levels = []
+    try:
+        for users in user_counts:
+            print(f"{users} 个用户...")
+            levels.append(run_level(users, args.rows, args.timeout))
+    finally:
+        if not args.keep_jobs and os.path.isdir(JOBS_PATH):
+            for name in set(os.listdir(JOBS_PATH)) - existing_jobs:
+                shutil.rmtree(os.path.join(JOBS_PATH, name), ignore_errors=True)
+
+    report = format_report(levels, args.rows)
+    print()
+    print(report, end='')
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        with open(os.path.join(args.out, 'load_report.txt'), 'w', encoding='utf-8') as f:
+            f.write(report)
+        with open(os.path.join(args.out, 'load_report.json'), 'w', encoding='utf-8') as f:
+            json.dump({'rows': args.rows, 'cpu_count': os.cpu_count(), 'levels': levels}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"报告: {os.path.join(args.out, 'load_report.txt')}")
+
+
+if __name__ == '__main__':
+    main()
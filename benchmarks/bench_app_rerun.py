@@ -0,0 +1,95 @@
+"""
+页面重新运行耗时基准测试
+Streamlit 中每次操作控件（切换选项、调整滑块）都会从头重新运行 app.py。
+用 streamlit.testing.v1.AppTest 无界面运行 app.py，上传一份 N 行的 CSV，然后反复操作生成前的控件，
+测量每次重新运行的脚本耗时（启用性能追踪，读取 script_run 区间）和 AppTest 单次运行的总耗时
+
+用法：
+    python benchmarks/bench_app_rerun.py [--rows 10000] [--runs 20]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+from bench_app_load import build_csv  # noqa: E402
+from core import tracing  # noqa: E402
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT_DIR, 'app.py')
+
+# 目标：1 万行数据时每次重新运行的脚本耗时
+TARGET_MS = 100
+
+
+def _script_runs(at):
+    """会话追踪器中所有 script_run 区间的耗时（毫秒）"""
+    return [event['dur'] / 1000 for event in at.session_state['tracer'].events if event['name'] == 'script_run']
+
+
+def _timed_run(at, timeout):
+    start = time.perf_counter()
+    at.run(timeout=timeout)
+    elapsed = (time.perf_counter() - start) * 1000
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return elapsed, _script_runs(at)[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PosterGenMaster 页面重新运行耗时基准测试")
+    parser.add_argument('--rows', type=int, default=10000, help="上传的 CSV 行数（默认 10000）")
+    parser.add_argument('--runs', type=int, default=20, help="每种操作的重新运行次数（默认 20）")
+    parser.add_argument('--timeout', type=float, default=300, help="每次脚本运行的超时秒数（默认 300）")
+    args = parser.parse_args()
+
+    # 应用使用相对路径读取资源；重新运行的耗时从性能追踪的 script_run 区间读取
+    os.chdir(ROOT_DIR)
+    os.environ[tracing.ENV_TRACE] = '1'
+    csv_bytes = build_csv(args.rows)
+
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    first_wall, first_script = _timed_run(at, args.timeout)
+    at.file_uploader[0].set_value(('bench.csv', csv_bytes, 'text/csv'))
+    upload_wall, upload_script = _timed_run(at, args.timeout)
+    if not at.dataframe:
+        print("错误: 上传后没有显示数据预览")
+        for error in at.error:
+            print(f"  {error.value}")
+        return 1
+
+    # 重新运行：不改变任何控件；切换额外输出尺寸（多选框，与调整滑块一样触发完整的重新运行）
+    results = {'不改变控件': [], '切换额外输出尺寸': []}
+    for run in range(args.runs):
+        results['不改变控件'].append(_timed_run(at, args.timeout))
+        size_select = next(m for m in at.multiselect if '额外输出尺寸' in m.label)
+        size_select.set_value([] if run % 2 else [size_select.options[0]])
+        results['切换额外输出尺寸'].append(_timed_run(at, args.timeout))
+
+    print(f"PosterGenMaster 页面重新运行耗时（上传 {args.rows} 行 CSV）")
+    print()
+    print(f"{'操作':<16}{'脚本 p50':>10}{'脚本 最大':>10}{'总计 p50':>10}")
+    print(f"{'首次打开页面':<16}{first_script:>10.1f}{first_script:>10.1f}{first_wall:>10.1f}")
+    print(f"{'上传 CSV':<16}{upload_script:>10.1f}{upload_script:>10.1f}{upload_wall:>10.1f}")
+    for name, timings in results.items():
+        scripts = [script for _, script in timings]
+        walls = [wall for wall, _ in timings]
+        print(f"{name:<16}{statistics.median(scripts):>10.1f}{max(scripts):>10.1f}{statistics.median(walls):>10.1f}")
+    print()
+    print("单位为毫秒；脚本 = app.py 的执行耗时（script_run 区间），总计 = AppTest 单次运行（含编译脚本和测试框架开销）")
+
+    rerun_p50 = max(statistics.median(script for _, script in timings) for timings in results.values())
+    if rerun_p50 > TARGET_MS:
+        print(f"警告: 重新运行耗时 {rerun_p50:.1f} ms 超过目标 {TARGET_MS} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+文本输入解析基准测试
+生成 10 万行模拟粘贴数据，测量 core.text_parser.parse_text 的吞吐量
+
+用法：
+    python benchmarks/bench_text_parser.py [行数]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.text_parser import parse_text  # noqa: E402
+
+
+CITIES = ['湖北', '广东', '深圳', '上海', '北京', '浙江', '江苏', '四川']
+NAMES = ['朱玉珍', '罗天颖', '白利丹', '刘保珍', '朱秀娟', '张三', '李四']
+
+
+def build_sample(line_count, seed=0):
+    """生成模拟的聊天导出文本，混入约 5% 的无效行"""
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(line_count):
+        roll = rng.random()
+        city = rng.choice(CITIES)
+        name = rng.choice(NAMES)
+        amount = rng.randint(5, 300)
+        if roll < 0.03:
+            lines.append(f"{city} {name}")
+        elif roll < 0.05:
+            lines.append(f"{city} {name} 待定 趸交")
+        elif roll < 0.5:
+            lines.append(f"{city} {name} {amount}万 趸交")
+        else:
+            lines.append(f"{city} {name} {amount}万x{rng.randint(3, 20)}年")
+    return '\n'.join(lines)
+
+
+def main():
+    line_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    text = build_sample(line_count)
+
+    rounds = 5
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        df, rejected = parse_text(text)
+        best = min(best, time.perf_counter() - start)
+
+    print(f"行数: {line_count}")
+    print(f"解析成功: {len(df)}，拒绝: {len(rejected)}")
+    print(f"最佳耗时: {best * 1000:.1f} ms（{line_count / best:,.0f} 行/秒，{rounds} 轮取最优）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+"""
+海报渲染回归检查（参考图比较）
+用一组固定的数据行和模板（assets/template.jpg 默认配置 + templates/templates.json 中的所有模板），
+按网页和命令行相同的路径渲染海报：TemplateManager 读取模板 -> prepare_templates 合并配置 -> render_batch 绘制编码，
+与保存的参考图逐像素比较（允许微小的抗锯齿差异），不一致时输出 期望 / 实际 / 差异 图；
+同时检查每个模板的渲染计划使用了模板配置的固定文字（如"喜签嘉年华"），
+并测量每张海报的渲染耗时与生成参考图时的耗时比较，优化速度和画面一致性一起检查
+
+参考图提交在 benchmarks/golden 中：每个模板和尺寸保存一张基准图，每个用例只保存与基准图不同的像素
+（RGBA，其余像素透明），还原后与完整的参考图逐像素相同，仓库中的文件小得多
+
+参考图必须用生产字体（assets/NotoSansSC-Regular.ttf 和 NotoSansSC-Bold.ttf）生成：update 在缺少字体时拒绝生成，
+index.json 记录两个字体文件的摘要，check 要求当前字体和 Pillow 版本与参考图完全一致，否则直接判为失败
+
+用法：
+    python benchmarks/golden_images.py update [--dir 参考图目录]      （在参考机器上生成参考图，提交到仓库）
+    python benchmarks/golden_images.py check [--dir 参考图目录] [--out 差异图目录] [--tolerance 8] [--max-ratio 0.001]
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL  # noqa: E402
+from PIL import Image, ImageChops, ImageFilter  # noqa: E402
+
+from core.batch_job import prepare_templates  # noqa: E402
+from core.drawer import OUTPUT_SIZE, PosterDrawer  # noqa: E402
+from core.render_pool import render_batch  # noqa: E402
+from core.template_manager import TemplateManager  # noqa: E402
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOLDEN_DIR = os.path.join(ROOT_DIR, 'benchmarks', 'golden')
+INDEX_FILENAME = 'index.json'
+
+DEFAULT_BACKGROUND = os.path.join(ROOT_DIR, 'assets', 'template.jpg')
+TEMPLATES_DIR = os.path.join(ROOT_DIR, 'templates')
+TEMPLATES_JSON = os.path.join(TEMPLATES_DIR, 'templates.json')
+FONT_PATH = os.path.join(ROOT_DIR, 'assets', 'NotoSansSC-Regular.ttf')
+BOLD_FONT_PATH = os.path.join(ROOT_DIR, 'assets', 'NotoSansSC-Bold.ttf')
+
+# 固定的数据行：覆盖常见长度、趸交 / 年期、长姓名、大金额、多字单位和生僻字
+ROWS = [
+    {'城市': '湖北', '姓名': '朱玉珍', '描述': '喜签趸交保单', '金额': '20', '单位': '万'},
+    {'城市': '广东', '姓名': '罗天颖', '描述': '喜签6年期保单', '金额': '120', '单位': '万'},
+    {'城市': '深圳', '姓名': '欧阳娜娜', '描述': '喜签10年期保单', '金额': '3000', '单位': '万'},
+    {'城市': '内蒙古', '姓名': '白利丹', '描述': '喜签20年期保单', '金额': '15', '单位': '万元'},
+    {'城市': '上海', '姓名': '刘䶮', '描述': '喜签3年期保单', '金额': '88', '单位': '万'},
+]
+
+# 额外检查的输出尺寸（缩放路径）
+EXTRA_SIZES = [(540, 960)]
+
+# 默认容差：单个像素任一通道差异超过 PIXEL_TOLERANCE 视为不同，不同像素的比例不能超过 MAX_DIFF_RATIO；
+# 模糊后（忽略一个像素以内的抗锯齿位移）的最大差异不能超过 BLUR_TOLERANCE
+PIXEL_TOLERANCE = 8
+MAX_DIFF_RATIO = 0.001
+BLUR_RADIUS = 1.5
+BLUR_TOLERANCE = 24
+
+# 计时轮数（取最优）
+TIMING_ROUNDS = 3
+
+# 模板没有设置固定文字时描述中使用的文字
+DEFAULT_TEMPLATE_TEXT = '喜签'
+
+
+def _file_digest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def open_template_manager(work_dir):
+    """
+    在临时目录中打开仓库中的模板（templates.json 和底图），经 TemplateManager 迁移到模板库后读取，
+    不读写本机 templates/ 中的模板库（其中可能有本机创建的模板）
+
+    Args:
+        work_dir: 临时目录
+
+    Returns:
+        TemplateManager 对象
+    """
+    templates_dir = os.path.join(work_dir, 'templates')
+    os.makedirs(templates_dir)
+    shutil.copy2(TEMPLATES_JSON, templates_dir)
+    with open(TEMPLATES_JSON, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    for entry in entries:
+        source = os.path.join(TEMPLATES_DIR, entry['background_path'])
+        dest = os.path.join(templates_dir, entry['background_path'])
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copy2(source, dest)
+    return TemplateManager(templates_dir, reload_interval=0)
+
+
+def load_templates(template_manager, drawer):
+    """
+    参与检查的模板：默认底图和配置，以及模板库中的所有模板（与网页生成时相同，经 prepare_templates 合并配置）
+
+    Returns:
+        list: [(模板名, 模板配置或 None, (底图, 合并后的配置)), ...]，模板名用作参考图文件名前缀
+    """
+    templates = [('default', None, prepare_templates(template_manager, drawer, [])[0][0])]
+    for template in template_manager.load_templates():
+        render_templates, _, _ = prepare_templates(template_manager, drawer, [template['id']])
+        templates.append((template['id'], template, render_templates[0]))
+    return templates
+
+
+def check_template_text(drawer, templates):
+    """
+    检查每个模板的渲染计划使用了模板配置的固定文字（替换描述中的"喜签"）
+
+    Returns:
+        list: 不一致的模板 [(模板名, 期望文字, 实际文字), ...]
+    """
+    mismatches = []
+    for template_name, template, (background, config) in templates:
+        layers = ((template or {}).get('config') or {}).get('layers', {})
+        expected = layers.get('template_text', {}).get('text') or DEFAULT_TEMPLATE_TEXT
+        actual = drawer.compile(config, background).template_text
+        if actual != expected:
+            mismatches.append((template_name, expected, actual))
+    return mismatches
+
+
+def render_cases(drawer, templates, rounds=TIMING_ROUNDS, workers=1):
+    """
+    渲染所有检查用例（render_batch，每个模板的全部数据行渲染 rounds 轮，取最优耗时）
+
+    Args:
+        drawer: PosterDrawer 实例
+        templates: load_templates() 返回的模板
+        rounds: 计时轮数
+        workers: 渲染进程数（1 表示在当前进程内渲染）
+
+    Returns:
+        (images, timings): {用例名: Image}，{模板名: 每张海报的渲染（绘制 + 缩放 + 编码）毫秒数}
+    """
+    output_sizes = [OUTPUT_SIZE, *EXTRA_SIZES]
+    images = {}
+    timings = {}
+    for template_name, _, render_template in templates:
+        best = float('inf')
+        for _ in range(rounds):
+            start = time.perf_counter()
+            results = list(render_batch(drawer, [render_template], ROWS, workers, 'PNG', output_sizes=output_sizes))
+            best = min(best, time.perf_counter() - start)
+        timings[template_name] = best / len(ROWS) * 1000
+
+        for row_index, row_results in results:
+            image_bytes, error = row_results[0]
+            if error is not None:
+                raise RuntimeError(f"{template_name} 第 {row_index + 1} 行渲染失败: {error}")
+            images[f"{template_name}-{row_index}"] = Image.open(io.BytesIO(image_bytes[0])).convert('RGB')
+            if row_index == 0:
+                for (width, height), size_bytes in zip(EXTRA_SIZES, image_bytes[1:]):
+                    images[f"{template_name}-0-{width}x{height}"] = Image.open(io.BytesIO(size_bytes)).convert('RGB')
+    return images, timings
+
+
+def environment():
+    """影响渲染结果的环境：Pillow 版本和字体文件摘要"""
+    return {
+        'pillow': PIL.__version__,
+        'font': _file_digest(FONT_PATH),
+        'bold_font': _file_digest(BOLD_FONT_PATH),
+    }
+
+
+def missing_fonts():
+    """缺少的生产字体文件（缺少时 PosterDrawer 使用回退字体，渲染结果不能作为参考）"""
+    return [path for path in (FONT_PATH, BOLD_FONT_PATH) if not os.path.exists(path)]
+
+
+def _group(name):
+    """用例所属的基准图组：模板名加尺寸（同一模板同一尺寸的用例共用一张基准图）"""
+    template_name, _, rest = name.rpartition('-')
+    if 'x' in rest:
+        template_name = template_name.rpartition('-')[0]
+        return f"{template_name}-{rest}"
+    return template_name
+
+
+def save_golden(directory, images):
+    """
+    保存参考图：每组的第一张用例作为基准图，每个用例保存与基准图不同的像素（RGBA，其余透明）
+
+    Returns:
+        dict: {用例名: {'base': 基准图文件名, 'overlay': 差异像素文件名}}
+    """
+    bases = {}
+    cases = {}
+    for name, image in images.items():
+        group = _group(name)
+        if group not in bases:
+            bases[group] = image
+            image.save(os.path.join(directory, f"{group}-base.png"), format='PNG', optimize=True)
+        base = bases[group]
+        red, green, blue = ImageChops.difference(base, image).split()
+        mask = ImageChops.lighter(ImageChops.lighter(red, green), blue).point(lambda value: 255 if value else 0)
+        overlay = Image.new('RGBA', image.size, (0, 0, 0, 0))
+        overlay.paste(image, mask=mask)
+        overlay.save(os.path.join(directory, f"{name}.png"), format='PNG', optimize=True)
+        cases[name] = {'base': f"{group}-base.png", 'overlay': f"{name}.png"}
+    return cases
+
+
+def load_golden(directory, case):
+    """还原一个用例的参考图（基准图 + 差异像素）"""
+    with Image.open(os.path.join(directory, case['base'])) as base:
+        expected = base.convert('RGB')
+    with Image.open(os.path.join(directory, case['overlay'])) as overlay:
+        overlay = overlay.convert('RGBA')
+        expected.paste(overlay, mask=overlay.getchannel('A'))
+    return expected
+
+
+def compare(expected, actual, tolerance=PIXEL_TOLERANCE):
+    """
+    比较两张图
+
+    Args:
+        expected: 参考图
+        actual: 本次渲染的图
+        tolerance: 单个像素任一通道的允许差异
+
+    Returns:
+        (metrics, diff): 差异指标字典和差异图（L 模式，每个像素为各通道差异的最大值）；尺寸不同时 diff 为 None
+    """
+    if expected.size != actual.size:
+        return {'size_mismatch': f"{expected.size} != {actual.size}"}, None
+    expected = expected.convert('RGB')
+    actual = actual.convert('RGB')
+
+    diff = ImageChops.difference(expected, actual)
+    red, green, blue = diff.split()
+    diff = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+    histogram = diff.histogram()
+    pixels = expected.width * expected.height
+    changed = sum(histogram[tolerance + 1:])
+
+    blurred = ImageChops.difference(
+        expected.filter(ImageFilter.GaussianBlur(BLUR_RADIUS)), actual.filter(ImageFilter.GaussianBlur(BLUR_RADIUS))
+    )
+    return {
+        'changed_ratio': changed / pixels,
+        'max_diff': max((value for value, count in enumerate(histogram) if count), default=0),
+        'mean_diff': sum(value * count for value, count in enumerate(histogram)) / pixels,
+        'blurred_max_diff': max(high for _, high in blurred.getextrema()),
+    }, diff
+
+
+def diff_image(expected, diff, tolerance=PIXEL_TOLERANCE):
+    """差异图：参考图变暗作为背景，超出容差的像素标为红色"""
+    mask = diff.point(lambda value: 255 if value > tolerance else 0)
+    background = Image.blend(expected.convert('RGB'), Image.new('RGB', expected.size, 'black'), 0.7)
+    background.paste(Image.new('RGB', expected.size, (255, 0, 0)), mask=mask)
+    return background
+
+
+def _prepare(work_dir):
+    """打开模板并检查固定文字，返回 (drawer, templates, 是否通过)"""
+    drawer = PosterDrawer(background_path=DEFAULT_BACKGROUND, font_path=FONT_PATH, bold_font_path=BOLD_FONT_PATH)
+    templates = load_templates(open_template_manager(work_dir), drawer)
+    mismatches = check_template_text(drawer, templates)
+    for template_name, expected, actual in mismatches:
+        print(f"✗ {template_name}: 描述使用的模板文字为 {actual!r}，模板配置为 {expected!r}")
+    return drawer, templates, not mismatches
+
+
+def cmd_update(args):
+    """渲染并保存参考图"""
+    missing = missing_fonts()
+    if missing:
+        print(f"错误: 缺少生产字体 {', '.join(missing)}，用回退字体生成的参考图没有意义，不保存参考图")
+        return 1
+    with tempfile.TemporaryDirectory() as work_dir:
+        drawer, templates, text_ok = _prepare(work_dir)
+        if not text_ok:
+            print("错误: 模板文字不一致，渲染路径有问题，不保存参考图")
+            return 1
+        images, timings = render_cases(drawer, templates, args.rounds, args.workers)
+
+    if os.path.isdir(args.dir):
+        for filename in os.listdir(args.dir):
+            if filename.endswith('.png') or filename == INDEX_FILENAME:
+                os.remove(os.path.join(args.dir, filename))
+    os.makedirs(args.dir, exist_ok=True)
+    cases = save_golden(args.dir, images)
+    index = {'environment': environment(), 'timings_ms': timings, 'cases': cases}
+    with open(os.path.join(args.dir, INDEX_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    print(f"已保存 {len(cases)} 张参考图到 {args.dir}")
+    for template_name, milliseconds in timings.items():
+        print(f"  {template_name}: {milliseconds:.1f} ms/张")
+    return 0
+
+
+def cmd_check(args):
+    """与参考图比较，输出差异和耗时变化"""
+    index_path = os.path.join(args.dir, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        print(f"错误: 没有参考图（{index_path}），请先运行 update")
+        return 1
+    with open(index_path, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+
+    # 字体或 Pillow 版本不同时字形本身会变化，比较结果没有意义，直接判为失败
+    reference_environment = index['environment']
+    if not reference_environment.get('font') or not reference_environment.get('bold_font'):
+        print("错误: 参考图不是用生产字体生成的，请在装有生产字体的参考机器上重新运行 update 并提交")
+        return 1
+    current_environment = environment()
+    if current_environment != reference_environment:
+        print(f"错误: 渲染环境与参考图不同（参考 {reference_environment}，当前 {current_environment}），"
+              f"请使用相同的字体文件和 Pillow 版本检查，或在参考机器上重新运行 update")
+        return 1
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        drawer, templates, text_ok = _prepare(work_dir)
+        images, timings = render_cases(drawer, templates, args.rounds, args.workers)
+    failed = [] if text_ok else ['template_text']
+    for name, case in index['cases'].items():
+        if name not in images:
+            failed.append(name)
+            print(f"✗ {name}: 本次没有渲染此用例")
+            continue
+        expected = load_golden(args.dir, case)
+        actual = images[name]
+        metrics, diff = compare(expected, actual, args.tolerance)
+        passed = diff is not None and (
+            metrics['changed_ratio'] <= args.max_ratio and metrics['blurred_max_diff'] <= args.blur_tolerance
+        )
+        if passed:
+            print(f"✓ {name}: 不同像素 {metrics['changed_ratio']:.4%}，最大差异 {metrics['max_diff']}")
+            continue
+
+        failed.append(name)
+        if diff is None:
+            print(f"✗ {name}: 尺寸不同 {metrics['size_mismatch']}")
+            continue
+        print(f"✗ {name}: 不同像素 {metrics['changed_ratio']:.4%}，最大差异 {metrics['max_diff']}，"
+              f"模糊后最大差异 {metrics['blurred_max_diff']}")
+        os.makedirs(args.out, exist_ok=True)
+        expected.save(os.path.join(args.out, f"{name}-expected.png"))
+        actual.save(os.path.join(args.out, f"{name}-actual.png"))
+        diff_image(expected, diff, args.tolerance).save(os.path.join(args.out, f"{name}-diff.png"))
+    for name in images.keys() - index['cases'].keys():
+        print(f"提示: 新用例 {name} 没有参考图（运行 update 后提交）")
+
+    print()
+    print("渲染耗时（每张海报，绘制 + 缩放 + 编码）:")
+    for template_name, milliseconds in timings.items():
+        reference = index['timings_ms'].get(template_name)
+        if reference:
+            print(f"  {template_name}: {milliseconds:.1f} ms（参考 {reference:.1f} ms，{reference / milliseconds:.2f}x）")
+        else:
+            print(f"  {template_name}: {milliseconds:.1f} ms")
+
+    print()
+    if failed:
+        print(f"{len(failed)} 项检查不一致（共 {len(index['cases'])} 个用例），差异图已保存到 {args.out}")
+        return 1
+    print(f"全部 {len(index['cases'])} 个用例与参考图一致")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="海报渲染回归检查（参考图比较）")
+    parser.add_argument('--dir', default=GOLDEN_DIR, help="参考图目录（默认 benchmarks/golden）")
+    parser.add_argument('--rounds', type=int, default=TIMING_ROUNDS, help=f"计时轮数（默认 {TIMING_ROUNDS}）")
+    parser.add_argument('--workers', type=int, default=1, help="渲染进程数（默认 1，在当前进程内渲染）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('update', help="渲染并保存参考图")
+
+    check_parser = subparsers.add_parser('check', help="与参考图比较")
+    check_parser.add_argument('--out', default='golden-diff', help="差异图目录（默认 golden-diff）")
+    check_parser.add_argument('--tolerance', type=int, default=PIXEL_TOLERANCE,
+                              help=f"单个像素任一通道的允许差异（默认 {PIXEL_TOLERANCE}）")
+    check_parser.add_argument('--max-ratio', type=float, default=MAX_DIFF_RATIO,
+                              help=f"超出容差的像素比例上限（默认 {MAX_DIFF_RATIO}）")
+    check_parser.add_argument('--blur-tolerance', type=int, default=BLUR_TOLERANCE,
+                              help=f"模糊后的最大差异上限（默认 {BLUR_TOLERANCE}）")
+
+    args = parser.parse_args(argv)
+    commands = {
+        'update': cmd_update,
+        'check': cmd_check,
+    }
+    return commands[args.command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
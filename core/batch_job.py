@@ -0,0 +1,759 @@
+"""
+批量任务模块
+长时间运行的批量生成任务：海报和进度检查点边生成边写入任务目录，
+进程退出（内存不足、容器重启、关闭桌面应用）后可以校验模板和输入数据一致后继续，跳过已完成的行
+"""
+import os
+import json
+import uuid
+import shutil
+import socket
+import hashlib
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+
+from . import metrics
+from .batch_manifest import MANIFEST_FILENAME, build_manifest, dumps_manifest, make_entry, output_digest, render_signature
+from .drawer import OUTPUT_SIZE, merge_template_config
+from .render_pool import render_batch
+
+
+# 任务目录的根目录
+JOBS_DIR = 'jobs'
+
+JOB_FILENAME = 'job.json'
+ROWS_FILENAME = 'rows.json'
+PROGRESS_FILENAME = 'progress.jsonl'
+OUTPUTS_DIRNAME = 'outputs'
+ZIP_FILENAME = 'posters.zip'
+LEASE_FILENAME = 'lease.json'
+
+# 每写入多少行检查点同步一次磁盘
+FSYNC_INTERVAL = 50
+
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+
+# 任务租约：生成期间每隔多少秒刷新一次；超过多少秒没有刷新视为进程已退出，任务可以继续
+LEASE_HEARTBEAT_SECONDS = 10
+LEASE_TIMEOUT_SECONDS = 60
+
+# 任务目录保留策略（环境变量）：超过多少小时没有活动的任务删除；所有任务的总大小上限（MB），
+# 超过时从最久没有活动的任务开始删除；0 表示不限制
+ENV_JOB_MAX_AGE_HOURS = 'POSTERGEN_JOB_MAX_AGE_HOURS'
+ENV_JOBS_MAX_MB = 'POSTERGEN_JOBS_MAX_MB'
+DEFAULT_JOB_MAX_AGE_HOURS = 72
+DEFAULT_JOBS_MAX_MB = 2048
+
+MB = 1024 * 1024
+
+# 文件名中不支持的字符（Windows 和 Unix 系统）
+INVALID_FILENAME_CHARS = ['/', '\\', ':', '*', '?', '"', '<', '>', '|', '\n', '\r', '\t']
+
+
+class JobMismatchError(ValueError):
+    """任务的模板或输入数据与当前不一致，不能继续"""
+
+
+class JobBusyError(ValueError):
+    """任务正在其他会话或进程中生成"""
+
+
+def clean_filename(text):
+    """清理文件名中的特殊字符（替换为下划线）"""
+    if pd.isna(text):
+        return ""
+    text = str(text).strip()
+    for char in INVALID_FILENAME_CHARS:
+        text = text.replace(char, '_')
+    return text
+
+
+def poster_filename(row):
+    """
+    生成海报文件名：城市-姓名-金额万-缴费期间-保单
+
+    Args:
+        row: 行数据（字典）
+
+    Returns:
+        str: 文件名，缴费期间为 0 或空时显示"趸交"，否则显示"{缴费期间}年期"
+    """
+    city = clean_filename(row.get('城市', ''))
+    name = clean_filename(row.get('姓名', ''))
+    amount = clean_filename(row.get('金额', ''))
+
+    payment_period_raw = row.get('缴费期间', 0)
+    try:
+        payment_period_num = pd.to_numeric(payment_period_raw, errors='coerce')
+        if pd.isna(payment_period_num) or payment_period_num == 0:
+            payment_period_str = "趸交"
+        else:
+            payment_period_str = f"{int(payment_period_num)}年期"
+    except Exception:
+        payment_period_str = "趸交"
+
+    return f"{city}-{name}-{amount}万-{payment_period_str}-保单.png"
+
+
+def prepare_templates(template_manager, drawer, template_ids):
+    """
+    加载批量生成使用的模板
+
+    Args:
+        template_manager: TemplateManager 实例
+        drawer: PosterDrawer 实例（加载底图；没有模板时使用它的底图和配置）
+        template_ids: 模板ID列表
+
+    Returns:
+        (templates, folder_names, background_ids): render_batch 使用的 (底图, 配置) 列表、
+        ZIP 中每个模板的文件夹名（只有一个模板时为空字符串，文件直接放在根目录）、底图标识（摘要或路径）
+
+    Raises:
+        JobMismatchError: 模板不存在
+        FileNotFoundError: 底图文件不存在
+    """
+    templates = []
+    folder_names = []
+    background_ids = []
+    for template_id in template_ids:
+        template = template_manager.get_template(template_id)
+        if not template:
+            raise JobMismatchError(f"模板不存在: {template_id}")
+        background = drawer.load_background(template_manager.get_template_render_path(template))
+        templates.append((background, merge_template_config(template)))
+        folder_name = clean_filename(template['name']) or template_id
+        if folder_name in folder_names:
+            folder_name = f"{folder_name}-{template_id}"
+        folder_names.append(folder_name)
+        background_ids.append(
+            template.get('assets', {}).get('background', {}).get('sha256') or template.get('background_path')
+        )
+
+    if not templates:
+        templates = [(drawer.load_background(), drawer.config)]
+        folder_names = ['']
+        background_ids = [drawer.background_path]
+    if len(templates) == 1:
+        folder_names = ['']
+    return templates, folder_names, background_ids
+
+
+def templates_signature(drawer, templates, folder_names, background_ids, output_sizes=None):
+    """
+    计算模板和输出设置的签名（模板配置、底图、文件夹、输出尺寸、字体）
+
+    Returns:
+        str: 十六进制签名
+    """
+    return render_signature(
+        [config for _, config in templates], background_ids, folder_names,
+        [list(size) for size in (output_sizes or [OUTPUT_SIZE])], drawer.font_path, drawer.bold_font_path
+    )
+
+
+def dumps_rows(rows):
+    """行数据 -> JSON 字节（输入摘要基于此计算，保证保存前后一致）"""
+    return json.dumps(rows, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+
+
+def input_digest(rows):
+    """
+    计算输入数据的摘要
+
+    Args:
+        rows: 行数据列表（字典）
+
+    Returns:
+        str: 十六进制摘要
+    """
+    return hashlib.sha256(dumps_rows(rows)).hexdigest()
+
+
+@contextmanager
+def _open_atomic(path):
+    """
+    原子写入文件：流式写入同目录下的临时文件，写完后替换为目标文件，中途退出不会留下不完整的文件
+
+    Yields:
+        以二进制写入模式打开的临时文件
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _write_atomic(path, data):
+    """原子写入文件（临时文件 + 替换），中途退出不会留下不完整的文件"""
+    with _open_atomic(path) as f:
+        f.write(data)
+
+
+def _ends_with_newline(path):
+    """文件是否以换行结尾"""
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def _heartbeat(path, stop):
+    """定期更新租约文件的修改时间，直到 stop 被设置"""
+    while not stop.wait(LEASE_HEARTBEAT_SECONDS):
+        try:
+            os.utime(path)
+        except OSError:
+            # 其他进程检查是否超时时可能把租约文件短暂改名，下次再刷新
+            pass
+
+
+class BatchJob:
+    """可以中断后继续的批量生成任务（一个任务对应一个任务目录）"""
+
+    def __init__(self, job_dir):
+        """
+        打开已有的任务目录
+
+        Args:
+            job_dir: 任务目录路径
+
+        Raises:
+            FileNotFoundError: 任务目录不存在或不完整
+        """
+        self.job_dir = job_dir
+        job_path = os.path.join(job_dir, JOB_FILENAME)
+        if not os.path.exists(job_path):
+            raise FileNotFoundError(f"任务不存在: {job_dir}")
+        with open(job_path, 'r', encoding='utf-8') as f:
+            self.spec = json.load(f)
+        self._rows = None
+        self._lease_token = None
+
+    @classmethod
+    def create(cls, rows, drawer, template_ids, signature, keys, hashes, render_indices=None,
+               carried_entries=None, output_sizes=None, image_format='PNG', jobs_dir=JOBS_DIR, job_id=None,
+               shard=None):
+        """
+        创建新任务（写入任务说明和输入数据）
+
+        Args:
+            rows: 全部行数据（字典列表）
+            drawer: PosterDrawer 实例（记录字体路径）
+            template_ids: 模板ID列表
+            signature: templates_signature() 计算的签名
+            keys: 每行的行键（batch_manifest.row_keys）
+            hashes: 每行的内容哈希（batch_manifest.content_hashes）
+            render_indices: 需要生成的行索引，None 表示全部（增量生成时只包含新增和变化的行）
+            carried_entries: 不需要重新生成、直接写入清单的清单行 {行键: 清单行}
+            output_sizes: 输出尺寸列表（可选）
+            image_format: 输出图片格式
+            jobs_dir: 任务目录的根目录
+            job_id: 任务ID（即任务目录名，可选），默认按创建时间生成
+            shard: 分片信息（可选，分片任务由 job_spec 模块创建）
+
+        Returns:
+            BatchJob 对象
+        """
+        if job_id is None:
+            job_id = f"job_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        job_dir = os.path.join(jobs_dir, job_id)
+        os.makedirs(os.path.join(job_dir, OUTPUTS_DIRNAME))
+
+        rows_data = dumps_rows(rows)
+        _write_atomic(os.path.join(job_dir, ROWS_FILENAME), rows_data)
+
+        spec = {
+            'id': job_id,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'status': STATUS_RUNNING,
+            'template_ids': list(template_ids),
+            'templates_signature': signature,
+            'input_digest': hashlib.sha256(rows_data).hexdigest(),
+            'row_count': len(rows),
+            'render_indices': list(range(len(rows))) if render_indices is None else list(render_indices),
+            'keys': list(keys),
+            'hashes': list(hashes),
+            'carried_entries': carried_entries or {},
+            'output_sizes': [list(size) for size in output_sizes] if output_sizes else None,
+            'image_format': image_format,
+            'font_path': drawer.font_path,
+            'bold_font_path': drawer.bold_font_path,
+        }
+        if shard is not None:
+            spec['shard'] = shard
+        _write_atomic(
+            os.path.join(job_dir, JOB_FILENAME),
+            json.dumps(spec, ensure_ascii=False, indent=2).encode('utf-8')
+        )
+        return cls(job_dir)
+
+    @property
+    def job_id(self):
+        return self.spec['id']
+
+    @property
+    def status(self):
+        return self.spec['status']
+
+    @property
+    def zip_path(self):
+        return os.path.join(self.job_dir, ZIP_FILENAME)
+
+    @property
+    def lease_path(self):
+        return os.path.join(self.job_dir, LEASE_FILENAME)
+
+    def lease_holder(self):
+        """
+        读取有效的租约
+
+        Returns:
+            dict: 持有租约的进程 {'pid', 'host', 'acquired_at'}；没有租约或租约已超时为 None
+        """
+        try:
+            heartbeat = os.path.getmtime(self.lease_path)
+            with open(self.lease_path, 'r', encoding='utf-8') as f:
+                holder = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - heartbeat > LEASE_TIMEOUT_SECONDS:
+            return None
+        return holder
+
+    def is_live(self):
+        """任务是否正在生成（本对象或其他会话、进程持有有效的租约）"""
+        return self._lease_token is not None or self.lease_holder() is not None
+
+    @contextmanager
+    def lease(self):
+        """
+        持有任务租约：生成期间其他会话和进程不能继续同一个任务
+        租约文件由后台线程定期刷新，进程退出后超过 LEASE_TIMEOUT_SECONDS 自动失效；已经持有时可以嵌套
+
+        Raises:
+            JobBusyError: 任务正在其他会话或进程中生成
+        """
+        if self._lease_token is not None:
+            yield
+            return
+
+        holder = self.lease_holder()
+        if holder is not None:
+            raise JobBusyError(
+                f"任务 {self.job_id} 正在其他会话或进程中生成（{holder.get('host')} 进程 {holder.get('pid')}），请稍后再试"
+            )
+        token = uuid.uuid4().hex
+        self._take_over_stale_lease(token)
+        # 没有租约文件时用 O_EXCL 创建：两个进程同时创建时只有一个能成功
+        try:
+            fd = os.open(self.lease_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            raise JobBusyError(f"任务 {self.job_id} 正在其他会话或进程中生成，请稍后再试")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({
+                'pid': os.getpid(),
+                'host': socket.gethostname(),
+                'token': token,
+                'acquired_at': datetime.now().isoformat(timespec='seconds'),
+            }, f)
+        self._lease_token = token
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(self.lease_path, stop), name='job-lease', daemon=True)
+        heartbeat.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            heartbeat.join()
+            self._lease_token = None
+            try:
+                with open(self.lease_path, 'r', encoding='utf-8') as f:
+                    owned = json.load(f).get('token') == token
+                if owned:
+                    os.unlink(self.lease_path)
+            except (OSError, ValueError):
+                pass
+
+    def _take_over_stale_lease(self, token):
+        """
+        移除超时的租约文件（持有的进程已退出）
+
+        先把租约文件原子重命名为本进程独有的文件名，再检查重命名的正是之前判断为超时的那个文件
+        （inode 和修改时间不变）：多个进程同时接管时只有一个能重命名成功；如果重命名时租约已被
+        其他进程接管并重新创建，把它改回原名并报告任务正在生成。
+
+        Args:
+            token: 本进程的租约标识（用于临时文件名）
+
+        Raises:
+            JobBusyError: 租约在检查之后被其他进程接管
+        """
+        try:
+            stale = os.stat(self.lease_path)
+        except FileNotFoundError:
+            return
+        if time.time() - stale.st_mtime <= LEASE_TIMEOUT_SECONDS:
+            raise JobBusyError(f"任务 {self.job_id} 正在其他会话或进程中生成，请稍后再试")
+
+        taken_path = f"{self.lease_path}.{token}.stale"
+        try:
+            os.rename(self.lease_path, taken_path)
+        except FileNotFoundError:
+            # 其他进程已经接管（或持有者刚好退出），由随后的 O_EXCL 创建决定归属
+            return
+        taken = os.stat(taken_path)
+        if (taken.st_ino, taken.st_mtime_ns) != (stale.st_ino, stale.st_mtime_ns):
+            # 重命名到的是其他进程刚创建（或刚刷新）的有效租约：还给它
+            try:
+                os.link(taken_path, self.lease_path)
+            except FileExistsError:
+                pass
+            os.unlink(taken_path)
+            raise JobBusyError(f"任务 {self.job_id} 正在其他会话或进程中生成，请稍后再试")
+        os.unlink(taken_path)
+
+    def last_activity(self):
+        """最后一次活动的时间（任务说明、检查点或 ZIP 的最新修改时间，Unix 时间戳）"""
+        times = []
+        for filename in (JOB_FILENAME, PROGRESS_FILENAME, ZIP_FILENAME, LEASE_FILENAME):
+            try:
+                times.append(os.path.getmtime(os.path.join(self.job_dir, filename)))
+            except OSError:
+                pass
+        return max(times, default=0)
+
+    def _save_spec(self):
+        _write_atomic(
+            os.path.join(self.job_dir, JOB_FILENAME),
+            json.dumps(self.spec, ensure_ascii=False, indent=2).encode('utf-8')
+        )
+
+    def load_rows(self):
+        """
+        读取任务保存的输入数据（校验摘要）
+
+        Returns:
+            list: 行数据列表
+
+        Raises:
+            JobMismatchError: 输入数据文件被修改
+        """
+        if self._rows is None:
+            with open(os.path.join(self.job_dir, ROWS_FILENAME), 'rb') as f:
+                data = f.read()
+            if hashlib.sha256(data).hexdigest() != self.spec['input_digest']:
+                raise JobMismatchError("任务的输入数据文件已被修改，无法继续")
+            self._rows = json.loads(data)
+        return self._rows
+
+    def verify(self, signature, rows=None):
+        """
+        校验模板签名和输入数据摘要与任务一致
+
+        Args:
+            signature: 当前模板和输出设置的签名
+            rows: 当前输入数据（可选），提供时校验与任务的输入数据一致
+
+        Raises:
+            JobMismatchError: 不一致
+        """
+        if signature != self.spec['templates_signature']:
+            raise JobMismatchError("模板或输出设置已变化（模板配置、底图、字体或输出尺寸），无法继续此任务")
+        if rows is not None and input_digest(rows) != self.spec['input_digest']:
+            raise JobMismatchError("输入数据与任务不一致，无法继续此任务")
+
+    def completed(self):
+        """
+        读取检查点：已成功完成且输出文件仍然存在的行
+
+        Returns:
+            dict: 行索引 -> 该行的输出 {ZIP 内路径: 输出摘要}
+        """
+        completed = {}
+        progress_path = os.path.join(self.job_dir, PROGRESS_FILENAME)
+        if not os.path.exists(progress_path):
+            return completed
+
+        outputs_dir = os.path.join(self.job_dir, OUTPUTS_DIRNAME)
+        with open(progress_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 进程退出时写了一半的最后一行
+                    continue
+                outputs = record.get('outputs')
+                if record.get('error') or not outputs:
+                    completed.pop(record['index'], None)
+                    continue
+                if all(os.path.exists(os.path.join(outputs_dir, path)) for path in outputs):
+                    completed[record['index']] = outputs
+        return completed
+
+    def progress(self):
+        """
+        任务进度
+
+        Returns:
+            (done, total): 已完成行数和需要生成的总行数
+        """
+        return len(self.completed()), len(self.spec['render_indices'])
+
+    def run(self, drawer, templates, folder_names, workers=None, build_zip=True, renderer=render_batch):
+        """
+        生成所有未完成的行，每行完成后写入海报文件和检查点；全部完成后生成 ZIP 和清单
+
+        Args:
+            drawer: PosterDrawer 实例
+            templates: prepare_templates() 返回的 (底图, 配置) 列表（调用前应先用 verify() 校验签名）
+            folder_names: prepare_templates() 返回的文件夹名
+            workers: 渲染进程数，None 表示自动决定
+            build_zip: 完成后是否打包 ZIP（分片任务由合并步骤统一打包）
+            renderer: 渲染函数，签名与 render_pool.render_batch 相同（如调度器的 session_renderer()）
+
+        Yields:
+            (row_index, files, errors): 行索引、[(ZIP 内路径, 图片字节), ...]、[(文件夹名, 错误信息), ...]
+
+        Raises:
+            JobBusyError: 任务正在其他会话或进程中生成（生成期间持有任务租约）
+        """
+        with self.lease():
+            yield from self._run(drawer, templates, folder_names, workers, renderer)
+            self.finish(build_zip)
+
+    def _run(self, drawer, templates, folder_names, workers, renderer):
+        """生成所有未完成的行（持有任务租约时调用），参数和生成的值同 run()"""
+        rows = self.load_rows()
+        completed = self.completed()
+        pending = [index for index in self.spec['render_indices'] if index not in completed]
+        # 与上一批次相同（增量生成时跳过）或已经完成（继续任务时跳过）的行不需要重新生成
+        metrics.CACHE_REQUESTS.inc(len(rows) - len(pending), cache='render', result='hit')
+        metrics.CACHE_REQUESTS.inc(len(pending), cache='render', result='miss')
+        output_sizes = [tuple(size) for size in self.spec['output_sizes']] if self.spec['output_sizes'] else None
+        outputs_dir = os.path.join(self.job_dir, OUTPUTS_DIRNAME)
+
+        progress_path = os.path.join(self.job_dir, PROGRESS_FILENAME)
+        with open(progress_path, 'a', encoding='utf-8') as log:
+            # 上次退出时写了一半的最后一行：先换行，避免新记录接在后面
+            if log.tell() and not _ends_with_newline(progress_path):
+                log.write('\n')
+            results = renderer(
+                drawer, templates, [rows[index] for index in pending], workers,
+                self.spec['image_format'], output_sizes=output_sizes
+            )
+            for current_idx, row_results in results:
+                row_index = pending[current_idx]
+                filename = poster_filename(rows[row_index])
+
+                files = []
+                errors = []
+                for folder_name, (image_bytes, error) in zip(folder_names, row_results):
+                    if error is not None:
+                        errors.append((folder_name, error))
+                        continue
+                    # 额外尺寸放在以尺寸命名的子文件夹中
+                    if output_sizes is None:
+                        sized = [('', image_bytes)]
+                    else:
+                        sized = [('', image_bytes[0])] + [
+                            (f"{width}x{height}", size_bytes)
+                            for (width, height), size_bytes in zip(output_sizes[1:], image_bytes[1:])
+                        ]
+                    for size_folder, size_bytes in sized:
+                        path = '/'.join(part for part in (folder_name, size_folder, filename) if part)
+                        files.append((path, size_bytes))
+
+                # 先写海报文件，再写检查点，检查点中记录的行一定已经完整写入
+                for path, data in files:
+                    _write_atomic(os.path.join(outputs_dir, path), data)
+                record = {'index': row_index}
+                if errors:
+                    record['error'] = '; '.join(f"{folder} {error}".strip() for folder, error in errors)
+                else:
+                    record['outputs'] = {path: output_digest(data) for path, data in files}
+                log.write(json.dumps(record, ensure_ascii=False) + '\n')
+                log.flush()
+                if (current_idx + 1) % FSYNC_INTERVAL == 0:
+                    os.fsync(log.fileno())
+
+                yield row_index, files, errors
+
+            os.fsync(log.fileno())
+
+    def manifest(self):
+        """
+        根据检查点生成本任务的完整清单（失败的行不写入清单）
+
+        Returns:
+            dict: 批次清单
+        """
+        completed = self.completed()
+        rows = self.load_rows()
+        entries = dict(self.spec['carried_entries'])
+        for row_index, outputs in completed.items():
+            key = self.spec['keys'][row_index]
+            entries[key] = make_entry(self.spec['hashes'][row_index], poster_filename(rows[row_index]), outputs)
+        return build_manifest(self.spec['templates_signature'], self.spec['keys'], entries)
+
+    def finish(self, build_zip=True):
+        """
+        将已完成的海报和清单打包为 ZIP，并标记任务完成
+
+        Args:
+            build_zip: 是否打包 ZIP，False 时只标记任务完成
+
+        Returns:
+            str: ZIP 文件路径（不打包时为 None）
+        """
+        if not build_zip:
+            self._mark_completed()
+            return None
+
+        start = time.perf_counter()
+        completed = self.completed()
+        outputs_dir = os.path.join(self.job_dir, OUTPUTS_DIRNAME)
+
+        # ZIP 直接流式写入任务目录中的临时文件，不在内存中保留整个压缩包
+        with _open_atomic(self.zip_path) as f:
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                for row_index in self.spec['render_indices']:
+                    for path in completed.get(row_index, ()):
+                        zip_file.write(os.path.join(outputs_dir, path), path)
+                zip_file.writestr(MANIFEST_FILENAME, dumps_manifest(self.manifest()))
+        metrics.ZIP_SECONDS.observe(time.perf_counter() - start)
+        metrics.ZIP_BYTES.inc(os.path.getsize(self.zip_path))
+        self._mark_completed()
+        return self.zip_path
+
+    def _mark_completed(self):
+        """标记任务完成"""
+        self.spec['status'] = STATUS_COMPLETED
+        self.spec['completed_at'] = datetime.now().isoformat(timespec='seconds')
+        self._save_spec()
+
+
+def list_jobs(jobs_dir=JOBS_DIR, status=None, include_live=True):
+    """
+    列出任务（按创建时间从新到旧）
+
+    Args:
+        jobs_dir: 任务目录的根目录
+        status: 只列出指定状态的任务（可选）
+        include_live: 是否包括正在其他会话或进程中生成的任务
+
+    Returns:
+        list: BatchJob 对象列表
+    """
+    if not os.path.isdir(jobs_dir):
+        return []
+    jobs = []
+    for name in sorted(os.listdir(jobs_dir), reverse=True):
+        try:
+            job = BatchJob(os.path.join(jobs_dir, name))
+        except (FileNotFoundError, ValueError):
+            continue
+        if status is not None and job.status != status:
+            continue
+        if include_live or not job.is_live():
+            jobs.append(job)
+    return jobs
+
+
+def _dir_size(path):
+    """目录中所有文件的总字节数"""
+    total = 0
+    for directory, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(directory, filename))
+            except OSError:
+                pass
+    return total
+
+
+def prune_jobs(jobs_dir=JOBS_DIR, max_age_seconds=None, max_bytes=None, keep=()):
+    """
+    清理任务目录：删除超过保留时间没有活动的任务（包括已完成和被中断的），
+    总大小超过上限时从最久没有活动的任务开始删除；正在生成的任务不会被删除
+
+    Args:
+        jobs_dir: 任务目录的根目录
+        max_age_seconds: 保留时间（秒），None 表示不限制
+        max_bytes: 所有任务的总大小上限（字节），None 表示不限制
+        keep: 不删除的任务ID
+
+    Returns:
+        list: 删除的任务ID
+    """
+    now = time.time()
+    jobs = sorted(
+        ((job.last_activity(), job) for job in list_jobs(jobs_dir)),
+        key=lambda item: item[0]
+    )
+    sizes = {job.job_id: _dir_size(job.job_dir) for _, job in jobs}
+    total = sum(sizes.values())
+
+    removed = []
+    for activity, job in jobs:
+        if job.job_id in keep or job.is_live():
+            continue
+        expired = max_age_seconds is not None and now - activity > max_age_seconds
+        over_limit = max_bytes is not None and total > max_bytes
+        if not (expired or over_limit):
+            continue
+        shutil.rmtree(job.job_dir, ignore_errors=True)
+        total -= sizes[job.job_id]
+        removed.append(job.job_id)
+    return removed
+
+
+def _env_number(name, default):
+    """环境变量中的非负数，未设置或无效时使用默认值"""
+    value = os.environ.get(name, '').strip()
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        print(f"警告: {name}={value!r} 不是数字，使用默认值 {default}")
+        return default
+
+
+def prune_jobs_from_env(jobs_dir=JOBS_DIR, keep=(), max_age_hours=None, max_mb=None):
+    """
+    按环境变量设置的保留时间（POSTERGEN_JOB_MAX_AGE_HOURS）和总大小上限（POSTERGEN_JOBS_MAX_MB）清理任务目录
+
+    Args:
+        jobs_dir: 任务目录的根目录
+        keep: 不删除的任务ID
+        max_age_hours: 保留时间（小时），None 表示使用环境变量或默认值，0 表示不限制
+        max_mb: 总大小上限（MB），None 表示使用环境变量或默认值，0 表示不限制
+
+    Returns:
+        list: 删除的任务ID
+    """
+    if max_age_hours is None:
+        max_age_hours = _env_number(ENV_JOB_MAX_AGE_HOURS, DEFAULT_JOB_MAX_AGE_HOURS)
+    if max_mb is None:
+        max_mb = _env_number(ENV_JOBS_MAX_MB, DEFAULT_JOBS_MAX_MB)
+    return prune_jobs(
+        jobs_dir,
+        max_age_seconds=max_age_hours * 3600 or None,
+        max_bytes=int(max_mb * MB) or None,
+        keep=keep
+    )
@@ -0,0 +1,192 @@
+"""
+批次清单模块
+每个批次生成一份清单（行键、内容哈希、文件名、输出摘要），
+增量模式下将新输入与上一批次的清单比较，只重新生成新增或内容有变化的行
+"""
+import json
+import hashlib
+from datetime import datetime
+
+
+MANIFEST_VERSION = 1
+
+# ZIP 中清单文件的名称
+MANIFEST_FILENAME = 'manifest.json'
+
+# 标识"同一条记录"的字段（同一人同一缴费期间的保单，金额变化视为内容变化）
+KEY_FIELDS = ('城市', '姓名', '缴费期间')
+
+# 影响海报内容的字段
+CONTENT_FIELDS = ('城市', '姓名', '描述', '金额', '单位')
+
+# 字段分隔符（不会出现在正常文字中）
+FIELD_SEPARATOR = '\x1f'
+
+
+def render_signature(*parts):
+    """
+    计算渲染设置的签名（模板配置、底图、输出尺寸等），签名变化时所有行都需要重新生成
+
+    Args:
+        *parts: 可 JSON 序列化的渲染设置
+
+    Returns:
+        str: 十六进制签名
+    """
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def row_keys(rows):
+    """
+    计算每行的行键（同一批次中重复的行键追加出现序号，保证唯一）
+
+    Args:
+        rows: 行数据列表（字典）
+
+    Returns:
+        list: 行键列表，与 rows 顺序一致
+    """
+    keys = []
+    seen = {}
+    for row in rows:
+        key = FIELD_SEPARATOR.join(str(row.get(field, '')) for field in KEY_FIELDS)
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        keys.append(f"{key}{FIELD_SEPARATOR}{count}" if count else key)
+    return keys
+
+
+def content_hashes(rows):
+    """
+    计算每行影响海报内容的字段的哈希
+
+    Args:
+        rows: 行数据列表（字典）
+
+    Returns:
+        list: 十六进制哈希列表，与 rows 顺序一致
+    """
+    blake2b = hashlib.blake2b
+    return [
+        blake2b(
+            FIELD_SEPARATOR.join(str(row.get(field, '')) for field in CONTENT_FIELDS).encode('utf-8'),
+            digest_size=16
+        ).hexdigest()
+        for row in rows
+    ]
+
+
+def output_digest(data):
+    """计算输出文件内容的摘要"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def diff_manifest(prior, rows, signature):
+    """
+    将新输入与上一批次的清单比较
+
+    Args:
+        prior: 上一批次的清单（load_manifest 的返回值），None 表示没有上一批次
+        rows: 新输入的行数据列表（字典）
+        signature: 本次的渲染设置签名
+
+    Returns:
+        dict: {
+            'keys': 每行的行键, 'hashes': 每行的内容哈希,
+            'new': 新增行的索引, 'changed': 内容变化行的索引, 'unchanged': 未变化行的索引,
+            'removed': 上一批次中有、本次没有的行键,
+            'signature_changed': 渲染设置是否变化（变化时所有已有行都算作 changed）
+        }
+    """
+    keys = row_keys(rows)
+    hashes = content_hashes(rows)
+    prior_entries = prior['rows'] if prior else {}
+    signature_changed = prior is not None and prior.get('render_signature') != signature
+
+    new, changed, unchanged = [], [], []
+    for index, (key, content_hash) in enumerate(zip(keys, hashes)):
+        entry = prior_entries.get(key)
+        if entry is None:
+            new.append(index)
+        elif signature_changed or entry['content_hash'] != content_hash:
+            changed.append(index)
+        else:
+            unchanged.append(index)
+
+    current = set(keys)
+    removed = [key for key in prior_entries if key not in current]
+
+    return {
+        'keys': keys,
+        'hashes': hashes,
+        'new': new,
+        'changed': changed,
+        'unchanged': unchanged,
+        'removed': removed,
+        'signature_changed': signature_changed,
+    }
+
+
+def make_entry(content_hash, filename, outputs):
+    """
+    构建清单中的一行
+
+    Args:
+        content_hash: 内容哈希
+        filename: 海报文件名
+        outputs: 该行所有输出文件 {ZIP 内路径: 输出摘要}
+
+    Returns:
+        dict: 清单行
+    """
+    return {'content_hash': content_hash, 'filename': filename, 'outputs': outputs}
+
+
+def build_manifest(signature, keys, entries):
+    """
+    构建完整清单
+
+    Args:
+        signature: 渲染设置签名
+        keys: 按输入顺序排列的行键
+        entries: 行键 -> 清单行（make_entry 的返回值）
+
+    Returns:
+        dict: 清单（行键缺少对应清单行的行，如生成失败的行，不写入清单）
+    """
+    return {
+        'version': MANIFEST_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'render_signature': signature,
+        'rows': {key: entries[key] for key in keys if key in entries},
+    }
+
+
+def dumps_manifest(manifest):
+    """清单 -> JSON 字节"""
+    return json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def load_manifest(data):
+    """
+    读取清单
+
+    Args:
+        data: JSON 字节或字符串
+
+    Returns:
+        dict: 清单
+
+    Raises:
+        ValueError: 不是有效的清单文件
+    """
+    try:
+        manifest = json.loads(data)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"清单文件格式不正确: {str(e)}")
+
+    if (not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION
+            or not isinstance(manifest.get('rows'), dict)):
+        raise ValueError("不是有效的批次清单文件")
+    return manifest
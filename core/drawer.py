@@ -2,8 +2,133 @@
 PosterGenMaster - 海报绘制核心逻辑
 PosterDrawer 类：负责在底图上绘制文字，生成海报
 """
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 import os
+import copy
+
+from . import metrics, tracing
+from .font_chain import FontChain
+from .layout_check import GlyphChecker, check_layout, fit_report
+from .raw_image import RAW_EXTENSION, open_raw_image
+from .render_plan import TextMeasurer, compile_plan, execute, scale_outputs
+
+
+# 输出海报尺寸（手机屏幕大小）
+OUTPUT_SIZE = (1080, 1920)
+
+# 默认配置字典 - 方便后续微调坐标和颜色
+# 整体往上移动，Y坐标都减少了
+DEFAULT_CONFIG = {
+    'layers': {
+        'template_text': {  # 模板固定文字（如"喜签嘉年华"）
+            'text': '喜签',  # 文字内容，默认为"喜签"
+            'color': '#FFEDB5',  # 浅金色
+            'size': 100,  # 字号
+            'y': 200,  # Y坐标
+            'align': 'center',
+            'bold': True  # 使用粗体
+        },
+        'city_name': {  # 城市+姓名（同一行）
+            'color': '#FFEDB5',  # 浅金色
+            'size': 120,  # 字号+20
+            'y': 415,  # Y坐标-15（往上移动）
+            'spacing': 35,  # 城市和姓名之间的间距（增大）
+            'align': 'center',
+            'bold': True  # 使用粗体
+        },
+        'desc': {
+            'color': '#FFEDB5',  # 浅金色（统一颜色）
+            'size': 50,
+            'y': 620,  # Y坐标+20（往下移动）
+            'align': 'center',
+            'bold': True  # 使用粗体
+        },
+        'amount': {
+            'color': '#FFEDB5',  # 浅金色（统一颜色）
+            'size': 220,
+            'y': 750,  # 往上移动
+            'align': 'center',
+            'bold': True  # 使用粗体
+        },
+        'unit': {
+            'color': '#FFEDB5',  # 浅金色（统一颜色）
+            'size': 80,
+            'y': 750,  # 与金额底部对齐，实际会动态调整
+            'spacing_x': 20,  # 金额和单位之间的水平间距
+            'spacing_y': 10,  # 金额和单位之间的垂直间距（单位在右下角）
+            'offset_y': 60,  # 单位Y坐标的偏移量（正值往下移动，负值往上移动）
+            'align': 'right_bottom',  # 单位在金额右下角
+            'bold': True  # 使用粗体
+        }
+    }
+}
+
+# 每个绘制器最多缓存的底图数量（多模板批量渲染时每个模板一张）
+BACKGROUND_CACHE_LIMIT = 8
+
+# 模板配置中可合并的图层（template_text 只用于替换描述文字，模板中有时才保留）
+TEMPLATE_LAYERS = ('city_name', 'desc', 'amount', 'unit')
+
+# 图层配置中以像素为单位的字段（底图等比缩放时按相同比例缩放）
+LAYER_PIXEL_KEYS = ('size', 'y', 'spacing', 'spacing_x', 'spacing_y', 'offset_y', 'max_width', 'min_size')
+
+
+def merge_template_config(template_config):
+    """
+    将模板中保存的配置与默认配置合并（模板中的值覆盖默认值，确保所有必需的图层都存在）
+    
+    Args:
+        template_config: 模板配置字典，包含 'config' 字段（可选）
+    
+    Returns:
+        dict: 完整的绘制配置
+    """
+    template_config = template_config.get('config') or {}
+    template_layers = template_config.get('layers', {})
+    default_layers = DEFAULT_CONFIG['layers']
+    config = {
+        'layers': {
+            layer_name: {**default_layers[layer_name], **template_layers.get(layer_name, {})}
+            for layer_name in TEMPLATE_LAYERS
+        }
+    }
+    
+    # 模板固定文字（如"喜签嘉年华"）替换描述中的"喜签"，合并时不能丢失
+    if 'template_text' in template_layers:
+        config['layers']['template_text'] = {**default_layers['template_text'], **template_layers['template_text']}
+    
+    # 模板配置的回退字体（首选字体缺字时按顺序使用）
+    font_fallbacks = template_config.get('font_fallbacks')
+    if font_fallbacks:
+        config['font_fallbacks'] = list(font_fallbacks)
+    return config
+
+
+def scale_template_config(template_config, factor):
+    """
+    按比例缩放模板配置中图层的坐标、间距和字号（底图被等比缩小时保持文字与底图的相对位置和大小）
+    
+    模板中没有设置的图层和字段先使用默认配置的值再缩放，缩放后的配置与缩放前在原图上的排版一致。
+    
+    Args:
+        template_config: 模板的配置字典（模板的 'config' 字段），可以为 None
+        factor: 缩放比例（如底图从 2160 像素宽缩小到 1080 像素宽时为 0.5）
+    
+    Returns:
+        dict: 缩放后的配置（新字典，不修改传入的配置）
+    """
+    config = copy.deepcopy(template_config or {})
+    template_layers = config.get('layers', {})
+    layers = {}
+    for layer_name in [*DEFAULT_CONFIG['layers'], *template_layers]:
+        layer = {**DEFAULT_CONFIG['layers'].get(layer_name, {}), **template_layers.get(layer_name, {})}
+        for key in LAYER_PIXEL_KEYS:
+            # max_width 为 'auto' 时按画布宽度计算，不需要缩放
+            if isinstance(layer.get(key), (int, float)) and not isinstance(layer[key], bool):
+                layer[key] = max(1, round(layer[key] * factor)) if key == 'size' else round(layer[key] * factor)
+        layers[layer_name] = layer
+    config['layers'] = layers
+    return config
 
 
 class PosterDrawer:
@@ -22,63 +147,50 @@ class PosterDrawer:
         self.font_path = font_path
         self.bold_font_path = bold_font_path
         
-        # 默认配置字典 - 方便后续微调坐标和颜色
-        # 整体往上移动，Y坐标都减少了
-        default_config = {
-            'layers': {
-                'template_text': {  # 模板固定文字（如"喜签嘉年华"）
-                    'text': '喜签',  # 文字内容，默认为"喜签"
-                    'color': '#FFEDB5',  # 浅金色
-                    'size': 100,  # 字号
-                    'y': 200,  # Y坐标
-                    'align': 'center',
-                    'bold': True  # 使用粗体
-                },
-                'city_name': {  # 城市+姓名（同一行）
-                    'color': '#FFEDB5',  # 浅金色
-                    'size': 120,  # 字号+20
-                    'y': 415,  # Y坐标-15（往上移动）
-                    'spacing': 35,  # 城市和姓名之间的间距（增大）
-                    'align': 'center',
-                    'bold': True  # 使用粗体
-                },
-                'desc': {
-                    'color': '#FFEDB5',  # 浅金色（统一颜色）
-                    'size': 50,
-                    'y': 620,  # Y坐标+20（往下移动）
-                    'align': 'center',
-                    'bold': True  # 使用粗体
-                },
-                'amount': {
-                    'color': '#FFEDB5',  # 浅金色（统一颜色）
-                    'size': 220,
-                    'y': 750,  # 往上移动
-                    'align': 'center',
-                    'bold': True  # 使用粗体
-                },
-                'unit': {
-                    'color': '#FFEDB5',  # 浅金色（统一颜色）
-                    'size': 80,
-                    'y': 750,  # 与金额底部对齐，实际会动态调整
-                    'spacing_x': 20,  # 金额和单位之间的水平间距
-                    'spacing_y': 10,  # 金额和单位之间的垂直间距（单位在右下角）
-                    'offset_y': 60,  # 单位Y坐标的偏移量（正值往下移动，负值往上移动）
-                    'align': 'right_bottom',  # 单位在金额右下角
-                    'bold': True  # 使用粗体
-                }
-            }
-        }
+        # 已解码的背景底图缓存：路径 -> (mtime_ns, Image)
+        self._background_cache = {}
+        # 直接提供的底图（如共享内存中的底图），设置后不再读取 background_path
+        self._background_image = None
+        # 字体回退链缓存：(是否粗体, 回退字体路径元组) -> FontChain
+        self._font_chains = {}
+        # 渲染计划缓存：(底图, 配置快照, RenderPlan)
+        self._plan_cache = None
+        # 排版预检查的字形检查缓存
+        self._glyph_checker = GlyphChecker()
+        # 文字测量缓存（同一绘制器的所有渲染计划共享）
+        self._measurer = TextMeasurer()
         
         # 如果提供了模板配置，使用模板配置
         if template_config:
             self.load_from_template(template_config)
         else:
             self.background_path = background_path
-            self.config = default_config
+            self.config = copy.deepcopy(DEFAULT_CONFIG)
+    
+    def get_font_chain(self, bold=False, font_fallbacks=()):
+        """
+        获取字体回退链（同一组合只构建一次，字符覆盖索引缓存在磁盘上）
+        
+        链的顺序为：首选字体（粗体或常规）、模板配置的回退字体、常规字体（粗体缺字时使用）。
+        不存在的字体文件会被跳过，全部不存在时使用默认字体。
+        
+        Args:
+            bold: 是否以粗体字体为首选，默认为 False
+            font_fallbacks: 回退字体路径（按优先级排列）
+        
+        Returns:
+            FontChain 对象
+        """
+        key = (bool(bold), tuple(font_fallbacks))
+        chain = self._font_chains.get(key)
+        if chain is None:
+            primary = self.bold_font_path if bold else self.font_path
+            chain = self._font_chains[key] = FontChain([primary, *key[1], self.font_path])
+        return chain
     
     def get_font(self, size, bold=False):
         """
-        获取字体对象，如果字体文件不存在则使用默认字体
+        获取字体对象（同一字号只加载一次）；首选字体文件不存在时依次使用常规字体和默认字体
         
         Args:
             size: 字体大小
@@ -87,16 +199,7 @@ class PosterDrawer:
         Returns:
             ImageFont 对象
         """
-        font_file = self.bold_font_path if bold else self.font_path
-        try:
-            if os.path.exists(font_file):
-                return ImageFont.truetype(font_file, size)
-            else:
-                # 使用默认字体
-                return ImageFont.load_default()
-        except Exception as e:
-            print(f"警告: 无法加载字体 {font_file}: {e}，使用默认字体")
-            return ImageFont.load_default()
+        return self.get_font_chain(bold).font(0, size)
     
     def get_text_bbox(self, draw, text, font):
         """
@@ -112,22 +215,116 @@ class PosterDrawer:
         """
         return draw.textbbox((0, 0), text, font=font)
     
-    def load_background(self):
+    def load_background(self, background_path=None):
         """
-        加载背景底图
+        加载背景底图（解码结果按路径和修改时间缓存，同一底图只解码一次）
+        
+        如果底图是原始像素格式（.raw），通过 mmap 直接映射，不需要解码。
+        
+        Args:
+            background_path: 底图路径（可选），默认为当前模板的底图；用于多模板批量渲染
         
         Returns:
-            PIL Image 对象
+            PIL Image 对象（共享的缓存对象，请复制后再修改）
         
         Raises:
             FileNotFoundError: 如果底图文件不存在
         """
-        if not os.path.exists(self.background_path):
+        if background_path is None:
+            if self._background_image is not None:
+                return self._background_image
+            background_path = self.background_path
+        
+        try:
+            mtime_ns = os.stat(background_path).st_mtime_ns
+        except OSError:
             raise FileNotFoundError(
-                f"底图文件不存在: {self.background_path}\n"
+                f"底图文件不存在: {background_path}\n"
                 f"请确保在 assets/ 目录下放置 template.jpg 文件"
             )
-        return Image.open(self.background_path)
+        
+        cached = self._background_cache.get(background_path)
+        if cached is not None and cached[0] == mtime_ns:
+            metrics.cache_hit('background', True)
+            return cached[1]
+        metrics.cache_hit('background', False)
+        
+        with tracing.span('load_background', path=background_path):
+            if background_path.endswith(RAW_EXTENSION):
+                base_image = open_raw_image(background_path)
+            else:
+                base_image = Image.open(background_path)
+                base_image.load()
+        self._background_cache.pop(background_path, None)
+        if len(self._background_cache) >= BACKGROUND_CACHE_LIMIT:
+            # 淘汰最早加载的底图
+            del self._background_cache[next(iter(self._background_cache))]
+        self._background_cache[background_path] = (mtime_ns, base_image)
+        return base_image
+    
+    def set_background_image(self, image):
+        """
+        直接设置底图（不从文件加载），用于渲染进程挂载共享内存中的底图
+        
+        Args:
+            image: PIL Image 对象，None 表示恢复从 background_path 加载
+        """
+        self._background_image = image
+    
+    def compile(self, config=None, background=None):
+        """
+        将配置编译为渲染计划（字体、颜色、坐标等一次性解析完成）
+        
+        Args:
+            config: 配置字典，如果为 None 则使用当前配置
+            background: 底图（PIL Image，可选），默认为当前底图；用于多模板共用一个绘制器
+        
+        Returns:
+            RenderPlan 对象
+        """
+        if config is None:
+            config = self.config
+        if background is None:
+            background = self.load_background()
+        with tracing.span('compile'):
+            return compile_plan(config, self.config['layers'], background, self.get_font_chain, OUTPUT_SIZE)
+    
+    def execute(self, plan, data_row):
+        """
+        按渲染计划绘制海报
+        
+        Args:
+            plan: compile() 返回的 RenderPlan 对象
+            data_row: 字典或 pandas Series，包含 '城市', '姓名', '描述', '金额', '单位' 等字段
+        
+        Returns:
+            绘制好的 Image 对象
+        """
+        return execute(plan, data_row, self._measurer)
+    
+    def get_plan(self, config=None):
+        """
+        获取配置对应的渲染计划（配置内容和底图不变时复用上次编译的结果）
+        
+        Args:
+            config: 配置字典，如果为 None 则使用当前配置
+        
+        Returns:
+            RenderPlan 对象
+        """
+        if config is None:
+            config = self.config
+        background = self.load_background()
+        
+        cache = self._plan_cache
+        if cache is not None and cache[0] is background and cache[1] == config:
+            metrics.cache_hit('plan', True)
+            return cache[2]
+        metrics.cache_hit('plan', False)
+        
+        plan = compile_plan(config, self.config['layers'], background, self.get_font_chain, OUTPUT_SIZE)
+        self._plan_cache = (background, copy.deepcopy(config), plan)
+        return plan
     
     def draw(self, data_row, config=None):
         """
@@ -140,144 +337,52 @@ class PosterDrawer:
         Returns:
             绘制好的 Image 对象
         """
-        # 加载底图
-        base_image = self.load_background()
+        return execute(self.get_plan(config), data_row, self._measurer)
+    
+    def draw_sizes(self, data_row, output_sizes, config=None):
+        """
+        绘制一次海报，同时生成多个输出尺寸（如朋友圈预览图、缩略图）
         
-        # 使用传入的配置或默认配置
-        if config is None:
-            config = self.config
+        Args:
+            data_row: 字典或 pandas Series，包含 '城市', '姓名', '描述', '金额', '单位' 等字段
+            output_sizes: 输出尺寸列表 [(宽, 高), ...]
+            config: 配置字典，如果为 None 则使用默认配置
         
-        # 创建底图的副本，避免修改原图
-        img = base_image.copy()
-        draw = ImageDraw.Draw(img)
-        
-        # 获取画布尺寸
-        canvas_width = img.width
-        canvas_height = img.height
-        center_x = canvas_width // 2
-        
-        layers_config = config.get('layers', self.config['layers'])
-        
-        # 获取模板文字内容（用于替换描述中的"喜签"）
-        template_text = '喜签'  # 默认值
-        if 'template_text' in layers_config:
-            template_text_config = layers_config['template_text']
-            template_text = template_text_config.get('text', '')
-            # 如果文字内容为空，使用默认值"喜签"
-            if not template_text:
-                template_text = '喜签'
-        
-        # 1. 绘制城市+姓名（同一行，居中，粗体）
-        city = str(data_row.get('城市', ''))
-        name = str(data_row.get('姓名', ''))
-        city_name_config = layers_config['city_name']
-        city_name_font = self.get_font(city_name_config['size'], bold=city_name_config.get('bold', False))
-        
-        # 计算城市和姓名的总宽度
-        city_bbox = self.get_text_bbox(draw, city, city_name_font)
-        name_bbox = self.get_text_bbox(draw, name, city_name_font)
-        city_width = city_bbox[2] - city_bbox[0]
-        name_width = name_bbox[2] - name_bbox[0]
-        spacing = city_name_config.get('spacing', 20)
-        total_width = city_width + spacing + name_width
-        
-        # 计算起始X坐标（居中）
-        start_x = center_x - total_width // 2
-        
-        # 绘制城市
-        city_x = start_x
-        draw.text(
-            (city_x, city_name_config['y']),
-            city,
-            fill=city_name_config['color'],
-            font=city_name_font
-        )
-        
-        # 绘制姓名
-        name_x = start_x + city_width + spacing
-        draw.text(
-            (name_x, city_name_config['y']),
-            name,
-            fill=city_name_config['color'],
-            font=city_name_font
-        )
-        
-        # 2. 绘制描述（居中）
-        desc = str(data_row.get('描述', ''))
-        # 如果描述中包含"喜签"，则用模板文字内容替换
-        if '喜签' in desc:
-            desc = desc.replace('喜签', template_text)
-        desc_config = layers_config['desc']
-        desc_font = self.get_font(desc_config['size'], bold=desc_config.get('bold', False))
-        desc_bbox = self.get_text_bbox(draw, desc, desc_font)
-        desc_width = desc_bbox[2] - desc_bbox[0]
-        desc_x = center_x - desc_width // 2
-        draw.text(
-            (desc_x, desc_config['y']),
-            desc,
-            fill=desc_config['color'],
-            font=desc_font
-        )
-        
-        # 3. 先计算金额和单位的尺寸（用于整体居中）
-        amount = str(data_row.get('金额', ''))
-        amount_config = layers_config['amount']
-        amount_font = self.get_font(amount_config['size'], bold=amount_config.get('bold', False))
-        amount_bbox = self.get_text_bbox(draw, amount, amount_font)
-        amount_width = amount_bbox[2] - amount_bbox[0]
-        amount_height = amount_bbox[3] - amount_bbox[1]
-        
-        unit = str(data_row.get('单位', ''))
-        unit_config = layers_config['unit']
-        unit_font = self.get_font(unit_config['size'], bold=unit_config.get('bold', False))
-        unit_bbox = self.get_text_bbox(draw, unit, unit_font)
-        unit_width = unit_bbox[2] - unit_bbox[0]
-        unit_height = unit_bbox[3] - unit_bbox[1]
-        
-        # 计算金额+单位的整体宽度（金额宽度 + 间距 + 单位宽度）
-        spacing_x = unit_config.get('spacing_x', 20)
-        total_width = amount_width + spacing_x + unit_width
-        
-        # 让金额+单位作为整体居中
-        # 金额的X坐标 = 中心 - 整体宽度的一半
-        amount_x = center_x - total_width // 2
-        amount_y = amount_config['y'] - amount_height // 2  # 调整Y坐标，使文字垂直居中
-        
-        # 计算金额的底部Y坐标
-        amount_bottom = amount_y + amount_height
-        
-        # 绘制金额
-        draw.text(
-            (amount_x, amount_y),
-            amount,
-            fill=amount_config['color'],
-            font=amount_font
-        )
-        
-        # 4. 绘制单位（在金额右下角，粗体）
-        # 单位的X坐标：金额右边缘 + 水平间距
-        unit_x = amount_x + amount_width + spacing_x
-        
-        # 计算单位的Y坐标：让单位的底部与金额的底部对齐，然后加上偏移量
-        # 单位应该在金额的右下角，底部对齐
-        # unit_y + unit_height = amount_bottom + offset_y
-        # 所以：unit_y = amount_bottom - unit_height + offset_y
-        offset_y = unit_config.get('offset_y', 0)  # 获取Y坐标偏移量（正值往下，负值往上）
-        unit_y = amount_bottom - unit_height + offset_y
-        
-        draw.text(
-            (unit_x, unit_y),
-            unit,
-            fill=unit_config['color'],
-            font=unit_font
-        )
-        
-        # 调整海报尺寸为手机屏幕大小（1080x1920）
-        phone_width = 1080
-        phone_height = 1920
-        img_resized = img.resize((phone_width, phone_height), Image.Resampling.LANCZOS)
-        
-        return img_resized
+        Returns:
+            list: 与 output_sizes 顺序一致的 Image 对象列表
+        """
+        return scale_outputs(self.draw(data_row, config), output_sizes)
+    
+    def validate_batch(self, rows, config=None, background=None):
+        """
+        排版预检查：只计算每行每个图层的边界框，不绘制、不编码
+        
+        Args:
+            rows: 行数据列表（字典或 pandas Series）
+            config: 配置字典，如果为 None 则使用默认配置
+            background: 底图（PIL Image，可选），默认为当前底图；用于检查批量生成的每个模板
+        
+        Returns:
+            list: 问题列表，每项为字典 {'行号', '图层', '问题'}；
+            问题包括文字超出画布、图层重叠、字体缺少字形
+        """
+        plan = self.get_plan(config) if background is None else self.compile(config, background)
+        return check_layout(plan, rows, self._glyph_checker)
+    
+    def fit_report(self, rows, config=None, background=None):
+        """
+        列出因超出图层最大宽度（max_width）而自动缩小字号的行
+        
+        Args:
+            rows: 行数据列表（字典或 pandas Series）
+            config: 配置字典，如果为 None 则使用默认配置
+            background: 底图（PIL Image，可选），默认为当前底图
+        
+        Returns:
+            list: 每项为字典 {'行号', '图层', '文字', '原字号', '实际字号'}
+        """
+        plan = self.get_plan(config) if background is None else self.compile(config, background)
+        return fit_report(plan, rows)
     
     def load_from_template(self, template_config):
         """
@@ -289,67 +394,8 @@ class PosterDrawer:
         # 设置背景图路径
         self.background_path = template_config.get('background_path', 'assets/template.jpg')
         
-        # 加载配置，如果模板配置中有 config，则使用它，否则使用默认配置
-        template_layers = template_config.get('config', {}).get('layers', {})
-        
-        # 深度合并配置，确保所有必需的层都存在
-        default_config = {
-            'layers': {
-                'template_text': {
-                    'text': '喜签',
-                    'color': '#FFEDB5',
-                    'size': 100,
-                    'y': 200,
-                    'align': 'center',
-                    'bold': True
-                },
-                'city_name': {
-                    'color': '#FFEDB5',
-                    'size': 120,
-                    'y': 415,
-                    'spacing': 35,
-                    'align': 'center',
-                    'bold': True
-                },
-                'desc': {
-                    'color': '#FFEDB5',
-                    'size': 50,
-                    'y': 620,
-                    'align': 'center',
-                    'bold': True
-                },
-                'amount': {
-                    'color': '#FFEDB5',
-                    'size': 220,
-                    'y': 750,
-                    'align': 'center',
-                    'bold': True
-                },
-                'unit': {
-                    'color': '#FFEDB5',
-                    'size': 80,
-                    'y': 750,
-                    'spacing_x': 20,
-                    'spacing_y': 10,
-                    'offset_y': 60,
-                    'align': 'right_bottom',
-                    'bold': True
-                }
-            }
-        }
-        
-        # 合并配置
-        merged_layers = {}
-        for layer_name in ['city_name', 'desc', 'amount', 'unit']:
-            if layer_name in template_layers:
-                # 合并模板配置和默认配置
-                merged_layer = default_config['layers'][layer_name].copy()
-                merged_layer.update(template_layers[layer_name])
-                merged_layers[layer_name] = merged_layer
-            else:
-                merged_layers[layer_name] = default_config['layers'][layer_name].copy()
-        
-        self.config = {'layers': merged_layers}
+        # 加载配置：模板中的值覆盖默认值，确保所有必需的层都存在
+        self.config = merge_template_config(template_config)
     
     def update_config(self, **kwargs):
         """
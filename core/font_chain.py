@@ -0,0 +1,332 @@
+"""
+字体回退链模块
+从字体文件的 cmap 表预先计算字符覆盖范围（缓存到磁盘），按覆盖范围为每段文字选择字体：
+首选字体缺少的字符（如生僻字）由回退链中第一个包含该字符的字体绘制
+"""
+import os
+import struct
+import hashlib
+import tempfile
+from array import array
+from PIL import ImageFont
+
+from . import metrics
+
+
+# 字符覆盖索引的磁盘缓存目录
+COVERAGE_CACHE_DIR = os.path.join('.cache', 'font_coverage')
+
+# 缓存文件：魔数 + 覆盖区间数组（每个区间为 [起始码位, 结束码位]，uint32）
+COVERAGE_MAGIC = b'PGMCOV1\0'
+
+# cmap 子表的选择优先级：(平台ID, 编码ID)，优先使用包含全部 Unicode 平面的子表
+CMAP_PREFERENCE = (
+    (3, 10),  # Windows, Unicode 全平面
+    (0, 6),   # Unicode 全平面
+    (0, 4),   # Unicode 2.0+ 全平面
+    (3, 1),   # Windows, Unicode BMP
+    (0, 3),   # Unicode 2.0 BMP
+    (0, 2),
+    (0, 1),
+    (0, 0),
+)
+
+# 进程内的覆盖索引缓存：(绝对路径, 文件大小, mtime_ns) -> frozenset
+_coverage_cache = {}
+
+
+def _cmap_ranges(data):
+    """
+    解析 TrueType / OpenType 字体的 cmap 表，返回有字形的码位区间
+
+    支持单字体文件和字体集合（.ttc，取第一个字体），子表格式支持 4 和 12。
+
+    Args:
+        data: 字体文件内容（bytes）
+
+    Returns:
+        list: [(起始码位, 结束码位), ...]（闭区间）
+
+    Raises:
+        ValueError: 不是支持的字体文件或没有可用的 cmap 子表
+    """
+    offset = 0
+    if data[:4] == b'ttcf':
+        offset = struct.unpack_from('>I', data, 12)[0]
+
+    num_tables = struct.unpack_from('>H', data, offset + 4)[0]
+    cmap_offset = None
+    for i in range(num_tables):
+        tag, _, table_offset, _ = struct.unpack_from('>4sIII', data, offset + 12 + 16 * i)
+        if tag == b'cmap':
+            cmap_offset = table_offset
+            break
+    if cmap_offset is None:
+        raise ValueError("字体文件中没有 cmap 表")
+
+    num_subtables = struct.unpack_from('>H', data, cmap_offset + 2)[0]
+    subtables = {}
+    for i in range(num_subtables):
+        platform_id, encoding_id, sub_offset = struct.unpack_from('>HHI', data, cmap_offset + 4 + 8 * i)
+        sub_offset += cmap_offset
+        sub_format = struct.unpack_from('>H', data, sub_offset)[0]
+        if sub_format in (4, 12):
+            subtables.setdefault((platform_id, encoding_id), (sub_format, sub_offset))
+
+    for key in CMAP_PREFERENCE:
+        if key in subtables:
+            sub_format, sub_offset = subtables[key]
+            break
+    else:
+        if not subtables:
+            raise ValueError("字体文件中没有支持的 cmap 子表（格式 4 / 12）")
+        sub_format, sub_offset = next(iter(subtables.values()))
+
+    if sub_format == 12:
+        return _format12_ranges(data, sub_offset)
+    return _format4_ranges(data, sub_offset)
+
+
+def _format12_ranges(data, offset):
+    """cmap 格式 12：分段覆盖（每组码位连续映射到连续的字形）"""
+    num_groups = struct.unpack_from('>I', data, offset + 12)[0]
+    ranges = []
+    for i in range(num_groups):
+        start, end, start_glyph = struct.unpack_from('>III', data, offset + 16 + 12 * i)
+        if start_glyph == 0:
+            # 映射到字形 0（.notdef）的码位视为缺字
+            start += 1
+        if start <= end:
+            ranges.append((start, end))
+    return ranges
+
+
+def _format4_ranges(data, offset):
+    """cmap 格式 4：BMP 分段映射（逐段检查映射到字形 0 的码位）"""
+    seg_count = struct.unpack_from('>H', data, offset + 6)[0] // 2
+    end_offset = offset + 14
+    start_offset = end_offset + 2 * seg_count + 2
+    delta_offset = start_offset + 2 * seg_count
+    range_offset = delta_offset + 2 * seg_count
+
+    end_codes = struct.unpack_from(f'>{seg_count}H', data, end_offset)
+    start_codes = struct.unpack_from(f'>{seg_count}H', data, start_offset)
+    deltas = struct.unpack_from(f'>{seg_count}H', data, delta_offset)
+    range_offsets = struct.unpack_from(f'>{seg_count}H', data, range_offset)
+
+    ranges = []
+    for i in range(seg_count):
+        start, end = start_codes[i], end_codes[i]
+        if start == 0xFFFF or start > end:
+            continue
+        if range_offsets[i] == 0:
+            # 字形 = (码位 + delta) mod 65536，只有一个码位可能落到字形 0
+            zero_code = (-deltas[i]) & 0xFFFF
+            if start <= zero_code <= end:
+                if start < zero_code:
+                    ranges.append((start, zero_code - 1))
+                if zero_code < end:
+                    ranges.append((zero_code + 1, end))
+            else:
+                ranges.append((start, end))
+            continue
+
+        # 通过 glyphIdArray 映射：逐个码位检查
+        glyph_offset = range_offset + 2 * i + range_offsets[i]
+        glyphs = struct.unpack_from(f'>{end - start + 1}H', data, glyph_offset)
+        run_start = None
+        for code, glyph in enumerate(glyphs, start):
+            if glyph and (glyph + deltas[i]) & 0xFFFF:
+                if run_start is None:
+                    run_start = code
+            elif run_start is not None:
+                ranges.append((run_start, code - 1))
+                run_start = None
+        if run_start is not None:
+            ranges.append((run_start, end))
+    return ranges
+
+
+def _ranges_to_set(ranges):
+    """码位区间 -> frozenset"""
+    codepoints = set()
+    for start, end in ranges:
+        codepoints.update(range(start, end + 1))
+    return frozenset(codepoints)
+
+
+def load_coverage(font_path, cache_dir=COVERAGE_CACHE_DIR):
+    """
+    获取字体的字符覆盖索引（每个字体文件只解析一次 cmap，结果缓存到磁盘）
+
+    Args:
+        font_path: 字体文件路径
+        cache_dir: 磁盘缓存目录，None 表示不使用磁盘缓存
+
+    Returns:
+        frozenset: 字体中有字形的 Unicode 码位集合
+
+    Raises:
+        OSError: 字体文件无法读取
+        ValueError: 不是支持的字体文件
+    """
+    abs_path = os.path.abspath(font_path)
+    stat = os.stat(abs_path)
+    key = (abs_path, stat.st_size, stat.st_mtime_ns)
+    coverage = _coverage_cache.get(key)
+    if coverage is not None:
+        metrics.cache_hit('font_coverage', True)
+        return coverage
+
+    cache_path = None
+    if cache_dir:
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:24]
+        cache_path = os.path.join(cache_dir, f"{digest}.cov")
+        ranges = _read_cache(cache_path)
+        if ranges is not None:
+            metrics.cache_hit('font_coverage', True)
+            coverage = _coverage_cache[key] = _ranges_to_set(ranges)
+            return coverage
+
+    metrics.cache_hit('font_coverage', False)
+
+    with open(abs_path, 'rb') as f:
+        data = f.read()
+    try:
+        ranges = _cmap_ranges(data)
+    except struct.error:
+        raise ValueError(f"字体文件已损坏: {font_path}")
+
+    if cache_path:
+        _write_cache(cache_path, ranges)
+    coverage = _coverage_cache[key] = _ranges_to_set(ranges)
+    return coverage
+
+
+def _read_cache(cache_path):
+    """读取磁盘缓存的覆盖区间，缓存不存在或损坏时返回 None"""
+    try:
+        with open(cache_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if not data.startswith(COVERAGE_MAGIC) or (len(data) - len(COVERAGE_MAGIC)) % 8:
+        return None
+    values = array('I')
+    values.frombytes(data[len(COVERAGE_MAGIC):])
+    return list(zip(values[0::2], values[1::2]))
+
+
+def _write_cache(cache_path, ranges):
+    """写入磁盘缓存（临时文件 + 原子替换，失败时忽略）"""
+    values = array('I', (value for pair in ranges for value in pair))
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(COVERAGE_MAGIC)
+                f.write(values.tobytes())
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    except OSError as e:
+        print(f"警告: 无法写入字体覆盖缓存 {cache_path}: {e}")
+
+
+class FontChain:
+    """有序的字体回退链：按字符覆盖范围为每段文字选择字体"""
+
+    def __init__(self, font_paths, cache_dir=COVERAGE_CACHE_DIR):
+        """
+        初始化字体回退链
+
+        Args:
+            font_paths: 字体文件路径列表（按优先级排列），不存在或无法解析的文件会被跳过
+            cache_dir: 字符覆盖索引的磁盘缓存目录
+        """
+        paths = []
+        coverages = []
+        for font_path in font_paths:
+            if not font_path or font_path in paths or not os.path.exists(font_path):
+                continue
+            try:
+                coverage = load_coverage(font_path, cache_dir)
+            except (OSError, ValueError) as e:
+                print(f"警告: 无法读取字体 {font_path} 的字符覆盖范围: {e}")
+                continue
+            paths.append(font_path)
+            coverages.append(coverage)
+
+        self.paths = tuple(paths)
+        self.coverages = tuple(coverages)
+        # 字体缓存：(链中序号, 字号) -> ImageFont
+        self._fonts = {}
+        # 字符 -> 链中第一个包含该字符的字体序号
+        self._choices = {}
+
+    def font(self, index, size):
+        """
+        获取链中第 index 个字体的指定字号（同一字号只加载一次）
+
+        链为空（所有字体文件都不存在）时返回默认字体。
+
+        Args:
+            index: 字体在链中的序号，0 为首选字体
+            size: 字体大小
+
+        Returns:
+            ImageFont 对象
+        """
+        key = (index, size)
+        font = self._fonts.get(key)
+        if font is not None:
+            metrics.cache_hit('font', True)
+            return font
+        metrics.cache_hit('font', False)
+
+        if not self.paths:
+            font = ImageFont.load_default()
+        else:
+            try:
+                font = ImageFont.truetype(self.paths[index], size)
+            except Exception as e:
+                print(f"警告: 无法加载字体 {self.paths[index]}: {e}，使用默认字体")
+                font = ImageFont.load_default()
+
+        self._fonts[key] = font
+        return font
+
+    def split(self, text):
+        """
+        按字体覆盖范围将文字切分为连续的段
+
+        Args:
+            text: 文字内容
+
+        Returns:
+            list: [(链中序号, 文字段), ...]；整段都能用首选字体绘制时返回 None。
+            所有字体都不包含的字符归入首选字体
+        """
+        coverages = self.coverages
+        if len(coverages) < 2 or coverages[0].issuperset(map(ord, text)):
+            return None
+
+        choices = self._choices
+        runs = []
+        current = 0
+        start = 0
+        for pos, char in enumerate(text):
+            index = choices.get(char)
+            if index is None:
+                codepoint = ord(char)
+                index = next((i for i, coverage in enumerate(coverages) if codepoint in coverage), 0)
+                choices[char] = index
+            if index != current:
+                if pos > start:
+                    runs.append((current, text[start:pos]))
+                current = index
+                start = pos
+        runs.append((current, text[start:]))
+        return runs
@@ -0,0 +1,374 @@
+"""
+分片任务规格模块
+将一个批量任务打包为自包含的任务规格目录（输入数据、模板快照及其底图和字体、输出设置），
+可以按行范围或行键哈希拆分为 N 个分片，分别在多台机器上生成，最后合并为一个 ZIP 和清单
+"""
+import os
+import json
+import shutil
+import hashlib
+import zipfile
+from datetime import datetime
+
+from .batch_job import (
+    BatchJob, JobMismatchError, OUTPUTS_DIRNAME, STATUS_COMPLETED,
+    _open_atomic, _write_atomic, dumps_rows, poster_filename, prepare_templates
+)
+from .batch_manifest import (
+    MANIFEST_FILENAME, build_manifest, content_hashes, dumps_manifest, make_entry, output_digest,
+    render_signature, row_keys
+)
+from .drawer import OUTPUT_SIZE, PosterDrawer, merge_template_config
+
+
+SPEC_VERSION = 1
+
+SPEC_FILENAME = 'spec.json'
+SPEC_ROWS_FILENAME = 'rows.json'
+SPEC_ASSETS_DIRNAME = 'assets'
+
+# 分片方式：按行范围（连续的行）或按行键哈希（输入顺序变化时分片不变）
+SHARD_BY_RANGE = 'range'
+SHARD_BY_HASH = 'hash'
+SHARD_METHODS = (SHARD_BY_RANGE, SHARD_BY_HASH)
+
+
+def _file_digest(path):
+    """计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _snapshot_asset(spec_dir, path):
+    """
+    将底图或字体文件复制到任务规格目录（按内容摘要命名，相同文件只保存一份）
+
+    Returns:
+        dict: {'file': 相对于任务规格目录的路径, 'sha256': 文件摘要}；文件不存在时返回 None
+    """
+    if not path or not os.path.exists(path):
+        return None
+    sha256 = _file_digest(path)
+    relative_path = f"{SPEC_ASSETS_DIRNAME}/{sha256}{os.path.splitext(path)[1].lower()}"
+    target_path = os.path.join(spec_dir, relative_path)
+    if not os.path.exists(target_path):
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        shutil.copyfile(path, target_path)
+    return {'file': relative_path, 'sha256': sha256}
+
+
+def create_spec(spec_dir, rows, template_manager, drawer, template_ids, output_sizes=None, image_format='PNG'):
+    """
+    创建任务规格目录
+
+    Args:
+        spec_dir: 任务规格目录（不能已存在）
+        rows: 行数据列表（字典）
+        template_manager: TemplateManager 实例
+        drawer: PosterDrawer 实例（字体；没有模板时使用它的底图和配置）
+        template_ids: 模板ID列表
+        output_sizes: 输出尺寸列表（可选）
+        image_format: 输出图片格式
+
+    Returns:
+        dict: 任务规格
+
+    Raises:
+        FileExistsError: 任务规格目录已存在
+        JobMismatchError: 模板不存在
+        FileNotFoundError: 底图文件不存在
+    """
+    _, folder_names, _ = prepare_templates(template_manager, drawer, template_ids)
+    os.makedirs(spec_dir)
+
+    fonts = {
+        'regular': _snapshot_asset(spec_dir, drawer.font_path),
+        'bold': _snapshot_asset(spec_dir, drawer.bold_font_path),
+    }
+
+    templates = []
+    for template_id, folder_name in zip(template_ids, folder_names):
+        template = template_manager.get_template(template_id)
+        background_path = template_manager.get_template_background_path(template)
+        templates.append({
+            'id': template_id,
+            'name': template['name'],
+            'folder': folder_name,
+            'config': _snapshot_fallbacks(spec_dir, merge_template_config(template)),
+            'background': _snapshot_asset(spec_dir, background_path),
+        })
+    if not templates:
+        config = json.loads(json.dumps(drawer.config))
+        templates.append({
+            'id': None,
+            'name': None,
+            'folder': '',
+            'config': _snapshot_fallbacks(spec_dir, config),
+            'background': _snapshot_asset(spec_dir, drawer.background_path),
+        })
+    for template in templates:
+        if template['background'] is None:
+            raise FileNotFoundError(f"模板底图文件不存在: {template['name'] or '默认模板'}")
+
+    rows_data = dumps_rows(rows)
+    _write_atomic(os.path.join(spec_dir, SPEC_ROWS_FILENAME), rows_data)
+
+    output_sizes = [list(size) for size in output_sizes] if output_sizes else None
+    spec = {
+        'version': SPEC_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'input_digest': hashlib.sha256(rows_data).hexdigest(),
+        'row_count': len(rows),
+        'keys': row_keys(rows),
+        'hashes': content_hashes(rows),
+        'templates': templates,
+        'fonts': fonts,
+        'output_sizes': output_sizes,
+        'image_format': image_format,
+    }
+    # 签名只基于快照内容（配置、文件摘要），与各机器上的文件路径无关
+    spec['signature'] = render_signature(
+        [template['config'] for template in templates],
+        [template['background']['sha256'] for template in templates],
+        [template['folder'] for template in templates],
+        output_sizes or [list(OUTPUT_SIZE)],
+        fonts, image_format
+    )
+    _write_atomic(
+        os.path.join(spec_dir, SPEC_FILENAME),
+        json.dumps(spec, ensure_ascii=False, indent=2).encode('utf-8')
+    )
+    return spec
+
+
+def _snapshot_fallbacks(spec_dir, config):
+    """将配置中的回退字体复制到任务规格目录，并改为快照中的相对路径（不存在的字体去掉）"""
+    font_fallbacks = config.get('font_fallbacks')
+    if font_fallbacks:
+        snapshots = [_snapshot_asset(spec_dir, path) for path in font_fallbacks]
+        config['font_fallbacks'] = [snapshot['file'] for snapshot in snapshots if snapshot]
+        if not config['font_fallbacks']:
+            del config['font_fallbacks']
+    return config
+
+
+def load_spec(spec_dir):
+    """
+    读取任务规格，并校验输入数据和快照文件的摘要
+
+    Args:
+        spec_dir: 任务规格目录
+
+    Returns:
+        dict: 任务规格
+
+    Raises:
+        FileNotFoundError: 任务规格或快照文件不存在
+        JobMismatchError: 输入数据或快照文件与任务规格不一致
+        ValueError: 不是有效的任务规格
+    """
+    spec_path = os.path.join(spec_dir, SPEC_FILENAME)
+    if not os.path.exists(spec_path):
+        raise FileNotFoundError(f"任务规格不存在: {spec_dir}")
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        try:
+            spec = json.load(f)
+        except ValueError as e:
+            raise ValueError(f"任务规格格式不正确: {str(e)}")
+    if not isinstance(spec, dict) or spec.get('version') != SPEC_VERSION:
+        raise ValueError("不是有效的任务规格文件")
+
+    if _file_digest(os.path.join(spec_dir, SPEC_ROWS_FILENAME)) != spec['input_digest']:
+        raise JobMismatchError("任务规格的输入数据文件已被修改")
+
+    assets = [template['background'] for template in spec['templates']]
+    assets += [font for font in spec['fonts'].values() if font]
+    for asset in assets:
+        asset_path = os.path.join(spec_dir, asset['file'])
+        if not os.path.exists(asset_path):
+            raise FileNotFoundError(f"任务规格缺少快照文件: {asset['file']}")
+        if _file_digest(asset_path) != asset['sha256']:
+            raise JobMismatchError(f"快照文件已被修改: {asset['file']}")
+    return spec
+
+
+def load_spec_rows(spec_dir):
+    """读取任务规格的输入数据"""
+    with open(os.path.join(spec_dir, SPEC_ROWS_FILENAME), 'rb') as f:
+        return json.loads(f.read())
+
+
+def shard_indices(spec, index, count, by=SHARD_BY_RANGE):
+    """
+    计算一个分片包含的行索引
+
+    Args:
+        spec: 任务规格
+        index: 分片序号（从 0 开始）
+        count: 分片总数
+        by: 分片方式，'range' 按行范围，'hash' 按行键哈希
+
+    Returns:
+        list: 行索引（升序）
+
+    Raises:
+        ValueError: 分片参数不正确
+    """
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"分片序号超出范围: {index}/{count}")
+    if by not in SHARD_METHODS:
+        raise ValueError(f"不支持的分片方式: {by}")
+
+    row_count = spec['row_count']
+    if by == SHARD_BY_RANGE:
+        return list(range(row_count * index // count, row_count * (index + 1) // count))
+    return [
+        row_index for row_index, key in enumerate(spec['keys'])
+        if int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8], 'big') % count == index
+    ]
+
+
+def spec_templates(spec_dir, spec):
+    """
+    用任务规格中的快照构建绘制器和模板
+
+    Args:
+        spec_dir: 任务规格目录
+        spec: 任务规格
+
+    Returns:
+        (drawer, templates, folder_names): PosterDrawer 实例、render_batch 使用的 (底图, 配置) 列表、文件夹名
+    """
+    def resolve(asset):
+        # 快照中没有的字体使用空路径（与创建任务规格时一样回退到默认字体）
+        return os.path.abspath(os.path.join(spec_dir, asset['file'])) if asset else ''
+
+    fonts = spec['fonts']
+    drawer = PosterDrawer(
+        background_path=resolve(spec['templates'][0]['background']),
+        font_path=resolve(fonts['regular']),
+        bold_font_path=resolve(fonts['bold'])
+    )
+
+    templates = []
+    for template in spec['templates']:
+        config = dict(template['config'])
+        if config.get('font_fallbacks'):
+            config['font_fallbacks'] = [
+                os.path.abspath(os.path.join(spec_dir, path)) for path in config['font_fallbacks']
+            ]
+        templates.append((drawer.load_background(resolve(template['background'])), config))
+    return drawer, templates, [template['folder'] for template in spec['templates']]
+
+
+def open_shard(spec_dir, spec, index, count, out_dir, by=SHARD_BY_RANGE, drawer=None):
+    """
+    打开分片任务：输出目录不存在时创建，已存在时校验与任务规格一致（用于继续被中断的分片）
+
+    Args:
+        spec_dir: 任务规格目录
+        spec: 任务规格
+        index: 分片序号（从 0 开始）
+        count: 分片总数
+        out_dir: 分片的输出目录
+        by: 分片方式
+        drawer: spec_templates() 返回的绘制器
+
+    Returns:
+        BatchJob 对象（调用 run(..., build_zip=False) 生成）
+
+    Raises:
+        JobMismatchError: 输出目录中已有其他任务规格或分片的任务
+    """
+    shard = {'index': index, 'count': count, 'by': by, 'input_digest': spec['input_digest']}
+    out_dir = os.path.abspath(out_dir)
+    try:
+        job = BatchJob(out_dir)
+    except FileNotFoundError:
+        return BatchJob.create(
+            load_spec_rows(spec_dir), drawer, [template['id'] for template in spec['templates']],
+            spec['signature'], spec['keys'], spec['hashes'],
+            render_indices=shard_indices(spec, index, count, by),
+            output_sizes=spec['output_sizes'], image_format=spec['image_format'],
+            jobs_dir=os.path.dirname(out_dir), job_id=os.path.basename(out_dir), shard=shard
+        )
+
+    job.verify(spec['signature'])
+    if job.spec.get('shard') != shard:
+        raise JobMismatchError(f"输出目录中已有其他分片的任务: {out_dir}")
+    return job
+
+
+def merge_shards(spec_dir, spec, shard_dirs, zip_path):
+    """
+    合并所有分片的输出为一个 ZIP 和清单（按输入顺序排列，与单机生成的结果一致）
+
+    Args:
+        spec_dir: 任务规格目录
+        spec: 任务规格
+        shard_dirs: 所有分片的输出目录
+        zip_path: 合并后的 ZIP 路径
+
+    Returns:
+        dict: {'posters': 成功的行数, 'failed': 失败的行索引}
+
+    Raises:
+        JobMismatchError: 分片与任务规格不一致、分片缺失、重复或未完成，或输出文件已损坏
+    """
+    shards = {}
+    for shard_dir in shard_dirs:
+        job = BatchJob(shard_dir)
+        shard = job.spec.get('shard')
+        if not shard or shard['input_digest'] != spec['input_digest']:
+            raise JobMismatchError(f"不是此任务规格的分片: {shard_dir}")
+        job.verify(spec['signature'])
+        if job.status != STATUS_COMPLETED:
+            raise JobMismatchError(f"分片还未完成: {shard_dir}")
+        if shard['index'] in shards:
+            raise JobMismatchError(f"分片重复: {shard['index']}")
+        shards[shard['index']] = (job, shard)
+
+    counts = {(shard['count'], shard['by']) for _, shard in shards.values()}
+    if len(counts) != 1:
+        raise JobMismatchError("分片的分片总数或分片方式不一致")
+    count, _ = counts.pop()
+    missing = [str(index) for index in range(count) if index not in shards]
+    if missing:
+        raise JobMismatchError(f"缺少分片: {', '.join(missing)}")
+
+    # 行索引 -> (分片输出目录, 输出)
+    completed = {}
+    for job, _ in shards.values():
+        for row_index, outputs in job.completed().items():
+            if row_index in completed:
+                raise JobMismatchError(f"第 {row_index + 1} 行出现在多个分片中")
+            completed[row_index] = (os.path.join(job.job_dir, OUTPUTS_DIRNAME), outputs)
+
+    rows = load_spec_rows(spec_dir)
+    entries = {}
+    # ZIP 直接流式写入目标路径旁的临时文件，写完后替换，不在内存中保留整个压缩包
+    with _open_atomic(os.path.abspath(zip_path)) as zip_out:
+        with zipfile.ZipFile(zip_out, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for row_index in range(spec['row_count']):
+                if row_index not in completed:
+                    continue
+                outputs_dir, outputs = completed[row_index]
+                for path, digest in outputs.items():
+                    with open(os.path.join(outputs_dir, path), 'rb') as f:
+                        data = f.read()
+                    if output_digest(data) != digest:
+                        raise JobMismatchError(f"分片输出文件已损坏: {path}")
+                    zip_file.writestr(path, data)
+                entries[spec['keys'][row_index]] = make_entry(
+                    spec['hashes'][row_index], poster_filename(rows[row_index]), outputs
+                )
+            manifest = build_manifest(spec['signature'], spec['keys'], entries)
+            zip_file.writestr(MANIFEST_FILENAME, dumps_manifest(manifest))
+
+    return {
+        'posters': len(entries),
+        'failed': [row_index for row_index in range(spec['row_count']) if row_index not in completed],
+    }
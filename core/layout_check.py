@@ -0,0 +1,183 @@
+"""
+排版预检查模块
+只计算排版（每个图层的边界框），不绘制、不编码，在正式渲染前找出有问题的行：
+文字超出画布、图层之间重叠、字体缺少字形，以及自动缩小了字号的行
+"""
+from PIL import Image, ImageDraw
+
+from .render_plan import layout
+
+
+# 用于和"缺字"占位字形（.notdef）比较的私有区字符，正常字体中不会有这个字形
+NOTDEF_PROBE = '\U000F0000'
+
+# 参与重叠检查的图层分组（城市和姓名属于同一行）
+LAYER_GROUPS = {
+    'city': 'city_name',
+    'name': 'city_name',
+    'desc': 'desc',
+    'amount': 'amount',
+    'unit': 'unit',
+}
+
+LAYER_LABELS = {
+    'city_name': '城市+姓名',
+    'desc': '描述',
+    'amount': '金额',
+    'unit': '单位',
+}
+
+
+class GlyphChecker:
+    """字形检查器：判断字体中是否缺少某个字符的字形（按字体和字符缓存结果）"""
+
+    def __init__(self):
+        self._notdef = {}
+        self._missing = {}
+
+    def _render_signature(self, font, char):
+        mask = font.getmask(char)
+        return mask.size, bytes(mask)
+
+    def missing_chars(self, font, text):
+        """
+        找出字体中缺少字形的字符
+
+        Args:
+            font: ImageFont 对象
+            text: 文字内容
+
+        Returns:
+            str: 缺少字形的字符（去重，保持出现顺序），没有缺字时为空字符串
+        """
+        font_key = id(font)
+        notdef = self._notdef.get(font_key)
+        if notdef is None:
+            notdef = self._notdef[font_key] = (font, self._render_signature(font, NOTDEF_PROBE))
+
+        missing = ''
+        for char in text:
+            if char.isspace() or char in missing:
+                continue
+            key = (font_key, char)
+            is_missing = self._missing.get(key)
+            if is_missing is None:
+                is_missing = self._missing[key] = self._render_signature(font, char) == notdef[1]
+            if is_missing:
+                missing += char
+        return missing
+
+
+def _overlaps(a, b):
+    """两个边界框是否有面积大于 0 的重叠"""
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def check_layout(plan, rows, glyph_checker=None):
+    """
+    对整批数据做排版预检查
+
+    Args:
+        plan: RenderPlan 对象
+        rows: 行数据列表（字典或 pandas Series）
+        glyph_checker: GlyphChecker 对象（可选，跨批次复用可保留缓存）
+
+    Returns:
+        list: 问题列表，每项为字典 {'行号', '图层', '问题'}，行号从 1 开始
+    """
+    if glyph_checker is None:
+        glyph_checker = GlyphChecker()
+
+    # 在 1x1 的画布上测量文字，测量结果与画布大小无关
+    textbbox = ImageDraw.Draw(Image.new(plan.mode, (1, 1))).textbbox
+    canvas_width, canvas_height = plan.canvas_size
+
+    issues = []
+    for row_index, row in enumerate(rows):
+        row_no = row_index + 1
+        items = layout(plan, row, textbbox)
+
+        # 每个图层分组的整体边界框（空文字不参与检查）
+        group_boxes = {}
+        for layer_name, text, _, font, _, box, _, runs in items:
+            if not text:
+                continue
+            group = LAYER_GROUPS[layer_name]
+            label = LAYER_LABELS[group]
+
+            # 1. 超出画布
+            if box[0] < 0 or box[1] < 0 or box[2] > canvas_width or box[3] > canvas_height:
+                issues.append({
+                    '行号': row_no,
+                    '图层': label,
+                    '问题': f"文字超出画布: '{text}' 范围 ({box[0]}, {box[1]}, {box[2]}, {box[3]})，"
+                            f"画布 {canvas_width}x{canvas_height}"
+                })
+
+            # 2. 缺少字形（分段绘制时按每段实际使用的字体检查）
+            if runs is None:
+                missing = glyph_checker.missing_chars(font, text)
+            else:
+                missing = ''.join(dict.fromkeys(
+                    ''.join(glyph_checker.missing_chars(run_font, segment) for _, segment, run_font in runs)
+                ))
+            if missing:
+                issues.append({'行号': row_no, '图层': label, '问题': f"字体缺少字形: {missing}"})
+
+            merged = group_boxes.get(group)
+            group_boxes[group] = box if merged is None else (
+                min(merged[0], box[0]), min(merged[1], box[1]),
+                max(merged[2], box[2]), max(merged[3], box[3])
+            )
+
+        # 3. 图层之间重叠
+        groups = list(group_boxes)
+        for i, group_a in enumerate(groups):
+            for group_b in groups[i + 1:]:
+                if _overlaps(group_boxes[group_a], group_boxes[group_b]):
+                    issues.append({
+                        '行号': row_no,
+                        '图层': f"{LAYER_LABELS[group_a]} / {LAYER_LABELS[group_b]}",
+                        '问题': '图层重叠'
+                    })
+
+    return issues
+
+
+def fit_report(plan, rows):
+    """
+    列出因超出最大宽度而自动缩小字号的行
+
+    Args:
+        plan: RenderPlan 对象
+        rows: 行数据列表（字典或 pandas Series）
+
+    Returns:
+        list: 每项为字典 {'行号', '图层', '文字', '原字号', '实际字号'}，行号从 1 开始
+    """
+    textbbox = ImageDraw.Draw(Image.new(plan.mode, (1, 1))).textbbox
+    configured_sizes = {
+        'city_name': plan.city_name.size,
+        'desc': plan.desc.size,
+        'amount': plan.amount.size,
+        'unit': plan.unit.size,
+    }
+
+    report = []
+    for row_index, row in enumerate(rows):
+        reported = set()
+        for layer_name, text, _, _, _, _, size, _ in layout(plan, row, textbbox):
+            group = LAYER_GROUPS[layer_name]
+            if size == configured_sizes[group] or group in reported:
+                continue
+            reported.add(group)
+            if group == 'city_name':
+                text = f"{row.get('城市', '')} {row.get('姓名', '')}"
+            report.append({
+                '行号': row_index + 1,
+                '图层': LAYER_LABELS[group],
+                '文字': text,
+                '原字号': configured_sizes[group],
+                '实际字号': size
+            })
+    return report
@@ -0,0 +1,317 @@
+"""
+内存分析模块
+在批量生成的阶段边界和每 N 行采样一次内存：进程 RSS、渲染进程 RSS、tracemalloc 统计的 Python 分配，
+以及调用方登记的监视项（如会话中缓存的海报字节）；把峰值归到所在阶段，
+估算 RSS 随行数的增长，并写出文字报告和 JSON 数据，用于确定容器内存和确认内存不随行数增长
+"""
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+try:
+    import psutil
+except ImportError:  # psutil 是可选依赖，没有时从 /proc 读取（只有 Linux 可用）
+    psutil = None
+
+
+# 设置此环境变量（如 POSTERGEN_MEMORY_PROFILE=1）后，应用为每个任务写出内存分析报告
+ENV_MEMORY_PROFILE = 'POSTERGEN_MEMORY_PROFILE'
+
+# 每生成多少行采样一次（环境变量 POSTERGEN_MEMORY_SAMPLE_EVERY，默认 50）
+ENV_MEMORY_SAMPLE_EVERY = 'POSTERGEN_MEMORY_SAMPLE_EVERY'
+DEFAULT_SAMPLE_EVERY = 50
+
+# tracemalloc 记录的调用栈深度
+TRACEMALLOC_FRAMES = 1
+
+# 报告中每个阶段列出的新增分配最多的代码位置数
+TOP_ALLOCATIONS = 10
+
+REPORT_FILENAME = 'memory_report.txt'
+DATA_FILENAME = 'memory_profile.json'
+
+MB = 1024 * 1024
+
+
+def env_enabled():
+    """是否通过环境变量启用了内存分析"""
+    return os.environ.get(ENV_MEMORY_PROFILE, '').strip().lower() not in ('', '0', 'false', 'no')
+
+
+def env_sample_every():
+    """环境变量设置的采样间隔（行），无效时使用默认值"""
+    value = os.environ.get(ENV_MEMORY_SAMPLE_EVERY, '').strip()
+    try:
+        return max(1, int(value)) if value else DEFAULT_SAMPLE_EVERY
+    except ValueError:
+        print(f"警告: {ENV_MEMORY_SAMPLE_EVERY}={value!r} 不是整数，使用默认值 {DEFAULT_SAMPLE_EVERY}")
+        return DEFAULT_SAMPLE_EVERY
+
+
+def _proc_rss(pid):
+    """从 /proc 读取进程 RSS（字节），不可用时返回 None"""
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def process_rss():
+    """
+    当前进程和子进程（渲染进程）的 RSS
+
+    Returns:
+        (rss, children_rss): 字节数，无法获取时为 None
+    """
+    if psutil is not None:
+        process = psutil.Process()
+        children_rss = 0
+        for child in process.children(recursive=True):
+            try:
+                children_rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return process.memory_info().rss, children_rss
+
+    rss = _proc_rss('self')
+    if rss is None:
+        return None, None
+    children_rss = 0
+    try:
+        # 只统计直接子进程（渲染进程池的进程都是直接子进程）
+        own_pid = str(os.getpid())
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f'/proc/{pid}/stat', 'r') as f:
+                    parent_pid = f.read().rsplit(')', 1)[1].split()[1]
+            except (OSError, IndexError):
+                continue
+            if parent_pid == own_pid:
+                children_rss += _proc_rss(pid) or 0
+    except OSError:
+        children_rss = None
+    return rss, children_rss
+
+
+def _take_snapshot():
+    """Python 分配快照（排除 tracemalloc 和本模块自身的分配）"""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+
+
+def _mb(value):
+    return '-' if value is None else f"{value / MB:.1f} MB"
+
+
+class MemoryProfiler:
+    """批量生成的内存分析器（启用 tracemalloc，有一定的性能开销，只在分析时使用）"""
+
+    def __init__(self, sample_every=DEFAULT_SAMPLE_EVERY, watch=None, metadata=None):
+        """
+        初始化内存分析器并开始跟踪 Python 分配
+
+        Args:
+            sample_every: 每生成多少行采样一次
+            watch: 监视项 {名称: 返回字节数的函数}（可选），每次采样时调用
+            metadata: 写入报告的附加信息（可选）
+        """
+        self.sample_every = max(1, sample_every)
+        self.watch = dict(watch or {})
+        self.metadata = dict(metadata or {})
+        self.samples = []
+        # 已结束的阶段：[{'stage', 'rows', 'elapsed', 'peak_rss', 'peak_children_rss', 'peak_traced', 'top'}, ...]
+        self.stages = []
+
+        self._started_tracemalloc = not tracemalloc.is_tracing()
+        if self._started_tracemalloc:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._stage = None
+        self._rows = 0
+        self._stage_rows = 0
+        self._stage_start = None
+        self._stage_snapshot = None
+        self._since_sample = 0
+
+    def stage(self, name):
+        """结束当前阶段，开始新阶段（阶段边界各采样一次）"""
+        self.end_stage()
+        self._stage = name
+        self._stage_rows = 0
+        self._stage_start = time.monotonic()
+        tracemalloc.reset_peak()
+        self._stage_snapshot = _take_snapshot()
+        self.sample('开始')
+
+    def tick(self, count=1):
+        """完成 count 行，每 sample_every 行采样一次"""
+        self._rows += count
+        self._stage_rows += count
+        self._since_sample += count
+        if self._since_sample >= self.sample_every:
+            self._since_sample = 0
+            self.sample()
+
+    def sample(self, label=''):
+        """
+        采样一次内存
+
+        Args:
+            label: 采样说明（可选）
+
+        Returns:
+            dict: 采样数据
+        """
+        rss, children_rss = process_rss()
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        watched = {}
+        for name, measure in self.watch.items():
+            try:
+                watched[name] = measure()
+            except Exception:
+                watched[name] = None
+        sample = {
+            'time': time.time(),
+            'stage': self._stage,
+            'label': label,
+            'rows': self._rows,
+            'rss': rss,
+            'children_rss': children_rss,
+            'traced': traced,
+            'traced_peak': traced_peak,
+            'watch': watched,
+        }
+        self.samples.append(sample)
+        return sample
+
+    def end_stage(self):
+        """结束当前阶段：记录阶段内的峰值和新增分配最多的代码位置"""
+        if self._stage is None:
+            return
+        self.sample('结束')
+        stage_samples = [sample for sample in self.samples if sample['stage'] == self._stage]
+        top = _take_snapshot().compare_to(self._stage_snapshot, 'lineno')[:TOP_ALLOCATIONS]
+        self.stages.append({
+            'stage': self._stage,
+            'rows': self._stage_rows,
+            'elapsed': time.monotonic() - self._stage_start,
+            'peak_rss': max((s['rss'] for s in stage_samples if s['rss'] is not None), default=None),
+            'peak_children_rss': max(
+                (s['children_rss'] for s in stage_samples if s['children_rss'] is not None), default=None
+            ),
+            'peak_traced': max(s['traced_peak'] for s in stage_samples),
+            'top': [
+                {'location': str(stat.traceback[0]), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff}
+                for stat in top if stat.size_diff > 0
+            ],
+        })
+        self._stage = None
+        self._stage_snapshot = None
+
+    def stop(self):
+        """结束当前阶段并停止跟踪 Python 分配（只停止由本分析器启动的跟踪）"""
+        self.end_stage()
+        if self._started_tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def growth_per_1000_rows(self):
+        """
+        用最小二乘法估算 RSS（含渲染进程）随已生成行数的增长
+        （只用生成第一行之后的采样，排除启动渲染进程、加载字体和底图的一次性开销）
+
+        Returns:
+            float: 每 1000 行增长的字节数，采样点不足时为 None
+        """
+        points = [
+            (sample['rows'], sample['rss'] + (sample['children_rss'] or 0))
+            for sample in self.samples if sample['rss'] is not None and sample['rows'] > 0
+        ]
+        if len({rows for rows, _ in points}) < 3:
+            return None
+        count = len(points)
+        mean_x = sum(x for x, _ in points) / count
+        mean_y = sum(y for _, y in points) / count
+        variance = sum((x - mean_x) ** 2 for x, _ in points)
+        covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+        return covariance / variance * 1000
+
+    def report(self):
+        """
+        生成文字报告
+
+        Returns:
+            str: 报告内容
+        """
+        lines = ["PosterGenMaster 内存分析报告", ""]
+        for key, value in self.metadata.items():
+            lines.append(f"{key}: {value}")
+        lines.append(f"采样: {len(self.samples)} 次（每 {self.sample_every} 行，以及每个阶段的开始和结束）")
+        if psutil is None:
+            lines.append("提示: 没有安装 psutil，RSS 从 /proc 读取（非 Linux 系统上不可用）")
+        lines.append("")
+
+        lines.append(f"{'阶段':<8}{'行数':>8}{'耗时':>10}{'峰值 RSS':>14}{'渲染进程 RSS':>16}{'Python 分配峰值':>18}")
+        for stage in self.stages:
+            lines.append(
+                f"{stage['stage']:<8}{stage['rows']:>8}{stage['elapsed']:>9.1f}s{_mb(stage['peak_rss']):>14}"
+                f"{_mb(stage['peak_children_rss']):>16}{_mb(stage['peak_traced']):>18}"
+            )
+
+        measured = [sample for sample in self.samples if sample['rss'] is not None]
+        if measured:
+            peak = max(measured, key=lambda sample: sample['rss'] + (sample['children_rss'] or 0))
+            lines.append("")
+            lines.append(
+                f"整体峰值: {_mb(peak['rss'] + (peak['children_rss'] or 0))}"
+                f"（主进程 {_mb(peak['rss'])} + 渲染进程 {_mb(peak['children_rss'])}），"
+                f"出现在阶段「{peak['stage']}」，已生成 {peak['rows']} 行"
+            )
+        growth = self.growth_per_1000_rows()
+        if growth is not None:
+            lines.append(f"RSS 随行数增长: 每 1000 行约 {growth / MB:+.1f} MB（接近 0 表示内存不随行数增长）")
+
+        if self.watch:
+            lines.append("")
+            lines.append("监视项峰值:")
+            for name in self.watch:
+                values = [sample['watch'].get(name) for sample in self.samples]
+                lines.append(f"  {name}: {_mb(max((v for v in values if v is not None), default=None))}")
+
+        for stage in self.stages:
+            if not stage['top']:
+                continue
+            lines.append("")
+            lines.append(f"阶段「{stage['stage']}」中新增分配最多的代码位置（阶段结束时仍未释放）:")
+            for item in stage['top']:
+                lines.append(f"  {item['size_diff'] / MB:+8.2f} MB  {item['count_diff']:+8d} 个  {item['location']}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory):
+        """
+        写出文字报告和 JSON 数据
+
+        Args:
+            directory: 输出目录
+
+        Returns:
+            str: 文字报告的路径
+        """
+        os.makedirs(directory, exist_ok=True)
+        report_path = os.path.join(directory, REPORT_FILENAME)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(self.report())
+        with open(os.path.join(directory, DATA_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({
+                'metadata': self.metadata,
+                'platform': sys.platform,
+                'sample_every': self.sample_every,
+                'stages': self.stages,
+                'samples': self.samples,
+            }, f, ensure_ascii=False, indent=2)
+        return report_path
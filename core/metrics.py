@@ -0,0 +1,426 @@
+"""
+运行指标模块
+进程内的指标注册表（计数器、仪表、直方图），以 Prometheus 文本格式导出：
+监听本地 HTTP 端口（GET /metrics），或定期写入文件（供 node_exporter 的 textfile collector 采集）。
+
+渲染进程中记录的计数和耗时随每行的渲染结果带回主进程合并（drain() / merge()），
+所以主进程导出的是整个服务的指标。
+"""
+import os
+import atexit
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 导出方式的环境变量：HTTP 端口、监听地址（默认只监听本机，容器中需要设为 0.0.0.0）、指标文件路径
+ENV_METRICS_PORT = 'POSTERGEN_METRICS_PORT'
+ENV_METRICS_HOST = 'POSTERGEN_METRICS_HOST'
+ENV_METRICS_FILE = 'POSTERGEN_METRICS_FILE'
+
+DEFAULT_HOST = '127.0.0.1'
+
+# 写指标文件的间隔（秒）
+FILE_INTERVAL = 15
+
+# 耗时直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ZIP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class _Metric:
+    """指标基类：按标签值分别记录"""
+
+    type_name = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """增加计数（标签以关键字参数传入）"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """当前计数"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def drain(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values):
+        with self._lock:
+            for key, amount in values.items():
+                self._values[tuple(key)] = self._values.get(tuple(key), 0) + amount
+
+    def expose(self):
+        with self._lock:
+            values = dict(self._values)
+        if not values and not self.labelnames:
+            # 没有标签的指标从 0 开始导出，告警规则不会因为缺少序列而失效
+            values = {(): 0}
+        lines = self._header()
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """可增可减的仪表，可以设置为导出时调用的函数（如调度器的排队行数）"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        """设置当前值"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """
+        导出时调用 function() 取值（只用于没有标签的仪表）
+
+        Args:
+            function: 返回数值的函数，None 表示取消
+        """
+        self._function = function
+
+    def expose(self):
+        function = self._function
+        if function is not None:
+            try:
+                self.set(function())
+            except Exception as e:
+                print(f"警告: 无法读取指标 {self.name}: {e}")
+        with self._lock:
+            values = dict(self._values)
+        lines = self._header()
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """直方图：按分桶统计观测值的分布（如耗时）"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """记录一个观测值"""
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各分桶的计数（不累计，最后一个为超出所有分桶）, 总和, 总数]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(self.buckets)
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def drain(self):
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values):
+        with self._lock:
+            for key, (counts, total, count) in values.items():
+                state = self._values.get(tuple(key))
+                if state is None:
+                    state = self._values[tuple(key)] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+                state[2] += count
+
+    def expose(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        if not values and not self.labelnames:
+            values = {(): ([0] * (len(self.buckets) + 1), 0.0, 0)}
+        lines = self._header()
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """登记指标（同名指标已存在时返回已有的）"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def get(self, name):
+        """按名称获取指标（不存在时为 None）"""
+        return self._metrics.get(name)
+
+    def expose(self):
+        """
+        导出所有指标
+
+        Returns:
+            str: Prometheus 文本格式
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+    def drain(self):
+        """
+        取出并清零所有计数器和直方图（在渲染进程中调用，结果随渲染结果返回主进程）
+
+        Returns:
+            dict: {指标名: 记录值}，没有新记录时为空字典
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        delta = {}
+        for metric in metrics:
+            if isinstance(metric, (Counter, Histogram)):
+                values = metric.drain()
+                if values:
+                    delta[metric.name] = values
+        return delta
+
+    def merge(self, delta):
+        """合并 drain() 的结果（在主进程中调用）"""
+        for name, values in (delta or {}).items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge(values)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labelnames=()):
+    """登记计数器"""
+    return REGISTRY.register(Counter(name, help_text, labelnames))
+
+
+def gauge(name, help_text, labelnames=()):
+    """登记仪表"""
+    return REGISTRY.register(Gauge(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+    """登记直方图"""
+    return REGISTRY.register(Histogram(name, help_text, labelnames, buckets))
+
+
+def drain():
+    """取出并清零渲染进程中记录的指标（见 Registry.drain）"""
+    return REGISTRY.drain()
+
+
+def merge(delta):
+    """合并渲染进程带回的指标（见 Registry.merge）"""
+    REGISTRY.merge(delta)
+
+
+# 服务的全部指标（渲染进程和主进程登记相同的指标，合并时按名称对应）
+POSTERS_RENDERED = counter('postergen_posters_rendered_total', '生成成功的海报数（每个模板一张）')
+RENDER_FAILURES = counter('postergen_render_failures_total', '生成失败的海报数（每个模板一张）')
+WARM_FAILURES = counter('postergen_warm_failures_total', '渲染进程启动预热失败的次数')
+CACHE_REQUESTS = counter(
+    'postergen_cache_requests_total', '缓存查询次数（font / font_coverage / background / plan / render）',
+    ('cache', 'result')
+)
+DRAW_SECONDS = histogram('postergen_draw_seconds', '绘制一张海报的耗时（秒）')
+ENCODE_SECONDS = histogram('postergen_encode_seconds', '缩放和编码一张海报的耗时（秒）')
+ZIP_SECONDS = histogram('postergen_zip_seconds', '打包一个任务 ZIP 的耗时（秒）', buckets=ZIP_BUCKETS)
+ZIP_BYTES = counter('postergen_zip_bytes_total', '打包的 ZIP 总字节数')
+SCHEDULER_QUEUED_ROWS = gauge('postergen_scheduler_queued_rows', '调度器中等待生成的行数')
+SCHEDULER_QUEUED_JOBS = gauge('postergen_scheduler_queued_jobs', '调度器中还没有开始的任务数')
+SCHEDULER_RUNNING_JOBS = gauge('postergen_scheduler_running_jobs', '调度器中正在生成的任务数')
+SCHEDULER_IN_FLIGHT = gauge('postergen_scheduler_in_flight_rows', '已提交给渲染进程、还没有完成的行数')
+SCHEDULER_SESSIONS = gauge('postergen_scheduler_sessions', '有任务在调度器中的会话数')
+
+
+def cache_hit(cache, hit):
+    """记录一次缓存查询"""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics 返回 Prometheus 文本格式的指标"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = REGISTRY.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不把每次采集请求打印到服务日志
+        pass
+
+
+def start_http_server(port, host=DEFAULT_HOST):
+    """
+    在后台线程中监听 HTTP 端口，提供 /metrics
+
+    Args:
+        port: 端口（0 表示自动选择空闲端口）
+        host: 监听地址
+
+    Returns:
+        ThreadingHTTPServer 对象（server_address 为实际监听的地址和端口）
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='postergen-metrics', daemon=True).start()
+    return server
+
+
+def write_file(path):
+    """把当前指标原子地写入文件（先写临时文件再替换，采集方不会读到写了一半的文件）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(REGISTRY.expose())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def start_file_writer(path, interval=FILE_INTERVAL):
+    """
+    在后台线程中每 interval 秒写一次指标文件，进程退出时停止后台线程并再写一次
+
+    Args:
+        path: 指标文件路径（如 node_exporter textfile 目录下的 postergen.prom）
+        interval: 写入间隔（秒）
+
+    Returns:
+        threading.Event: 设置后后台线程停止写入
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            try:
+                write_file(path)
+            except OSError as e:
+                print(f"警告: 无法写入指标文件 {path}: {e}")
+            stop.wait(interval)
+
+    def finish():
+        stop.set()
+        try:
+            write_file(path)
+        except OSError as e:
+            print(f"警告: 无法写入指标文件 {path}: {e}")
+
+    threading.Thread(target=loop, name='postergen-metrics-file', daemon=True).start()
+    atexit.register(finish)
+    return stop
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def serve_from_env():
+    """
+    按环境变量启动导出（每个进程只启动一次，Streamlit 每次重新运行脚本时调用也没有影响）：
+    POSTERGEN_METRICS_PORT 监听 HTTP 端口，POSTERGEN_METRICS_FILE 定期写指标文件
+    """
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+        port = os.environ.get(ENV_METRICS_PORT, '').strip()
+        if port:
+            host = os.environ.get(ENV_METRICS_HOST, DEFAULT_HOST)
+            try:
+                server = start_http_server(int(port), host)
+                print(f"指标: http://{host}:{server.server_address[1]}/metrics")
+            except (OSError, ValueError) as e:
+                print(f"警告: 无法在 {host}:{port} 提供指标: {e}")
+        path = os.environ.get(ENV_METRICS_FILE, '').strip()
+        if path:
+            start_file_writer(path)
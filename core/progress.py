@@ -0,0 +1,217 @@
+"""
+进度报告模块
+按阶段统计进度（已完成数、速度、预计剩余时间、每个阶段的耗时），限制界面更新频率；
+生成失败的行集中收集，最后汇总为一张表格和可下载的错误 CSV；
+启用性能追踪时每个阶段同时记录为一个追踪区间，传入内存分析器时在阶段边界和每 N 行采样内存
+"""
+import io
+import csv
+import time
+
+from . import tracing
+
+
+# 两次界面更新之间的最短间隔（秒），每秒最多更新约 4 次
+UPDATE_INTERVAL = 0.25
+
+# 错误 CSV 的列（行号从 1 开始）
+FAILURE_COLUMNS = ('行号', '模板', '城市', '姓名', '错误')
+
+
+def format_duration(seconds):
+    """
+    格式化时长
+
+    Args:
+        seconds: 秒数
+
+    Returns:
+        str: 如 "8.5 秒"、"3 分 05 秒"、"1 小时 02 分"
+    """
+    if seconds < 60:
+        return f"{seconds:.1f} 秒"
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes < 60:
+        return f"{minutes} 分 {seconds:02d} 秒"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} 小时 {minutes:02d} 分"
+
+
+class ProgressReporter:
+    """分阶段的进度报告器：每次 advance() 只更新计数，按时间间隔节流后才调用界面回调"""
+
+    def __init__(self, on_update=None, min_interval=UPDATE_INTERVAL, clock=time.monotonic, profiler=None):
+        """
+        初始化进度报告器
+
+        Args:
+            on_update: 进度回调 on_update(snapshot)，snapshot 为 snapshot() 的返回值
+            min_interval: 两次回调之间的最短间隔（秒），阶段开始和结束时总是回调
+            clock: 计时函数
+            profiler: MemoryProfiler 对象（可选），阶段开始、结束和每次 advance() 时通知
+        """
+        self.on_update = on_update
+        self.min_interval = min_interval
+        self.clock = clock
+        self.profiler = profiler
+        # 已结束的阶段：[(阶段名, 耗时秒数, 完成数), ...]
+        self.stages = []
+        self.failures = []
+        self._stage = None
+        self._total = None
+        self._done = 0
+        self._initial = 0
+        self._started_at = None
+        self._last_update = None
+        self._span = None
+
+    def stage(self, name, total=None, done=0):
+        """
+        结束当前阶段，开始新阶段
+
+        Args:
+            name: 阶段名
+            total: 本阶段的总数（可选，没有总数时不计算进度比例和剩余时间）
+            done: 开始时已完成的数量（如继续任务时跳过的行，不计入速度）
+        """
+        self._end_stage()
+        self._stage = name
+        self._total = total
+        self._done = self._initial = done
+        self._started_at = self.clock()
+        self._span = tracing.span(f"stage:{name}", total=total)
+        if self.profiler is not None:
+            self.profiler.stage(name)
+        self._emit()
+
+    def advance(self, count=1):
+        """完成 count 个（距上次回调不足 min_interval 时不回调）"""
+        self._done += count
+        if self.profiler is not None:
+            self.profiler.tick(count)
+        if self.on_update is not None and self.clock() - self._last_update >= self.min_interval:
+            self._emit()
+
+    def fail(self, row_index, row, error, template=''):
+        """
+        记录一行生成失败
+
+        Args:
+            row_index: 行索引（从 0 开始）
+            row: 行数据（字典）
+            error: 错误信息
+            template: 模板名（可选）
+        """
+        self.failures.append({
+            '行号': row_index + 1,
+            '模板': template,
+            '城市': row.get('城市', ''),
+            '姓名': row.get('姓名', ''),
+            '错误': error,
+        })
+
+    def finish(self):
+        """结束当前阶段（传入了内存分析器时同时停止分析）"""
+        self._end_stage()
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def snapshot(self):
+        """
+        当前阶段的进度
+
+        Returns:
+            dict: {'stage', 'done', 'total', 'fraction', 'rate', 'eta', 'elapsed'}，
+            rate 为每秒完成数，eta 为预计剩余秒数（无法估计时为 None）
+        """
+        elapsed = self.clock() - self._started_at
+        processed = self._done - self._initial
+        rate = processed / elapsed if elapsed > 0 and processed else None
+        fraction = eta = None
+        if self._total:
+            fraction = min(self._done / self._total, 1.0)
+            if rate:
+                eta = max(self._total - self._done, 0) / rate
+        elif self._total == 0:
+            fraction = 1.0
+        return {
+            'stage': self._stage,
+            'done': self._done,
+            'total': self._total,
+            'fraction': fraction,
+            'rate': rate,
+            'eta': eta,
+            'elapsed': elapsed,
+        }
+
+    def summary(self):
+        """
+        各阶段耗时的一行汇总
+
+        Returns:
+            str: 如 "准备 0.3 秒 · 生成 12.1 秒（4.1 行/秒） · 打包 0.8 秒"
+        """
+        parts = []
+        for name, elapsed, done in self.stages:
+            part = f"{name} {format_duration(elapsed)}"
+            if done and elapsed > 0:
+                part += f"（{done / elapsed:.1f} 行/秒）"
+            parts.append(part)
+        return ' · '.join(parts)
+
+    def _emit(self):
+        self._last_update = self.clock()
+        if self.on_update is not None:
+            self.on_update(self.snapshot())
+
+    def _end_stage(self):
+        if self._stage is None:
+            return
+        self._emit()
+        self.stages.append((self._stage, self.clock() - self._started_at, self._done - self._initial))
+        self._span.end(done=self._done - self._initial, failures=len(self.failures))
+        if self.profiler is not None:
+            self.profiler.end_stage()
+        self._stage = None
+
+
+def format_progress(snapshot, unit='张'):
+    """
+    进度的一行文字说明
+
+    Args:
+        snapshot: ProgressReporter.snapshot() 的返回值
+        unit: 计数单位
+
+    Returns:
+        str: 如 "生成：120/500 张 · 4.2 张/秒 · 已用 28.6 秒 · 预计剩余 1 分 30 秒"，
+        没有总数和计数的阶段只显示阶段名和已用时间
+    """
+    text = snapshot['stage']
+    if snapshot['total'] is not None:
+        text += f"：{snapshot['done']}/{snapshot['total']} {unit}"
+    elif snapshot['done']:
+        text += f"：{snapshot['done']} {unit}"
+    if snapshot['rate']:
+        text += f" · {snapshot['rate']:.1f} {unit}/秒"
+    text += f" · 已用 {format_duration(snapshot['elapsed'])}"
+    if snapshot['eta'] is not None:
+        text += f" · 预计剩余 {format_duration(snapshot['eta'])}"
+    return text
+
+
+def failures_csv(failures):
+    """
+    生成失败的行 -> CSV 字节（UTF-8 带 BOM，Excel 可直接打开）
+
+    Args:
+        failures: ProgressReporter.failures
+
+    Returns:
+        bytes: CSV 内容
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FAILURE_COLUMNS)
+    writer.writeheader()
+    writer.writerows(failures)
+    return buffer.getvalue().encode('utf-8-sig')
@@ -0,0 +1,102 @@
+"""
+原始像素底图格式
+将解码后的底图以未压缩像素 + 固定长度文件头的形式保存，绘制时通过 mmap 直接映射，
+多个进程共享同一份物理内存页，无需再解码 JPEG
+"""
+import mmap
+import struct
+from PIL import Image
+
+
+# 文件头：魔数(8) + 原始模式(8) + 存储模式(8) + 宽(4) + 高(4)，补齐到 64 字节
+RAW_MAGIC = b'PGMRAW1\0'
+RAW_HEADER = struct.Struct('<8s8s8sII')
+RAW_HEADER_SIZE = 64
+
+# 原始模式 -> 文件中的存储模式
+# RGB 以 RGBX（每像素 4 字节）存储，这样 Image.frombuffer 才能直接共享内存而不复制
+STORAGE_MODES = {
+    'RGB': 'RGBX',
+    'RGBA': 'RGBA',
+    'L': 'L',
+}
+
+RAW_EXTENSION = '.raw'
+
+
+def write_raw_image(img, f):
+    """
+    将图片写为原始像素格式
+
+    Args:
+        img: PIL Image 对象（RGB / RGBA / L，其他模式会转换为 RGB）
+        f: 以二进制写模式打开的文件对象
+    """
+    if img.mode not in STORAGE_MODES:
+        img = img.convert('RGB')
+    storage_mode = STORAGE_MODES[img.mode]
+    stored = img.convert(storage_mode) if storage_mode != img.mode else img
+
+    header = RAW_HEADER.pack(
+        RAW_MAGIC,
+        img.mode.encode('ascii'),
+        storage_mode.encode('ascii'),
+        img.width,
+        img.height
+    )
+    f.write(header.ljust(RAW_HEADER_SIZE, b'\0'))
+    f.write(stored.tobytes('raw', storage_mode))
+
+
+def open_raw_image(path):
+    """
+    通过 mmap 打开原始像素格式的底图（只读、零拷贝）
+
+    Args:
+        path: 原始像素文件路径
+
+    Returns:
+        PIL Image 对象（只读，与文件映射共享内存；RGB 底图返回 RGBX 模式）
+
+    Raises:
+        ValueError: 文件格式不正确
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(mapped) < RAW_HEADER_SIZE:
+        mapped.close()
+        raise ValueError(f"原始底图文件已损坏: {path}")
+
+    magic, _, storage_mode, width, height = RAW_HEADER.unpack_from(mapped, 0)
+    storage_mode = storage_mode.rstrip(b'\0').decode('ascii')
+    if magic != RAW_MAGIC or storage_mode not in STORAGE_MODES.values():
+        mapped.close()
+        raise ValueError(f"不是有效的原始底图文件: {path}")
+
+    pixel_bytes = width * height * len(storage_mode)
+    if len(mapped) < RAW_HEADER_SIZE + pixel_bytes:
+        mapped.close()
+        raise ValueError(f"原始底图文件已损坏: {path}")
+
+    # Image 对象持有 memoryview 的引用，映射在图片被释放时随之释放
+    buffer = memoryview(mapped)[RAW_HEADER_SIZE:RAW_HEADER_SIZE + pixel_bytes]
+    return Image.frombuffer(storage_mode, (width, height), buffer, 'raw', storage_mode, 0, 1)
+
+
+def read_raw_header(path):
+    """
+    读取原始像素文件头
+
+    Args:
+        path: 原始像素文件路径
+
+    Returns:
+        (mode, (width, height)): 原始模式和尺寸
+    """
+    with open(path, 'rb') as f:
+        header = f.read(RAW_HEADER.size)
+    magic, mode, _, width, height = RAW_HEADER.unpack(header)
+    if magic != RAW_MAGIC:
+        raise ValueError(f"不是有效的原始底图文件: {path}")
+    return mode.rstrip(b'\0').decode('ascii'), (width, height)
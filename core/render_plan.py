@@ -0,0 +1,412 @@
+"""
+PosterGenMaster - 预编译渲染计划
+将模板配置一次性解析为不可变的渲染计划（字体、颜色、坐标、间距都已确定），
+逐行绘制时只处理行数据本身
+"""
+from PIL import Image, ImageColor, ImageDraw
+
+
+# max_width 为 'auto' 时，文字两侧各保留的画布宽度比例
+AUTO_FIT_MARGIN = 0.05
+
+# 自动缩小时的默认最小字号
+DEFAULT_MIN_FONT_SIZE = 12
+
+# 自动缩小结果缓存的最大条目数（超过后清空）
+FIT_CACHE_LIMIT = 50000
+
+# 文字测量缓存的最大条目数（超过后清空）
+MEASURE_CACHE_LIMIT = 100000
+
+
+class _Frozen:
+    """不可变对象基类：构造完成后禁止修改属性"""
+
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} 是不可变对象")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} 是不可变对象")
+
+
+class TextMeasurer:
+    """
+    文字测量缓存：同一字体、同一文字、同一位置只测量一次
+
+    可作为 layout() 的 textbbox 参数，在多个渲染计划（多个模板）之间共享，
+    同一份数据用不同模板渲染时，字体相同的图层不再重复测量
+    """
+
+    def __init__(self):
+        # 测量结果与画布大小和颜色模式无关，用 1x1 的画布测量
+        self._textbbox = ImageDraw.Draw(Image.new('L', (1, 1))).textbbox
+        self._cache = {}
+
+    def __call__(self, xy, text, font=None, anchor=None):
+        key = (xy, text, font, anchor)
+        bbox = self._cache.get(key)
+        if bbox is None:
+            if len(self._cache) >= MEASURE_CACHE_LIMIT:
+                self._cache.clear()
+            bbox = self._cache[key] = self._textbbox(xy, text, font=font, anchor=anchor)
+        return bbox
+
+
+class LayerPlan(_Frozen):
+    """单个文字图层的渲染参数"""
+
+    __slots__ = (
+        'font',           # 首选字体（配置字号）
+        'chain',          # 字体回退链（FontChain），首选字体缺字时按段切换字体
+        'fill', 'y', 'spacing', 'offset_y',
+        'size', 'bold',   # 配置中的字号和粗体设置
+        'max_width',      # 最大宽度（像素），超出时自动缩小字号；None 表示不限制
+        'min_size',       # 自动缩小的最小字号
+    )
+
+
+class RenderPlan(_Frozen):
+    """一个模板配置的完整渲染计划"""
+
+    __slots__ = (
+        'background',     # 底图（共享对象，绘制时复制）
+        'mode',           # 绘制画布的颜色模式
+        'canvas_size',    # 底图尺寸（图层坐标所在的坐标系）
+        'center_x',       # 画布水平中心
+        'output_size',    # 输出海报尺寸
+        'template_text',  # 模板文字（替换描述中的"喜签"）
+        'city_name',      # 城市+姓名图层（spacing 为城市与姓名的间距）
+        'desc',           # 描述图层
+        'amount',         # 金额图层
+        'unit',           # 单位图层（spacing 为与金额的水平间距，offset_y 为垂直偏移）
+        'fit_cache',      # 自动缩小结果缓存：(图层, 文字, 附加宽度) -> 字号
+    )
+
+
+def _compile_layer(layer_config, get_font_chain, font_fallbacks, mode, canvas_width, spacing_key=None, default_spacing=20):
+    """解析单个图层配置"""
+    size = layer_config['size']
+    bold = layer_config.get('bold', False)
+    chain = get_font_chain(bold, font_fallbacks)
+
+    # 最大宽度：像素值，或 'auto'（画布宽度减去两侧边距）
+    max_width = layer_config.get('max_width')
+    if max_width == 'auto':
+        max_width = canvas_width - 2 * int(canvas_width * AUTO_FIT_MARGIN)
+    elif max_width:
+        max_width = int(max_width)
+    else:
+        max_width = None
+
+    return LayerPlan(
+        font=chain.font(0, size),
+        chain=chain,
+        fill=ImageColor.getcolor(layer_config['color'], mode),
+        y=layer_config['y'],
+        spacing=layer_config.get(spacing_key, default_spacing) if spacing_key else 0,
+        offset_y=layer_config.get('offset_y', 0),
+        size=size,
+        bold=bold,
+        max_width=max_width,
+        min_size=min(size, layer_config.get('min_size', DEFAULT_MIN_FONT_SIZE))
+    )
+
+
+def compile_plan(config, fallback_layers, background, get_font_chain, output_size):
+    """
+    将模板配置编译为渲染计划
+
+    Args:
+        config: 配置字典（包含 'layers'）
+        fallback_layers: config 中没有 'layers' 时使用的图层配置
+        background: 底图（PIL Image）
+        get_font_chain: 获取字体回退链的函数 get_font_chain(bold, font_fallbacks)
+        output_size: 输出海报尺寸 (宽, 高)
+
+    Returns:
+        RenderPlan 对象
+
+    Raises:
+        KeyError: 图层配置缺少必需字段（size / y / color）
+    """
+    layers_config = config.get('layers', fallback_layers)
+
+    # RGBX 为原始像素格式的 RGB 底图，绘制时转换为 RGB
+    mode = 'RGB' if background.mode == 'RGBX' else background.mode
+
+    # 获取模板文字内容（用于替换描述中的"喜签"），为空时使用默认值"喜签"
+    template_text = '喜签'
+    if 'template_text' in layers_config:
+        template_text = layers_config['template_text'].get('text', '') or '喜签'
+
+    # 模板配置的回退字体（按优先级排列的字体文件路径）
+    font_fallbacks = tuple(config.get('font_fallbacks') or ())
+    width = background.width
+
+    return RenderPlan(
+        background=background,
+        mode=mode,
+        canvas_size=background.size,
+        center_x=background.width // 2,
+        output_size=tuple(output_size),
+        template_text=template_text,
+        city_name=_compile_layer(layers_config['city_name'], get_font_chain, font_fallbacks, mode, width, 'spacing'),
+        desc=_compile_layer(layers_config['desc'], get_font_chain, font_fallbacks, mode, width),
+        amount=_compile_layer(layers_config['amount'], get_font_chain, font_fallbacks, mode, width),
+        unit=_compile_layer(layers_config['unit'], get_font_chain, font_fallbacks, mode, width, 'spacing_x'),
+        fit_cache={}
+    )
+
+
+def _fit_font(plan, layer_name, layer, texts, extra_width, full_width, textbbox):
+    """
+    超出最大宽度时，二分查找能放下文字的最大字号
+
+    Args:
+        plan: RenderPlan 对象
+        layer_name: 图层名（缓存键）
+        layer: LayerPlan 对象
+        texts: 使用该图层字体的文字元组（宽度相加）
+        extra_width: 不随字号变化的附加宽度（如间距、单位宽度）
+        full_width: 原字号下的总宽度
+        textbbox: ImageDraw.textbbox 方法
+
+    Returns:
+        (font, size): 字体对象和字号；不需要缩小时返回原字体
+    """
+    if layer.max_width is None or full_width <= layer.max_width:
+        return layer.font, layer.size
+
+    fit_cache = plan.fit_cache
+    key = (layer_name, texts, extra_width)
+    size = fit_cache.get(key)
+    if size is None:
+        chain = layer.chain
+        low, high = layer.min_size, layer.size - 1
+        size = layer.min_size
+        while low <= high:
+            mid = (low + high) // 2
+            font = chain.font(0, mid)
+            width = extra_width
+            for text in texts:
+                bbox, _ = _measure(chain, text, font, mid, textbbox)
+                width += bbox[2] - bbox[0]
+            if width <= layer.max_width:
+                size = mid
+                low = mid + 1
+            else:
+                high = mid - 1
+        if len(fit_cache) >= FIT_CACHE_LIMIT:
+            fit_cache.clear()
+        fit_cache[key] = size
+
+    return layer.chain.font(0, size), size
+
+
+def _measure(chain, text, font, size, textbbox):
+    """
+    测量文字（首选字体缺字时按字体回退链分段）
+
+    Args:
+        chain: FontChain 对象
+        text: 文字内容
+        font: 首选字体（size 字号）
+        size: 字号
+        textbbox: ImageDraw.textbbox 方法
+
+    Returns:
+        (bbox, runs): 以 (0, 0) 为绘制起点的墨迹边界框；runs 为 None 表示整段使用首选字体，
+        否则为 ((dx, dy), 文字段, 字体) 列表，各段以基线锚点（'ls'）绘制，基线与首选字体对齐
+    """
+    segments = chain.split(text)
+    if segments is None:
+        return textbbox((0, 0), text, font=font), None
+
+    baseline = font.getmetrics()[0]
+    runs = []
+    box = None
+    x = 0
+    for index, segment in segments:
+        run_font = chain.font(index, size)
+        run_x = round(x)
+        run_box = textbbox((run_x, baseline), segment, font=run_font, anchor='ls')
+        box = run_box if box is None else (
+            min(box[0], run_box[0]), min(box[1], run_box[1]),
+            max(box[2], run_box[2]), max(box[3], run_box[3])
+        )
+        runs.append(((run_x, baseline), segment, run_font))
+        x += run_font.getlength(segment)
+    return box, runs
+
+
+def _place_runs(runs, x, y):
+    """将分段的相对坐标平移到绘制坐标"""
+    if runs is None:
+        return None
+    return tuple(((x + dx, y + dy), segment, font) for (dx, dy), segment, font in runs)
+
+
+def layout(plan, data_row, textbbox):
+    """
+    计算一行数据的完整排版（不绘制）
+
+    Args:
+        plan: RenderPlan 对象
+        data_row: 字典或 pandas Series，包含 '城市', '姓名', '描述', '金额', '单位' 等字段
+        textbbox: ImageDraw.textbbox 方法（用于测量文字）
+
+    Returns:
+        list: 按绘制顺序排列的文字项，每项为
+            (图层名, 文字, 绘制坐标 (x, y), 字体, 颜色, 墨迹边界框 (left, top, right, bottom), 字号, 分段)；
+            配置了 max_width 的图层超宽时字号会自动缩小；分段为 None 表示整段使用首选字体，
+            否则为 ((x, y), 文字段, 字体) 元组，各段以基线锚点（'ls'）绘制
+    """
+    center_x = plan.center_x
+
+    # 1. 城市+姓名（同一行，整体居中）
+    city = str(data_row.get('城市', ''))
+    name = str(data_row.get('姓名', ''))
+    layer = plan.city_name
+    chain = layer.chain
+    city_bbox, city_runs = _measure(chain, city, layer.font, layer.size, textbbox)
+    name_bbox, name_runs = _measure(chain, name, layer.font, layer.size, textbbox)
+    city_width = city_bbox[2] - city_bbox[0]
+    name_width = name_bbox[2] - name_bbox[0]
+    city_name_font, city_name_size = _fit_font(
+        plan, 'city_name', layer, (city, name), layer.spacing,
+        city_width + layer.spacing + name_width, textbbox
+    )
+    if city_name_font is not layer.font:
+        city_bbox, city_runs = _measure(chain, city, city_name_font, city_name_size, textbbox)
+        name_bbox, name_runs = _measure(chain, name, city_name_font, city_name_size, textbbox)
+        city_width = city_bbox[2] - city_bbox[0]
+        name_width = name_bbox[2] - name_bbox[0]
+    city_x = center_x - (city_width + layer.spacing + name_width) // 2
+    name_x = city_x + city_width + layer.spacing
+
+    # 2. 描述（居中），"喜签"替换为模板文字
+    desc = str(data_row.get('描述', ''))
+    if '喜签' in desc:
+        desc = desc.replace('喜签', plan.template_text)
+    desc_layer = plan.desc
+    desc_bbox, desc_runs = _measure(desc_layer.chain, desc, desc_layer.font, desc_layer.size, textbbox)
+    desc_font, desc_size = _fit_font(
+        plan, 'desc', desc_layer, (desc,), 0, desc_bbox[2] - desc_bbox[0], textbbox
+    )
+    if desc_font is not desc_layer.font:
+        desc_bbox, desc_runs = _measure(desc_layer.chain, desc, desc_font, desc_size, textbbox)
+    desc_x = center_x - (desc_bbox[2] - desc_bbox[0]) // 2
+
+    # 3. 金额+单位作为整体居中，单位底部与金额底部对齐后加上偏移量（超宽时只缩小金额）
+    amount = str(data_row.get('金额', ''))
+    unit = str(data_row.get('单位', ''))
+    amount_layer = plan.amount
+    unit_layer = plan.unit
+    amount_bbox, amount_runs = _measure(amount_layer.chain, amount, amount_layer.font, amount_layer.size, textbbox)
+    unit_bbox, unit_runs = _measure(unit_layer.chain, unit, unit_layer.font, unit_layer.size, textbbox)
+    unit_width = unit_bbox[2] - unit_bbox[0]
+    unit_height = unit_bbox[3] - unit_bbox[1]
+    amount_font, amount_size = _fit_font(
+        plan, 'amount', amount_layer, (amount,), unit_layer.spacing + unit_width,
+        amount_bbox[2] - amount_bbox[0] + unit_layer.spacing + unit_width, textbbox
+    )
+    if amount_font is not amount_layer.font:
+        amount_bbox, amount_runs = _measure(amount_layer.chain, amount, amount_font, amount_size, textbbox)
+    amount_width = amount_bbox[2] - amount_bbox[0]
+    amount_height = amount_bbox[3] - amount_bbox[1]
+
+    amount_x = center_x - (amount_width + unit_layer.spacing + unit_width) // 2
+    amount_y = amount_layer.y - amount_height // 2
+    unit_x = amount_x + amount_width + unit_layer.spacing
+    unit_y = amount_y + amount_height - unit_height + unit_layer.offset_y
+
+    return [
+        ('city', city, (city_x, layer.y), city_name_font, layer.fill,
+         _offset_box(city_bbox, city_x, layer.y), city_name_size,
+         _place_runs(city_runs, city_x, layer.y)),
+        ('name', name, (name_x, layer.y), city_name_font, layer.fill,
+         _offset_box(name_bbox, name_x, layer.y), city_name_size,
+         _place_runs(name_runs, name_x, layer.y)),
+        ('desc', desc, (desc_x, desc_layer.y), desc_font, desc_layer.fill,
+         _offset_box(desc_bbox, desc_x, desc_layer.y), desc_size,
+         _place_runs(desc_runs, desc_x, desc_layer.y)),
+        ('amount', amount, (amount_x, amount_y), amount_font, amount_layer.fill,
+         _offset_box(amount_bbox, amount_x, amount_y), amount_size,
+         _place_runs(amount_runs, amount_x, amount_y)),
+        ('unit', unit, (unit_x, unit_y), unit_layer.font, unit_layer.fill,
+         _offset_box(unit_bbox, unit_x, unit_y), unit_layer.size,
+         _place_runs(unit_runs, unit_x, unit_y)),
+    ]
+
+
+def _offset_box(bbox, x, y):
+    """将以 (0, 0) 测量的边界框平移到绘制坐标"""
+    return (bbox[0] + x, bbox[1] + y, bbox[2] + x, bbox[3] + y)
+
+
+def execute(plan, data_row, textbbox=None):
+    """
+    按渲染计划绘制一张海报
+
+    Args:
+        plan: RenderPlan 对象
+        data_row: 字典或 pandas Series，包含 '城市', '姓名', '描述', '金额', '单位' 等字段
+        textbbox: 测量文字的函数（可选，如 TextMeasurer），默认使用画布的 textbbox
+
+    Returns:
+        绘制好的 Image 对象
+    """
+    background = plan.background
+    # 创建底图的副本，避免修改原图（RGBX 转换为 RGB 时即完成复制）
+    img = background.convert('RGB') if background.mode == 'RGBX' else background.copy()
+    draw = ImageDraw.Draw(img)
+
+    for _, text, position, font, fill, _, _, runs in layout(plan, data_row, textbbox or draw.textbbox):
+        if runs is None:
+            draw.text(position, text, fill=fill, font=font)
+            continue
+        # 首选字体缺字时逐段绘制（各段基线对齐）
+        for run_position, segment, run_font in runs:
+            draw.text(run_position, segment, fill=fill, font=run_font, anchor='ls')
+
+    # 调整为输出尺寸，底图已是输出尺寸时无需缩放
+    if img.size == plan.output_size:
+        return img
+    return img.resize(plan.output_size, Image.Resampling.LANCZOS)
+
+
+def scale_outputs(image, output_sizes):
+    """
+    从一张渲染好的海报生成多个尺寸（级联缩小）
+
+    按面积从大到小依次生成，每个尺寸从已生成的、两边都不小于目标的最小图片缩小：
+    先用 Image.reduce 做整数倍的盒式缩小（代价很低），剩余的非整数倍部分再用双三次插值，
+    额外尺寸的代价只是主图渲染的一小部分
+
+    Args:
+        image: 渲染好的海报（Image 对象，通常为输出尺寸）
+        output_sizes: 输出尺寸列表 [(宽, 高), ...]
+
+    Returns:
+        list: 与 output_sizes 顺序一致的 Image 对象列表（与原图尺寸相同的直接返回原图）
+    """
+    produced = {image.size: image}
+    for size in sorted(set(map(tuple, output_sizes)), key=lambda s: s[0] * s[1], reverse=True):
+        if size in produced:
+            continue
+        width, height = size
+        candidates = [img for img in produced.values() if img.width >= width and img.height >= height]
+        source = min(candidates, key=lambda img: img.width * img.height) if candidates else image
+
+        factor = min(source.width // width, source.height // height)
+        if factor >= 2:
+            source = source.reduce(factor)
+        produced[size] = source if source.size == size else source.resize(size, Image.Resampling.BICUBIC)
+    return [produced[tuple(size)] for size in output_sizes]
+
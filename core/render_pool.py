@@ -0,0 +1,295 @@
+"""
+并行渲染模块
+每个模板的底图放入共享内存，渲染进程零拷贝挂载后绘制海报，只把编码后的图片字节返回给主进程
+"""
+import io
+import os
+import math
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from PIL import Image
+
+from . import metrics, tracing
+from .drawer import PosterDrawer
+from .render_plan import scale_outputs
+from .raw_image import STORAGE_MODES
+
+
+# 每个渲染进程至少分到的行数，行数太少时并行的启动开销不划算
+MIN_ROWS_PER_WORKER = 8
+
+# 渲染进程内的全局状态（由 _init_worker 设置）
+_worker_drawer = None
+_worker_plans = []
+_worker_shms = []
+_worker_image_format = 'PNG'
+_worker_output_sizes = None
+_worker_trace = False
+
+
+class SharedBackground:
+    """放在共享内存中的底图（每个模板一份，由主进程创建和释放）"""
+
+    def __init__(self, image):
+        """
+        将底图复制到新建的共享内存块
+
+        Args:
+            image: PIL Image 对象（已包含所有静态图层的底图）
+        """
+        # 共享内存中按 Image.frombuffer 可直接映射的布局存放（RGB 存为 RGBX）
+        storage_mode = STORAGE_MODES.get(image.mode, image.mode)
+        if storage_mode not in STORAGE_MODES.values():
+            image, storage_mode = image.convert('RGB'), 'RGBX'
+        data = image.tobytes('raw', storage_mode)
+
+        self.mode = storage_mode
+        self.size = image.size
+        self._shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        self._shm.buf[:len(data)] = data
+
+    @property
+    def descriptor(self):
+        """传给渲染进程的描述信息：(共享内存名称, 模式, 尺寸)"""
+        return (self._shm.name, self.mode, self.size)
+
+    @staticmethod
+    def attach(descriptor):
+        """
+        在渲染进程中挂载共享内存中的底图（只读、零拷贝）
+
+        Args:
+            descriptor: SharedBackground.descriptor
+
+        Returns:
+            (SharedMemory, Image): 共享内存句柄（需保持引用）和底图
+        """
+        name, mode, size = descriptor
+        try:
+            # Python 3.13+：挂载方不登记到 resource_tracker，由创建方负责释放
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        pixel_bytes = size[0] * size[1] * len(mode)
+        image = Image.frombuffer(mode, size, shm.buf[:pixel_bytes], 'raw', mode, 0, 1)
+        return shm, image
+
+    def close(self):
+        """释放共享内存（可重复调用）"""
+        if self._shm is None:
+            return
+        try:
+            self._shm.close()
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def default_worker_count(row_count):
+    """
+    根据行数和 CPU 核数决定渲染进程数
+
+    Args:
+        row_count: 待渲染行数
+
+    Returns:
+        int: 渲染进程数，1 表示在当前进程内顺序渲染
+    """
+    cpu_count = os.cpu_count() or 1
+    return max(1, min(cpu_count, math.ceil(row_count / MIN_ROWS_PER_WORKER)))
+
+
+def _init_worker(templates, font_path, bold_font_path, image_format, output_sizes, trace=False):
+    """渲染进程初始化：挂载所有模板的共享底图，用同一个绘制器（共享字体和文字测量）编译渲染计划"""
+    global _worker_drawer, _worker_plans, _worker_shms, _worker_image_format, _worker_output_sizes, _worker_trace
+    _worker_drawer = PosterDrawer(font_path=font_path, bold_font_path=bold_font_path)
+    _worker_plans = []
+    _worker_shms = []
+    for descriptor, config in templates:
+        shm, background = SharedBackground.attach(descriptor)
+        _worker_shms.append(shm)
+        _worker_plans.append(_compile_plan(_worker_drawer, config, background))
+    _worker_image_format = image_format
+    _worker_output_sizes = output_sizes
+    _worker_trace = trace
+
+
+def _compile_plan(drawer, config, background):
+    """编译渲染计划；配置有误时返回异常对象，由每行的渲染结果报告错误"""
+    try:
+        return drawer.compile(config, background)
+    except Exception as e:
+        return e
+
+
+def encode_image(image, image_format='PNG'):
+    """将海报编码为图片字节"""
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def _render_row(drawer, plans, index, row, image_format, output_sizes=None):
+    """
+    用每个模板的渲染计划绘制并编码一行，返回 (索引, [(图片字节, 错误信息), ...])；
+    指定了 output_sizes 时图片字节为按尺寸顺序排列的元组
+    """
+    results = []
+    for template_index, plan in enumerate(plans):
+        if isinstance(plan, Exception):
+            results.append((None, str(plan)))
+            metrics.RENDER_FAILURES.inc()
+            continue
+        try:
+            start = time.perf_counter()
+            with tracing.span('draw', row=index, template=template_index):
+                image = drawer.execute(plan, row)
+            drawn = time.perf_counter()
+            metrics.DRAW_SECONDS.observe(drawn - start)
+            if output_sizes is None:
+                with tracing.span('encode', row=index, template=template_index) as encode_span:
+                    image_bytes = encode_image(image, image_format)
+                    encode_span.set(bytes=len(image_bytes))
+            else:
+                with tracing.span('resize', row=index, template=template_index, sizes=len(output_sizes)):
+                    images = scale_outputs(image, output_sizes)
+                with tracing.span('encode', row=index, template=template_index) as encode_span:
+                    image_bytes = tuple(encode_image(img, image_format) for img in images)
+                    encode_span.set(bytes=sum(len(data) for data in image_bytes))
+            metrics.ENCODE_SECONDS.observe(time.perf_counter() - drawn)
+            metrics.POSTERS_RENDERED.inc()
+            results.append((image_bytes, None))
+        except Exception as e:
+            results.append((None, str(e)))
+            metrics.RENDER_FAILURES.inc()
+    return index, results
+
+
+def _render_row_traced(drawer, plans, index, row, image_format, output_sizes=None):
+    """渲染进程中启用追踪时：渲染一行并收集区间事件，返回 (索引, 结果, 事件列表)"""
+    with tracing.collect() as events:
+        index, results = _render_row(drawer, plans, index, row, image_format, output_sizes)
+    return index, results, events
+
+
+def _render_in_worker(task):
+    """
+    渲染进程中执行的任务：task 为 (索引, 行数据)，
+    返回 (索引, 结果, 区间事件列表（没有启用追踪时为 None）, 渲染进程中记录的指标)
+    """
+    index, row = task
+    events = None
+    if _worker_trace:
+        index, results, events = _render_row_traced(
+            _worker_drawer, _worker_plans, index, row, _worker_image_format, _worker_output_sizes
+        )
+    else:
+        index, results = _render_row(
+            _worker_drawer, _worker_plans, index, row, _worker_image_format, _worker_output_sizes
+        )
+    return index, results, events, metrics.drain()
+
+
+def render_batch(drawer, templates, rows, workers=None, image_format='PNG', mp_context='spawn', output_sizes=None):
+    """
+    用多个模板批量渲染同一份数据，按输入顺序逐行产出结果
+
+    所有模板共用一个进程池：每个模板的底图各放入共享内存一次，渲染进程用同一个绘制器
+    编译所有模板的渲染计划（字体和文字测量结果在模板之间共享）；任务按行分发，
+    每行数据只传递一次，在渲染进程中依次用每个模板绘制。无论正常结束、出错还是被中途关闭（取消），
+    进程池和共享内存都会被释放。
+
+    Args:
+        drawer: PosterDrawer 实例（提供字体和默认配置）
+        templates: 模板列表，每项为 (底图 PIL Image, 配置字典)
+        rows: 行数据列表（字典）
+        workers: 渲染进程数，None 表示自动决定，1 表示在当前进程内顺序渲染
+        image_format: 输出图片格式
+        mp_context: 多进程启动方式（默认 spawn，避免在多线程的 Streamlit 进程中 fork）
+        output_sizes: 输出尺寸列表 [(宽, 高), ...]（可选），每张海报只绘制一次，再级联缩小为各个尺寸
+
+    Yields:
+        (index, results): 行索引和按模板顺序排列的结果列表，
+        每项为 (图片字节, 错误信息)，成功时错误信息为 None，失败时图片字节为 None；
+        指定了 output_sizes 时图片字节为与 output_sizes 顺序一致的元组
+    """
+    rows = [dict(row) for row in rows]
+    if workers is None:
+        workers = default_worker_count(len(rows) * len(templates))
+
+    if workers <= 1:
+        plans = [_compile_plan(drawer, config, background) for background, config in templates]
+        for index, row in enumerate(rows):
+            yield _render_row(drawer, plans, index, row, image_format, output_sizes)
+        return
+
+    # 启用追踪时，渲染进程记录的区间随结果带回，加入当前线程的追踪器
+    tracer = tracing.current_tracer()
+
+    shared_backgrounds = []
+    executor = None
+    try:
+        for background, _ in templates:
+            shared_backgrounds.append(SharedBackground(background))
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(mp_context),
+            initializer=_init_worker,
+            initargs=(
+                [(shared.descriptor, config) for shared, (_, config) in zip(shared_backgrounds, templates)],
+                drawer.font_path, drawer.bold_font_path, image_format, output_sizes, tracer is not None
+            )
+        )
+        tasks = enumerate(rows)
+        chunksize = max(1, min(32, len(rows) // (workers * 4)))
+        for index, results, events, metrics_delta in executor.map(_render_in_worker, tasks, chunksize=chunksize):
+            if events:
+                tracer.add_events(events)
+            metrics.merge(metrics_delta)
+            yield index, results
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        for shared in shared_backgrounds:
+            shared.close()
+
+
+def render_posters(drawer, rows, config=None, workers=None, image_format='PNG', mp_context='spawn'):
+    """
+    批量渲染海报，按输入顺序逐个产出结果
+
+    多进程渲染时，底图只放入共享内存一次，渲染进程零拷贝挂载；任务中只传递行数据，
+    返回的只有编码后的图片字节。无论正常结束、出错还是被中途关闭（取消），
+    进程池和共享内存都会被释放。
+
+    Args:
+        drawer: PosterDrawer 实例（提供底图、字体和默认配置）
+        rows: 行数据列表（字典）
+        config: 配置字典，如果为 None 则使用 drawer 的配置
+        workers: 渲染进程数，None 表示自动决定，1 表示在当前进程内顺序渲染
+        image_format: 输出图片格式
+        mp_context: 多进程启动方式（默认 spawn，避免在多线程的 Streamlit 进程中 fork）
+
+    Yields:
+        (index, image_bytes, error): 行索引、图片字节（失败时为 None）、错误信息（成功时为 None）
+
+    Raises:
+        FileNotFoundError: 底图文件不存在
+    """
+    if config is None:
+        config = drawer.config
+
+    # 在主进程中加载一次底图（底图不存在时直接报错，不启动进程池）
+    templates = [(drawer.load_background(), config)]
+    for index, results in render_batch(drawer, templates, rows, workers, image_format, mp_context):
+        image_bytes, error = results[0]
+        yield index, image_bytes, error
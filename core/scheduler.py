@@ -0,0 +1,636 @@
+"""
+渲染调度模块
+同一个服务进程中的所有会话把渲染任务提交给同一个调度器，由一个共享的进程池按行执行：
+会话之间公平分配渲染进程，小任务优先，并限制每个会话排队的行数和缓存的结果大小。
+进程池可以在服务启动时预热（预先启动渲染进程、加载字体和默认模板），空闲超时后停止，
+每个进程平均执行一定行数后整体更换，限制渲染进程的内存增长
+"""
+import os
+import time
+import atexit
+import functools
+import itertools
+import threading
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import metrics, tracing
+from .drawer import PosterDrawer, merge_template_config
+from .render_pool import SharedBackground, _compile_plan, _render_row, _render_row_traced, encode_image
+
+
+# 行数不超过此值的任务优先调度（在大任务的行之间插队）
+SMALL_JOB_ROWS = 50
+
+# 每个会话同时排队和生成的最大行数
+DEFAULT_SESSION_ROW_LIMIT = 20000
+
+# 每个会话已生成、但还没有被取走的结果最多占用的内存，超过时暂停调度该会话的行
+DEFAULT_SESSION_MEMORY_LIMIT = 512 * 1024 * 1024
+
+# 每个渲染进程预先分配的行数（保证进程在两行之间不空闲）
+TASKS_PER_WORKER = 2
+
+# 等待结果时报告排队位置的间隔（秒）
+QUEUE_POLL_INTERVAL = 0.5
+
+# 调度器配置的环境变量（服务器部署时设置）
+ENV_MAX_WORKERS = 'POSTERGEN_MAX_WORKERS'
+ENV_SESSION_ROW_LIMIT = 'POSTERGEN_SESSION_ROW_LIMIT'
+ENV_SESSION_MEMORY_MB = 'POSTERGEN_SESSION_MEMORY_MB'
+
+# 渲染进程池的环境变量：启动服务时预热（如 POSTERGEN_WARM_POOL=1）、空闲多少秒后停止、
+# 每个渲染进程平均执行多少行后更换进程池（0 表示不停止 / 不更换）
+ENV_WARM_POOL = 'POSTERGEN_WARM_POOL'
+ENV_WORKER_IDLE_SECONDS = 'POSTERGEN_WORKER_IDLE_SECONDS'
+ENV_WORKER_MAX_TASKS = 'POSTERGEN_WORKER_MAX_TASKS'
+
+# 预热时绘制一次的数据行（加载常用字号的字体、字形和文字测量）
+WARM_ROW = {'城市': '湖北', '姓名': '朱玉珍', '描述': '喜签趸交保单', '金额': '20', '单位': '万'}
+
+# 渲染进程内的状态：(字体, 粗体字体) -> 绘制器；任务上下文ID -> (共享内存句柄列表, 渲染计划列表)
+_worker_drawers = {}
+_worker_contexts = {}
+
+
+class SchedulerLimitError(ValueError):
+    """会话排队的行数超过限制"""
+
+
+def _context_plans(context):
+    """渲染进程中获取任务上下文的渲染计划（每个上下文只挂载底图、编译一次）"""
+    context_id, templates, font_path, bold_font_path = context[:4]
+    cached = _worker_contexts.get(context_id)
+    if cached is not None:
+        return cached[1]
+
+    drawer_key = (font_path, bold_font_path)
+    drawer = _worker_drawers.get(drawer_key)
+    if drawer is None:
+        drawer = _worker_drawers[drawer_key] = PosterDrawer(font_path=font_path, bold_font_path=bold_font_path)
+
+    shms = []
+    plans = []
+    for descriptor, config in templates:
+        shm, background = SharedBackground.attach(descriptor)
+        shms.append(shm)
+        plans.append(_compile_plan(drawer, config, background))
+    _worker_contexts[context_id] = (shms, plans)
+    return plans
+
+
+def _release_contexts(context_ids=None):
+    """渲染进程中释放任务上下文：先释放引用共享内存的渲染计划，再关闭共享内存"""
+    for context_id in list(_worker_contexts) if context_ids is None else context_ids:
+        shms, plans = _worker_contexts.pop(context_id)
+        del plans
+        for shm in shms:
+            try:
+                shm.close()
+            except BufferError:
+                pass
+
+
+atexit.register(_release_contexts)
+
+
+def _warm_worker(font_path, bold_font_path, templates):
+    """
+    渲染进程启动时预热：加载字体，用预热模板编译渲染计划并绘制、编码一次，
+    第一行不再等待字体加载、底图解码和文字测量（预热失败打印警告并计入 postergen_warm_failures_total，不影响渲染进程）
+
+    Args:
+        font_path: 字体路径（与任务使用的路径相同，预热的绘制器供之后的任务共用）
+        bold_font_path: 粗体字体路径
+        templates: 预热模板列表，每项为 (底图路径, 配置字典)
+    """
+    failed = False
+    try:
+        drawer_key = (font_path, bold_font_path)
+        drawer = _worker_drawers.get(drawer_key)
+        if drawer is None:
+            drawer = _worker_drawers[drawer_key] = PosterDrawer(font_path=font_path, bold_font_path=bold_font_path)
+        for background_path, config in templates:
+            # 底图只在预热时使用（任务的底图来自共享内存），不保存在共用绘制器的缓存中
+            background = PosterDrawer(background_path=background_path).load_background()
+            encode_image(drawer.execute(drawer.compile(config, background), WARM_ROW))
+    except Exception as e:
+        print(f"警告: 渲染进程预热失败: {e}")
+        failed = True
+    # 预热产生的缓存指标不计入任务；预热失败的次数随之后的第一个任务结果带回主进程
+    metrics.drain()
+    if failed:
+        metrics.WARM_FAILURES.inc()
+
+
+def _warm_ping():
+    """空任务：同时提交多个，让进程池一次启动所有渲染进程；返回渲染进程中记录的指标（如预热失败次数）"""
+    return metrics.drain()
+
+
+def _merge_ping_metrics(future):
+    """空任务完成时合并渲染进程带回的指标"""
+    if not future.cancelled() and future.exception() is None:
+        metrics.merge(future.result())
+
+
+def _run_task(task):
+    """
+    渲染进程中执行的任务：task 为 (任务上下文, 仍在运行的上下文ID, 行索引, 行数据, 是否追踪)，
+    返回 (行索引, 结果, 区间事件列表, 渲染进程中记录的指标)
+    """
+    context, live_ids, index, row, trace = task
+
+    # 释放已结束任务的底图和渲染计划（ID 比所有仍在运行的任务都大的，是提交本行之后才开始的任务，保留）
+    newest_id = max(live_ids)
+    _release_contexts([
+        context_id for context_id in _worker_contexts if context_id not in live_ids and context_id < newest_id
+    ])
+
+    _, _, font_path, bold_font_path, image_format, output_sizes = context
+    plans = _context_plans(context)
+    drawer = _worker_drawers[(font_path, bold_font_path)]
+    events = None
+    if trace:
+        index, results, events = _render_row_traced(drawer, plans, index, row, image_format, output_sizes)
+    else:
+        index, results = _render_row(drawer, plans, index, row, image_format, output_sizes)
+    return index, results, events, metrics.drain()
+
+
+def _result_size(results):
+    """一行结果中图片字节的总大小"""
+    size = 0
+    for image_bytes, _ in results:
+        if isinstance(image_bytes, tuple):
+            size += sum(len(data) for data in image_bytes)
+        elif image_bytes:
+            size += len(image_bytes)
+    return size
+
+
+class _ScheduledJob:
+    """调度器中的一个渲染任务（一个会话的一次批量生成）"""
+
+    def __init__(self, job_id, session_id, drawer, templates, rows, image_format, output_sizes, trace=False):
+        self.job_id = job_id
+        self.session_id = session_id
+        self.drawer = drawer
+        self.templates = templates
+        self.row_count = len(rows)
+        self.image_format = image_format
+        self.output_sizes = output_sizes
+        self.trace = trace
+        self.pending = deque(enumerate(rows))
+        # 行索引 -> (结果, 字节数, 区间事件)：已生成、还没有被取走的结果
+        self.results = {}
+        self.buffered_bytes = 0
+        self.in_flight = 0
+        self.closed = False
+        # 第一行开始生成时创建（共享内存底图和传给渲染进程的上下文）
+        self.shared_backgrounds = None
+        self.context = None
+
+    @property
+    def started(self):
+        return self.context is not None
+
+    @property
+    def is_small(self):
+        return self.row_count <= SMALL_JOB_ROWS
+
+    def start(self):
+        """把底图放入共享内存，创建传给渲染进程的上下文"""
+        self.shared_backgrounds = []
+        for background, _ in self.templates:
+            self.shared_backgrounds.append(SharedBackground(background))
+        self.context = (
+            self.job_id,
+            [(shared.descriptor, config) for shared, (_, config) in zip(self.shared_backgrounds, self.templates)],
+            self.drawer.font_path, self.drawer.bold_font_path, self.image_format, self.output_sizes
+        )
+
+    def release(self):
+        """释放共享内存底图"""
+        for shared in self.shared_backgrounds or ():
+            shared.close()
+        self.shared_backgrounds = None
+
+
+class RenderScheduler:
+    """进程级渲染调度器：所有会话共享一个渲染进程池，按公平份额和小任务优先逐行调度"""
+
+    def __init__(self, max_workers=None, session_row_limit=DEFAULT_SESSION_ROW_LIMIT,
+                 session_memory_limit=DEFAULT_SESSION_MEMORY_LIMIT, mp_context='spawn',
+                 idle_timeout=0, max_tasks_per_worker=0):
+        """
+        初始化调度器（渲染进程池在预热或第一次提交任务时启动）
+
+        Args:
+            max_workers: 同时运行的渲染进程数，默认为 CPU 核数
+            session_row_limit: 每个会话同时排队和生成的最大行数
+            session_memory_limit: 每个会话已生成、还没有被取走的结果最多占用的字节数
+            mp_context: 多进程启动方式（默认 spawn，避免在多线程的 Streamlit 进程中 fork）
+            idle_timeout: 没有任务时渲染进程池保留的秒数，超时后停止进程池释放内存（0 表示一直保留）
+            max_tasks_per_worker: 进程池平均每个渲染进程执行多少行后整体更换（0 表示不更换）；
+                之后的行提交给新进程池，旧进程池执行完已提交的行后退出
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.session_row_limit = session_row_limit
+        self.session_memory_limit = session_memory_limit
+        self.mp_context = mp_context
+        self.idle_timeout = idle_timeout
+        self.max_tasks_per_worker = max_tasks_per_worker
+
+        self._condition = threading.Condition()
+        self._jobs = []
+        self._job_ids = itertools.count(1)
+        self._in_flight = 0
+        self._executor = None
+        # 当前进程池已提交的行数（用于更换进程池）和最后一次有任务活动的时间（用于空闲超时）
+        self._executor_tasks = 0
+        self._last_active = time.monotonic()
+        # 预热参数 (字体, 粗体字体, 预热模板)，预热后新建的进程池都用它初始化渲染进程
+        self._warm_args = None
+        self._dispatcher = None
+        self._shutdown = False
+
+    def render(self, session_id, drawer, templates, rows, image_format='PNG', output_sizes=None, on_queue=None):
+        """
+        提交渲染任务，按输入顺序逐行产出结果（与 render_pool.render_batch 的产出相同）
+
+        生成器被关闭（会话取消或页面重新运行）时，任务中还没有开始的行会被撤销。
+
+        Args:
+            session_id: 会话标识（公平分配的单位）
+            drawer: PosterDrawer 实例（提供字体）
+            templates: 模板列表，每项为 (底图 PIL Image, 配置字典)
+            rows: 行数据列表（字典）
+            image_format: 输出图片格式
+            output_sizes: 输出尺寸列表（可选）
+            on_queue: 排队时的回调 on_queue(position)，position 为前面还在等待的任务数 + 1，
+                在调用方线程中每 QUEUE_POLL_INTERVAL 秒调用一次
+
+        Yields:
+            (index, results): 行索引和按模板顺序排列的结果列表
+
+        Raises:
+            SchedulerLimitError: 会话排队的行数超过限制
+        """
+        rows = [dict(row) for row in rows]
+        if not rows:
+            return
+        # 启用追踪时，渲染进程记录的区间随结果带回，加入调用方线程的追踪器
+        tracer = tracing.current_tracer()
+        job = self._submit(session_id, drawer, templates, rows, image_format, output_sizes, tracer is not None)
+        try:
+            for index in range(len(rows)):
+                while True:
+                    with self._condition:
+                        result = job.results.pop(index, None)
+                        if result is None:
+                            self._condition.wait(QUEUE_POLL_INTERVAL)
+                            result = job.results.pop(index, None)
+                        if result is not None:
+                            job.buffered_bytes -= result[1]
+                            self._condition.notify_all()
+                            break
+                        position = None if job.started else self._queue_position(job)
+                    if position is not None and on_queue is not None:
+                        on_queue(position)
+                if result[2]:
+                    tracer.add_events(result[2])
+                yield index, result[0]
+        finally:
+            self._close(job)
+
+    def session_renderer(self, session_id, on_queue=None):
+        """
+        返回与 render_pool.render_batch 签名相同的渲染函数（用于 BatchJob.run 的 renderer 参数）
+
+        Args:
+            session_id: 会话标识
+            on_queue: 排队时的回调 on_queue(position)
+
+        Returns:
+            callable: renderer(drawer, templates, rows, workers=None, image_format='PNG', output_sizes=None)，
+            workers 被忽略（渲染进程数由调度器统一分配）
+        """
+        def renderer(drawer, templates, rows, workers=None, image_format='PNG', output_sizes=None):
+            return self.render(session_id, drawer, templates, rows, image_format, output_sizes, on_queue)
+        return renderer
+
+    @property
+    def warmed(self):
+        """是否已经预热过"""
+        return self._warm_args is not None
+
+    def warm(self, font_path, bold_font_path, templates=()):
+        """
+        启动渲染进程池并预热：所有渲染进程在后台启动，启动时加载字体、编译并绘制一次预热模板
+        （之后因空闲超时或更换而重新创建的进程池同样预热）。不等待预热完成
+
+        Args:
+            font_path: 字体路径
+            bold_font_path: 粗体字体路径
+            templates: 预热模板列表，每项为 (底图路径, 配置字典)
+
+        Returns:
+            bool: 是否开始预热（已经预热过或调度器已停止时为 False）
+        """
+        with self._condition:
+            if self._shutdown or self._warm_args is not None:
+                return False
+            self._warm_args = (font_path, bold_font_path, tuple(templates))
+            if self._executor is None:
+                self._new_executor()
+            executor = self._executor
+            self._last_active = time.monotonic()
+            self._start_dispatcher()
+            # 唤醒调度线程，按新的空闲时间计算超时
+            self._condition.notify_all()
+        self._prestart(executor)
+        return True
+
+    def status(self):
+        """
+        调度器当前状态
+
+        Returns:
+            dict: {'max_workers', 'running_jobs', 'queued_jobs', 'queued_rows', 'in_flight', 'sessions'}
+        """
+        with self._condition:
+            return {
+                'max_workers': self.max_workers,
+                'running_jobs': sum(1 for job in self._jobs if job.started),
+                'queued_jobs': sum(1 for job in self._jobs if not job.started),
+                'queued_rows': sum(len(job.pending) for job in self._jobs),
+                'in_flight': self._in_flight,
+                'sessions': len({job.session_id for job in self._jobs}),
+            }
+
+    def shutdown(self):
+        """停止调度线程和渲染进程池"""
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+            executor, self._executor = self._executor, None
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, session_id, drawer, templates, rows, image_format, output_sizes, trace=False):
+        """登记任务（检查会话的行数限制），必要时启动调度线程"""
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("调度器已停止")
+            session_rows = sum(
+                len(job.pending) + job.in_flight + len(job.results)
+                for job in self._jobs if job.session_id == session_id
+            )
+            if session_rows + len(rows) > self.session_row_limit:
+                raise SchedulerLimitError(
+                    f"每个会话最多同时生成 {self.session_row_limit} 行（当前已有 {session_rows} 行在排队或生成），"
+                    f"请等待当前任务完成或减少数据行数"
+                )
+            job = _ScheduledJob(
+                next(self._job_ids), session_id, drawer, templates, rows, image_format, output_sizes, trace
+            )
+            self._jobs.append(job)
+            self._start_dispatcher()
+            self._condition.notify_all()
+            return job
+
+    def _start_dispatcher(self):
+        """启动调度线程（调用方持有锁）"""
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='render-scheduler', daemon=True)
+            self._dispatcher.start()
+
+    def _new_executor(self):
+        """创建渲染进程池（调用方持有锁；预热过时每个渲染进程启动时预热）"""
+        initializer = {}
+        if self._warm_args is not None:
+            initializer = {'initializer': _warm_worker, 'initargs': self._warm_args}
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=multiprocessing.get_context(self.mp_context), **initializer
+        )
+        self._executor_tasks = 0
+
+    def _prestart(self, executor):
+        """同时提交 max_workers 个空任务，进程池立即在后台启动所有渲染进程（而不是在提交行时逐个启动）"""
+        try:
+            for _ in range(self.max_workers):
+                executor.submit(_warm_ping).add_done_callback(_merge_ping_metrics)
+        except RuntimeError:
+            # 进程池已经停止（调度器停止或空闲超时）
+            pass
+
+    def _idle_wait(self):
+        """
+        没有任务时检查空闲超时（调用方持有锁）：超时则停止进程池
+
+        Returns:
+            float: 距离超时的秒数，不需要计时时为 None
+        """
+        if not self.idle_timeout or self._executor is None or self._jobs or self._in_flight:
+            return None
+        remaining = self._last_active + self.idle_timeout - time.monotonic()
+        if remaining > 0:
+            return remaining
+        executor, self._executor = self._executor, None
+        executor.shutdown(wait=False)
+        return None
+
+    def _close(self, job):
+        """任务结束或被取消：撤销还没有开始的行，所有行结束后释放底图"""
+        with self._condition:
+            job.closed = True
+            job.pending.clear()
+            job.results.clear()
+            job.buffered_bytes = 0
+            if job in self._jobs:
+                self._jobs.remove(job)
+            if job.in_flight == 0:
+                job.release()
+            self._condition.notify_all()
+
+    def _session_bytes(self, session_id):
+        return sum(job.buffered_bytes for job in self._jobs if job.session_id == session_id)
+
+    def _priority(self, session_in_flight):
+        """调度顺序：小任务优先，其次是正在生成的行最少的会话（公平份额），再次是剩余行数少、提交早的任务"""
+        return lambda job: (not job.is_small, session_in_flight[job.session_id], len(job.pending), job.job_id)
+
+    def _queue_position(self, job):
+        """还没有开始的任务在等待队列中的位置（从 1 开始）"""
+        session_in_flight = Counter()
+        for other in self._jobs:
+            session_in_flight[other.session_id] += other.in_flight
+        priority = self._priority(session_in_flight)
+        key = priority(job)
+        return 1 + sum(1 for other in self._jobs if not other.started and other is not job and priority(other) < key)
+
+    def _next_job(self):
+        """选出下一行要调度的任务（没有可调度的行时返回 None）"""
+        session_in_flight = Counter()
+        for job in self._jobs:
+            session_in_flight[job.session_id] += job.in_flight
+        candidates = [
+            job for job in self._jobs
+            if job.pending and self._session_bytes(job.session_id) < self.session_memory_limit
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=self._priority(session_in_flight))
+
+    def _dispatch_loop(self):
+        """调度线程：渲染进程有空闲时，按优先级把下一行提交给进程池"""
+        capacity = self.max_workers * TASKS_PER_WORKER
+        while True:
+            with self._condition:
+                while not self._shutdown:
+                    job = self._next_job() if self._in_flight < capacity else None
+                    if job is not None:
+                        break
+                    self._condition.wait(self._idle_wait())
+                if self._shutdown:
+                    return
+
+                if not job.started:
+                    try:
+                        job.start()
+                    except Exception as e:
+                        # 底图无法放入共享内存：该任务的所有行都报告错误
+                        job.release()
+                        while job.pending:
+                            index, _ = job.pending.popleft()
+                            job.results[index] = ([(None, str(e))] * len(job.templates), 0, None)
+                        self._condition.notify_all()
+                        continue
+
+                index, row = job.pending.popleft()
+                job.in_flight += 1
+                self._in_flight += 1
+                live_ids = tuple(other.job_id for other in self._jobs if other.started)
+                if self._executor is None:
+                    self._new_executor()
+                executor = self._executor
+                retired = None
+                self._executor_tasks += 1
+                self._last_active = time.monotonic()
+                if self.max_tasks_per_worker and self._executor_tasks >= self.max_tasks_per_worker * self.max_workers:
+                    # 进程池执行的行数达到上限：之后的行提交给新进程池（限制渲染进程的内存增长），
+                    # 新进程池的渲染进程在旧进程池执行剩余的行时启动
+                    retired = executor
+                    self._new_executor()
+                    fresh = self._executor
+
+            try:
+                future = executor.submit(_run_task, (job.context, live_ids, index, row, job.trace))
+            except Exception as e:
+                self._task_done(job, index, None, e, executor=executor)
+                continue
+            finally:
+                if retired is not None:
+                    # 旧进程池执行完已提交的行后退出
+                    retired.shutdown(wait=False)
+                    self._prestart(fresh)
+            future.add_done_callback(functools.partial(self._task_done, job, index, executor=executor))
+
+    def _task_done(self, job, index, future, error=None, executor=None):
+        """一行生成结束：保存结果，唤醒等待结果的会话和调度线程"""
+        if future is not None:
+            error = future.exception()
+        with self._condition:
+            job.in_flight -= 1
+            self._in_flight -= 1
+            self._last_active = time.monotonic()
+            if error is not None:
+                # 渲染进程异常退出：之后重新创建进程池（已经更换过的进程池不影响当前进程池）
+                if isinstance(error, BrokenProcessPool) and self._executor is executor:
+                    self._executor = None
+                results = [(None, f"渲染进程异常: {error}")] * len(job.templates)
+                events = None
+            else:
+                _, results, events, metrics_delta = future.result()
+                metrics.merge(metrics_delta)
+            if not job.closed:
+                size = _result_size(results)
+                job.results[index] = (results, size, events)
+                job.buffered_bytes += size
+            elif job.in_flight == 0:
+                job.release()
+            self._condition.notify_all()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    获取进程级的渲染调度器（第一次调用时创建）
+
+    渲染进程数、每个会话的行数限制和内存限制、进程池的空闲超时和更换行数可以用环境变量配置：
+    POSTERGEN_MAX_WORKERS、POSTERGEN_SESSION_ROW_LIMIT、POSTERGEN_SESSION_MEMORY_MB、
+    POSTERGEN_WORKER_IDLE_SECONDS、POSTERGEN_WORKER_MAX_TASKS。
+
+    Returns:
+        RenderScheduler 对象
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            memory_mb = os.environ.get(ENV_SESSION_MEMORY_MB)
+            _scheduler = RenderScheduler(
+                max_workers=int(os.environ.get(ENV_MAX_WORKERS, 0)) or None,
+                session_row_limit=int(os.environ.get(ENV_SESSION_ROW_LIMIT, DEFAULT_SESSION_ROW_LIMIT)),
+                session_memory_limit=(
+                    int(memory_mb) * 1024 * 1024 if memory_mb else DEFAULT_SESSION_MEMORY_LIMIT
+                ),
+                idle_timeout=float(os.environ.get(ENV_WORKER_IDLE_SECONDS, 0)),
+                max_tasks_per_worker=int(os.environ.get(ENV_WORKER_MAX_TASKS, 0))
+            )
+            # 导出指标时读取调度器的排队情况
+            scheduler = _scheduler
+            metrics.SCHEDULER_QUEUED_ROWS.set_function(lambda: scheduler.status()['queued_rows'])
+            metrics.SCHEDULER_QUEUED_JOBS.set_function(lambda: scheduler.status()['queued_jobs'])
+            metrics.SCHEDULER_RUNNING_JOBS.set_function(lambda: scheduler.status()['running_jobs'])
+            metrics.SCHEDULER_IN_FLIGHT.set_function(lambda: scheduler.status()['in_flight'])
+            metrics.SCHEDULER_SESSIONS.set_function(lambda: scheduler.status()['sessions'])
+        return _scheduler
+
+
+def warm_from_env(template_manager, font_path, bold_font_path):
+    """
+    设置了环境变量 POSTERGEN_WARM_POOL 时预热进程级调度器的渲染进程池，
+    预热模板为模板管理器的默认模板（每个服务进程只预热一次，之后的调用直接返回）
+
+    Args:
+        template_manager: TemplateManager 对象
+        font_path: 字体路径
+        bold_font_path: 粗体字体路径
+
+    Returns:
+        bool: 本次是否开始预热
+    """
+    if os.environ.get(ENV_WARM_POOL, '').strip().lower() in ('', '0', 'false', 'no'):
+        return False
+    # spawn 方式启动的渲染进程会重新导入主模块（Streamlit 中为 app.py），渲染进程中不预热
+    if multiprocessing.parent_process() is not None:
+        return False
+    scheduler = get_scheduler()
+    if scheduler.warmed:
+        return False
+    templates = []
+    default_template = template_manager.get_default_template()
+    if default_template:
+        background_path = template_manager.get_template_render_path(default_template)
+        if background_path:
+            # 与任务相同，使用与默认配置合并后的模板配置
+            templates.append((background_path, merge_template_config(default_template)))
+    return scheduler.warm(font_path, bold_font_path, templates)
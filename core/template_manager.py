@@ -3,64 +3,178 @@
 负责模板的创建、更新、删除和持久化存储
 """
 import os
-import json
 import shutil
 import uuid
-import io
+import time
+import hashlib
+import tempfile
 from datetime import datetime
-from PIL import Image
+from PIL import Image, ImageOps
+
+from . import tracing
+from .drawer import OUTPUT_SIZE, scale_template_config
+from .raw_image import RAW_EXTENSION, write_raw_image
+from .template_store import TemplateStore
+
+
+# 上传图片的尺寸上限（解压炸弹防护）：在解码像素数据之前根据文件头检查
+MAX_UPLOAD_SIDE = 12000
+MAX_UPLOAD_PIXELS = 50_000_000
+
+# 模板预览缩略图的最大尺寸
+PREVIEW_SIZE = (360, 640)
+
+# 图层配置的坐标标记：值为 'upload' 表示图层的坐标和字号以上传原图的像素为单位，
+# 保存时按底图的缩小比例换算到底图（输出）坐标；没有标记的配置（如界面滑块生成的配置）
+# 已经是输出坐标，不做任何缩放
+COORDINATE_SPACE_KEY = 'coordinate_space'
+UPLOAD_SPACE = 'upload'
+
+# 模板库的数据版本（记录在模板库元数据中，版本化迁移只执行一次）
+# 1: 标记为原图坐标的图层配置换算到底图坐标
+TEMPLATE_SCHEMA_VERSION = 1
+
+
+def background_scale(assets):
+    """
+    上传图片生成底图时的缩小比例（底图不超过输出尺寸，超过时等比缩小）
+    
+    Args:
+        assets: ingest_template_image() 返回的资源记录
+    
+    Returns:
+        float: 底图与原图的边长之比，没有缩小时为 1.0
+    """
+    original_size = assets.get('original', {}).get('size')
+    background_size = assets.get('background', {}).get('size')
+    if not original_size or not background_size:
+        return 1.0
+    # 按 EXIF 方向旋转后宽高可能互换，用长边计算
+    return min(1.0, max(background_size) / max(original_size))
+
+
+def to_background_space(config, assets):
+    """
+    把标记为原图坐标的图层配置换算到底图坐标
+    
+    Args:
+        config: 模板的配置字典，可以为 None
+        assets: 模板的资源记录（可以为 None）
+    
+    Returns:
+        dict: 换算后的配置；没有原图坐标标记的配置原样返回
+    """
+    if not config or config.get(COORDINATE_SPACE_KEY) != UPLOAD_SPACE:
+        return config
+    factor = background_scale(assets or {})
+    config = scale_template_config(config, factor) if factor < 1.0 else dict(config)
+    config.pop(COORDINATE_SPACE_KEY, None)
+    return config
 
 
 class TemplateManager:
     """模板管理器"""
     
-    def __init__(self, templates_dir='templates'):
+    def __init__(self, templates_dir='templates', reload_interval=1.0):
         """
         初始化模板管理器
         
         Args:
             templates_dir: 模板存储目录
+            reload_interval: 检查模板库是否被其他会话/进程修改的最小间隔（秒），
+                间隔内的查询直接使用内存索引，不做任何数据库操作
         """
         self.templates_dir = templates_dir
         self.templates_json_path = os.path.join(templates_dir, 'templates.json')
+        self.templates_db_path = os.path.join(templates_dir, 'templates.db')
+        self.reload_interval = reload_interval
+        
+        # 内存索引：模板列表、按ID索引、默认模板，以及对应的数据版本号
+        self._templates = []
+        self._templates_by_id = {}
+        self._default_template = None
+        self._data_version = None
+        self._last_check = None
+        
         self._ensure_templates_dir()
+        
+        # 模板持久化存储（首次使用时从 templates.json 迁移）
+        self.store = TemplateStore(self.templates_db_path, legacy_json_path=self.templates_json_path)
+        self.store.migrate(TEMPLATE_SCHEMA_VERSION, self._migrate_coordinate_space)
     
     def _ensure_templates_dir(self):
         """确保模板目录存在"""
         if not os.path.exists(self.templates_dir):
             os.makedirs(self.templates_dir, exist_ok=True)
     
+    def _migrate_coordinate_space(self, conn):
+        """
+        版本 1 迁移（在模板库写事务内执行）：标记为原图坐标的已有模板配置换算到底图坐标，
+        没有标记的配置保持不变
+        """
+        for template in self.store.load_all():
+            config = template.get('config')
+            if config and config.get(COORDINATE_SPACE_KEY) == UPLOAD_SPACE:
+                template['config'] = to_background_space(config, template.get('assets'))
+                self.store.update(conn, template)
+    
+    def _set_cache(self, templates, data_version):
+        """用模板列表重建内存索引"""
+        self._templates = templates
+        self._templates_by_id = {t['id']: t for t in templates}
+        self._default_template = next((t for t in templates if t.get('is_default', False)), None)
+        # 如果没有默认模板，使用第一个模板
+        if self._default_template is None and templates:
+            self._default_template = templates[0]
+        self._data_version = data_version
+        self._last_check = time.monotonic()
+    
+    @tracing.traced('template_manager.reload')
+    def _reload_cache(self):
+        """从模板库重新读取全部模板并重建内存索引"""
+        try:
+            templates = self.store.load_all()
+        except Exception as e:
+            print(f"加载模板列表失败: {e}")
+            templates = []
+        self._set_cache(templates, self.store.data_version())
+    
+    def _refresh(self):
+        """按需刷新内存索引：仅当其他连接提交了写入（数据版本变化）时才重新读取"""
+        now = time.monotonic()
+        if self._last_check is not None and now - self._last_check < self.reload_interval:
+            return
+        
+        data_version = self.store.data_version()
+        if self._last_check is not None and data_version == self._data_version:
+            self._last_check = now
+            return
+        
+        self._reload_cache()
+    
     def load_templates(self):
         """
         加载所有模板
         
         Returns:
-            list: 模板列表
+            list: 模板列表（模板字典为内存索引中的共享对象，请勿直接修改）
         """
-        if not os.path.exists(self.templates_json_path):
-            return []
-        
-        try:
-            with open(self.templates_json_path, 'r', encoding='utf-8') as f:
-                templates = json.load(f)
-            return templates if isinstance(templates, list) else []
-        except Exception as e:
-            print(f"加载模板列表失败: {e}")
-            return []
+        self._refresh()
+        return list(self._templates)
     
     def save_templates(self, templates):
         """
-        保存模板列表
+        整体替换模板列表（单个事务），并更新内存索引
         
         Args:
             templates: 模板列表
         """
-        self._ensure_templates_dir()
         try:
-            with open(self.templates_json_path, 'w', encoding='utf-8') as f:
-                json.dump(templates, f, ensure_ascii=False, indent=2)
+            self.store.replace_all(templates)
         except Exception as e:
             raise Exception(f"保存模板列表失败: {str(e)}")
+        
+        self._reload_cache()
     
     def get_template(self, template_id):
         """
@@ -72,11 +186,8 @@ class TemplateManager:
         Returns:
             dict: 模板配置，如果不存在返回None
         """
-        templates = self.load_templates()
-        for template in templates:
-            if template['id'] == template_id:
-                return template
-        return None
+        self._refresh()
+        return self._templates_by_id.get(template_id)
     
     def get_default_template(self):
         """
@@ -85,12 +196,8 @@ class TemplateManager:
         Returns:
             dict: 默认模板配置，如果不存在返回None
         """
-        templates = self.load_templates()
-        for template in templates:
-            if template.get('is_default', False):
-                return template
-        # 如果没有默认模板，返回第一个模板
-        return templates[0] if templates else None
+        self._refresh()
+        return self._default_template
     
     def create_template(self, name, config=None, uploaded_file=None, background_path=None):
         """
@@ -98,15 +205,13 @@ class TemplateManager:
         
         Args:
             name: 模板名称
-            config: 模板配置字典
+            config: 模板配置字典（输出坐标；标记为原图坐标（coordinate_space 为 'upload'）时按底图的缩小比例换算）
             uploaded_file: 上传的文件对象（Streamlit UploadedFile）
             background_path: 背景图片路径（如果使用已有文件）
         
         Returns:
             dict: 创建的模板配置
         """
-        templates = self.load_templates()
-        
         # 生成唯一ID
         template_id = str(uuid.uuid4())
         
@@ -115,8 +220,10 @@ class TemplateManager:
         os.makedirs(template_dir, exist_ok=True)
         
         # 处理背景图片
+        assets = None
         if uploaded_file:
-            background_path = self.save_template_image(uploaded_file, template_id)
+            assets = self.ingest_template_image(uploaded_file, template_id)
+            background_path = assets['background']['path']
         elif background_path and os.path.exists(background_path):
             # 如果提供了已有路径，复制到模板目录
             dest_path = os.path.join(template_dir, 'background.jpg')
@@ -135,12 +242,18 @@ class TemplateManager:
             'updated_at': datetime.now().isoformat(),
             'is_default': False
         }
+        if assets:
+            template['assets'] = assets
+        template['config'] = to_background_space(template['config'], assets)
         
-        # 添加到列表
-        templates.append(template)
+        # 保存（只插入新模板，不重写其他模板）
+        try:
+            with self.store.transaction() as conn:
+                self.store.insert(conn, template)
+        except Exception as e:
+            raise Exception(f"保存模板失败: {str(e)}")
         
-        # 保存
-        self.save_templates(templates)
+        self._reload_cache()
         
         return template
     
@@ -151,43 +264,45 @@ class TemplateManager:
         Args:
             template_id: 模板ID
             name: 新名称（可选）
-            config: 新配置（可选）
+            config: 新配置（可选）；标记为原图坐标（coordinate_space 为 'upload'）时按底图的缩小比例换算
             uploaded_file: 新背景图片（可选）
         
         Returns:
             dict: 更新后的模板配置
         """
-        templates = self.load_templates()
-        
-        template = None
-        template_index = -1
-        for i, t in enumerate(templates):
-            if t['id'] == template_id:
-                template = t
-                template_index = i
-                break
-        
-        if template is None:
+        if self.store.get(template_id) is None:
             raise Exception(f"模板不存在: {template_id}")
         
-        # 更新名称
-        if name is not None:
-            template['name'] = name
-        
-        # 更新配置
-        if config is not None:
-            template['config'] = config
-        
-        # 更新背景图片
+        # 更新背景图片（在事务外完成耗时的图片处理）
+        assets = None
         if uploaded_file:
-            template['background_path'] = self.save_template_image(uploaded_file, template_id)
-        
-        # 更新更新时间
-        template['updated_at'] = datetime.now().isoformat()
-        
-        # 保存
-        templates[template_index] = template
-        self.save_templates(templates)
+            assets = self.ingest_template_image(uploaded_file, template_id)
+        
+        # 在写事务内读取最新记录再修改，避免覆盖其他会话同时做的修改
+        with self.store.transaction() as conn:
+            template = self.store.get(template_id, conn=conn)
+            if template is None:
+                raise Exception(f"模板不存在: {template_id}")
+            
+            # 更新名称
+            if name is not None:
+                template['name'] = name
+            
+            if assets is not None:
+                template['background_path'] = assets['background']['path']
+                template['assets'] = assets
+            
+            # 更新配置（只换算新传入的原图坐标配置；已保存的配置都是底图坐标，更换底图时不再缩放）
+            if config is not None:
+                template['config'] = to_background_space(config, template.get('assets'))
+            
+            # 更新更新时间
+            template['updated_at'] = datetime.now().isoformat()
+            
+            # 保存
+            self.store.update(conn, template)
+        
+        self._reload_cache()
         
         return template
     
@@ -201,22 +316,19 @@ class TemplateManager:
         Returns:
             bool: 是否删除成功
         """
-        templates = self.load_templates()
-        
-        template = None
-        template_index = -1
-        for i, t in enumerate(templates):
-            if t['id'] == template_id:
-                template = t
-                template_index = i
-                break
-        
-        if template is None:
-            raise Exception(f"模板不存在: {template_id}")
+        with self.store.transaction() as conn:
+            template = self.store.get(template_id, conn=conn)
+            if template is None:
+                raise Exception(f"模板不存在: {template_id}")
+            
+            # 检查是否为默认模板
+            if template.get('is_default', False):
+                raise Exception("不能删除默认模板")
+            
+            # 从模板库中删除
+            self.store.delete(conn, template_id)
         
-        # 检查是否为默认模板
-        if template.get('is_default', False):
-            raise Exception("不能删除默认模板")
+        self._reload_cache()
         
         # 删除模板目录
         template_dir = os.path.join(self.templates_dir, template_id)
@@ -226,15 +338,6 @@ class TemplateManager:
             except Exception as e:
                 raise Exception(f"删除模板目录失败: {str(e)}")
         
-        # 从列表中删除
-        templates.pop(template_index)
-        
-        # 保存更新后的模板列表
-        try:
-            self.save_templates(templates)
-        except Exception as e:
-            raise Exception(f"保存模板列表失败: {str(e)}")
-        
         return True
     
     def set_default_template(self, template_id):
@@ -247,20 +350,11 @@ class TemplateManager:
         Returns:
             bool: 是否设置成功
         """
-        templates = self.load_templates()
+        # 取消其他模板的默认标记并设置新的默认模板（同一事务内完成）
+        with self.store.transaction() as conn:
+            self.store.set_default(conn, template_id)
         
-        # 取消所有模板的默认标记
-        for template in templates:
-            template['is_default'] = False
-        
-        # 设置新的默认模板
-        for template in templates:
-            if template['id'] == template_id:
-                template['is_default'] = True
-                break
-        
-        # 保存
-        self.save_templates(templates)
+        self._reload_cache()
         
         return True
     
@@ -275,35 +369,168 @@ class TemplateManager:
         Returns:
             str: 保存后的相对路径
         """
+        return self.ingest_template_image(uploaded_file, template_id)['background']['path']
+    
+    @tracing.traced('template_manager.ingest_image')
+    def ingest_template_image(self, uploaded_file, template_id):
+        """
+        处理上传的模板背景图片（只在上传时执行一次）
+        
+        依次完成：尺寸校验（解压炸弹防护）、保存原图、生成可直接用于绘制的底图
+        （不超过输出尺寸的 RGB 图片）和预览缩略图，并计算各文件的摘要。
+        底图被缩小时，以原图坐标编写的图层配置由 to_background_space() 按相同比例换算。
+        
+        Args:
+            uploaded_file: Streamlit UploadedFile 对象（或任意二进制文件对象）
+            template_id: 模板ID
+        
+        Returns:
+            dict: 资源记录，包含 'original'、'background'、'raw'、'preview' 四项，
+                每项为 {'path': 相对路径, 'sha256': 摘要, 'size': [宽, 高]}
+        
+        Raises:
+            ValueError: 图片无法识别或尺寸超出限制
+        """
         template_dir = os.path.join(self.templates_dir, template_id)
         os.makedirs(template_dir, exist_ok=True)
         
-        dest_path = os.path.join(template_dir, 'background.jpg')
+        uploaded_file.seek(0)
+        try:
+            img = Image.open(uploaded_file)
+        except Exception as e:
+            raise ValueError(f"无法识别的图片文件: {str(e)}")
+        
+        # 只读取了文件头，在解码像素之前检查尺寸
+        width, height = img.size
+        if width > MAX_UPLOAD_SIDE or height > MAX_UPLOAD_SIDE or width * height > MAX_UPLOAD_PIXELS:
+            raise ValueError(
+                f"图片尺寸过大: {width}x{height}，"
+                f"单边不能超过 {MAX_UPLOAD_SIDE} 像素，总像素不能超过 {MAX_UPLOAD_PIXELS}"
+            )
+        
+        # 保存原图（原始字节，不重新编码）
+        original_ext = (img.format or 'jpg').lower().replace('jpeg', 'jpg')
+        original_name = f'original.{original_ext}'
+        uploaded_file.seek(0)
+        original_digest = self._write_atomic(
+            os.path.join(template_dir, original_name),
+            lambda f: shutil.copyfileobj(uploaded_file, f)
+        )
+        for name in os.listdir(template_dir):
+            if name.startswith('original.') and name != original_name:
+                os.remove(os.path.join(template_dir, name))
+        
+        # 生成绘制用底图：按 EXIF 方向旋转，去除透明通道（白色底），超过输出尺寸时等比缩小
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3])  # 使用 alpha 通道作为 mask
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        if img.width > OUTPUT_SIZE[0] or img.height > OUTPUT_SIZE[1]:
+            img.thumbnail(OUTPUT_SIZE, Image.Resampling.LANCZOS)
+        
+        background_digest = self._write_atomic(
+            os.path.join(template_dir, 'background.jpg'),
+            lambda f: img.save(f, 'JPEG', quality=95)
+        )
+        
+        # 生成原始像素格式的底图，绘制进程通过 mmap 直接使用
+        raw_record = self._write_raw_background(img, template_id, background_digest)
+        
+        # 生成预览缩略图
+        preview = img.copy()
+        preview.thumbnail(PREVIEW_SIZE, Image.Resampling.LANCZOS)
+        preview_digest = self._write_atomic(
+            os.path.join(template_dir, 'preview.jpg'),
+            lambda f: preview.save(f, 'JPEG', quality=85)
+        )
+        
+        return {
+            'original': {
+                'path': os.path.join(template_id, original_name),
+                'sha256': original_digest,
+                'size': [width, height]
+            },
+            'background': {
+                'path': os.path.join(template_id, 'background.jpg'),
+                'sha256': background_digest,
+                'size': list(img.size)
+            },
+            'raw': raw_record,
+            'preview': {
+                'path': os.path.join(template_id, 'preview.jpg'),
+                'sha256': preview_digest,
+                'size': list(preview.size)
+            }
+        }
+    
+    def _write_raw_background(self, img, template_id, source_digest):
+        """
+        写入原始像素格式的底图，并清理该模板旧的原始像素文件
         
-        # 读取上传的文件
-        file_bytes = uploaded_file.read()
+        文件名包含来源图片的摘要：正在被其他进程 mmap 映射的旧文件不会被覆盖
+        （Windows 下无法替换已映射的文件），旧文件删除失败时保留到下次清理。
         
-        # 打开图片
-        img = Image.open(io.BytesIO(file_bytes))
+        Args:
+            img: 绘制用底图（PIL Image）
+            template_id: 模板ID
+            source_digest: 来源背景图片的 SHA-256 摘要
         
-        # 检测格式
-        img_format = img.format
+        Returns:
+            dict: 资源记录 {'path', 'sha256', 'size'}
+        """
+        template_dir = os.path.join(self.templates_dir, template_id)
+        raw_name = f'background-{source_digest[:16]}{RAW_EXTENSION}'
+        raw_digest = self._write_atomic(
+            os.path.join(template_dir, raw_name),
+            lambda f: write_raw_image(img, f)
+        )
         
-        # 如果是PNG，转换为JPG
-        if img_format == 'PNG':
-            # 转换为 RGB 模式（PNG 可能是 RGBA）
-            if img.mode == 'RGBA':
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3])  # 使用 alpha 通道作为 mask
-                img = background
-            else:
-                img = img.convert('RGB')
+        for name in os.listdir(template_dir):
+            if name.startswith('background-') and name.endswith(RAW_EXTENSION) and name != raw_name:
+                try:
+                    os.remove(os.path.join(template_dir, name))
+                except OSError:
+                    pass
+        
+        return {
+            'path': os.path.join(template_id, raw_name),
+            'sha256': raw_digest,
+            'size': list(img.size)
+        }
+    
+    @staticmethod
+    def _write_atomic(dest_path, write_func):
+        """
+        原子写入文件：先写入同目录下的临时文件，再重命名替换目标文件
         
-        # 保存文件
-        img.save(dest_path, 'JPEG', quality=95)
+        Args:
+            dest_path: 目标文件路径
+            write_func: 接收二进制文件对象并写入内容的函数
         
-        # 返回相对路径
-        return os.path.join(template_id, 'background.jpg')
+        Returns:
+            str: 写入内容的 SHA-256 摘要
+        """
+        dest_dir = os.path.dirname(dest_path)
+        fd, tmp_path = tempfile.mkstemp(dir=dest_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w+b') as f:
+                write_func(f)
+                f.flush()
+                f.seek(0)
+                digest = hashlib.sha256()
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest.hexdigest()
     
     def get_template_background_path(self, template):
         """
@@ -327,6 +554,89 @@ class TemplateManager:
         
         return full_path if os.path.exists(full_path) else None
     
+    def get_template_preview_path(self, template):
+        """
+        获取模板预览缩略图的完整路径（没有缩略图时返回背景图片路径）
+        
+        Args:
+            template: 模板配置字典
+        
+        Returns:
+            str: 预览图片的完整路径
+        """
+        preview_path = template.get('assets', {}).get('preview', {}).get('path')
+        if preview_path:
+            full_path = os.path.join(self.templates_dir, preview_path)
+            if os.path.exists(full_path):
+                return full_path
+        return self.get_template_background_path(template)
+    
+    @tracing.traced('template_manager.prepare_raw_background')
+    def prepare_raw_background(self, template_id):
+        """
+        为已有模板生成原始像素格式的底图，并记录到模板的资源记录中
+        
+        Args:
+            template_id: 模板ID
+        
+        Returns:
+            dict: 更新后的模板配置，如果模板不存在或没有背景图片返回None
+        """
+        template = self.get_template(template_id)
+        if template is None:
+            return None
+        
+        background_path = self.get_template_background_path(template)
+        if not background_path:
+            return None
+        
+        digest = hashlib.sha256()
+        with open(background_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        
+        with Image.open(background_path) as img:
+            img.load()
+            raw_record = self._write_raw_background(img, template_id, digest.hexdigest())
+        
+        with self.store.transaction() as conn:
+            template = self.store.get(template_id, conn=conn)
+            if template is None:
+                return None
+            template.setdefault('assets', {})['raw'] = raw_record
+            self.store.update(conn, template)
+        
+        self._reload_cache()
+        
+        return template
+    
+    def get_template_render_path(self, template, prepare=True):
+        """
+        获取绘制用底图的完整路径：优先使用原始像素格式（mmap 零拷贝），否则使用背景图片
+        
+        Args:
+            template: 模板配置字典
+            prepare: 模板还没有原始像素底图时，是否立即生成（只生成一次）
+        
+        Returns:
+            str: 绘制用底图的完整路径
+        """
+        raw_path = template.get('assets', {}).get('raw', {}).get('path')
+        if raw_path:
+            full_path = os.path.join(self.templates_dir, raw_path)
+            if os.path.exists(full_path):
+                return full_path
+        
+        if prepare and self.get_template_background_path(template):
+            try:
+                prepared = self.prepare_raw_background(template['id'])
+                if prepared is not None:
+                    return self.get_template_render_path(prepared, prepare=False)
+            except Exception as e:
+                print(f"生成原始像素底图失败: {e}")
+        
+        return self.get_template_background_path(template)
+    
     def initialize_default_template(self, default_background_path='assets/template.jpg'):
         """
         初始化默认模板（如果不存在任何模板）
@@ -337,7 +647,8 @@ class TemplateManager:
         Returns:
             dict: 创建的默认模板配置
         """
-        templates = self.load_templates()
+        self._reload_cache()
+        templates = self._templates
         
         # 如果已有模板，不创建
         if templates:
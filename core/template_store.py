@@ -0,0 +1,260 @@
+"""
+模板存储模块
+基于 SQLite 的模板持久化后端：按模板ID索引、单模板事务更新、多进程并发写入安全
+"""
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class TemplateStore:
+    """模板存储（SQLite，WAL 模式）"""
+
+    SCHEMA = (
+        '''
+        CREATE TABLE IF NOT EXISTS templates (
+            id TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            is_default INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL
+        )
+        ''',
+        # 保证最多只有一个默认模板
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_templates_default
+        ON templates (is_default) WHERE is_default = 1
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''',
+    )
+
+    def __init__(self, db_path, legacy_json_path=None, timeout=30.0):
+        """
+        初始化模板存储
+
+        Args:
+            db_path: SQLite 数据库文件路径
+            legacy_json_path: 旧版 templates.json 路径（可选），数据库为空时一次性迁移
+            timeout: 等待其他进程释放写锁的最长时间（秒）
+        """
+        self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+
+        # 同一连接会被 Streamlit 的多个脚本线程共享，用锁串行化访问
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            db_path,
+            timeout=timeout,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+
+        # 已初始化的数据库只做一次普通读取，不获取写锁
+        if not self._initialized():
+            with self.transaction() as conn:
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+                self._migrate_from_json(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        写事务：BEGIN IMMEDIATE 立即获取数据库写锁，其他进程的写入会等待
+
+        Yields:
+            sqlite3.Connection 对象
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            else:
+                self._conn.execute('COMMIT')
+
+    def _initialized(self):
+        """数据库是否已建表并完成 templates.json 迁移（普通读取，不加写锁）"""
+        with self._lock:
+            try:
+                return self._conn.execute(
+                    "SELECT 1 FROM meta WHERE key = 'migrated_from_json'"
+                ).fetchone() is not None
+            except sqlite3.OperationalError:
+                # meta 表还不存在
+                return False
+
+    def schema_version(self):
+        """
+        读取模板库的数据版本（普通读取，不加写锁）
+
+        Returns:
+            int: 已完成的版本化迁移的最高版本，从未迁移时为 0
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'schema_version'"
+            ).fetchone()
+        return int(row[0]) if row else 0
+
+    def migrate(self, version, migration):
+        """
+        执行一次版本化迁移：数据版本低于 version 时在写事务内执行 migration 并记录新版本
+
+        已是最新版本时只做一次普通读取；多个进程同时启动时，获取写锁后再检查一次版本，
+        保证迁移只执行一次。
+
+        Args:
+            version: 迁移完成后的数据版本
+            migration: 迁移函数，参数为事务中的连接
+
+        Returns:
+            bool: 本次是否执行了迁移
+        """
+        if self.schema_version() >= version:
+            return False
+        with self.transaction() as conn:
+            current = self.get_meta(conn, 'schema_version')
+            if current is not None and int(current) >= version:
+                return False
+            migration(conn)
+            self.set_meta(conn, 'schema_version', str(version))
+        return True
+
+    def _migrate_from_json(self, conn):
+        """从旧版 templates.json 一次性迁移（仅在尚未迁移且数据库为空时执行）"""
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone():
+            return
+
+        if (self.legacy_json_path and os.path.exists(self.legacy_json_path)
+                and not conn.execute('SELECT 1 FROM templates LIMIT 1').fetchone()):
+            try:
+                with open(self.legacy_json_path, 'r', encoding='utf-8') as f:
+                    templates = json.load(f)
+            except Exception as e:
+                raise Exception(f"迁移模板列表失败: {str(e)}")
+
+            if isinstance(templates, list):
+                self._replace_all(conn, templates)
+
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+            (self.legacy_json_path or '',)
+        )
+
+    @staticmethod
+    def _row_to_template(row):
+        """数据库行 -> 模板字典"""
+        template = json.loads(row[1])
+        template['is_default'] = bool(row[0])
+        return template
+
+    @staticmethod
+    def _template_to_data(template):
+        """模板字典 -> JSON 文本（is_default 由单独的列维护）"""
+        data = {k: v for k, v in template.items() if k != 'is_default'}
+        return json.dumps(data, ensure_ascii=False)
+
+    def _replace_all(self, conn, templates):
+        """在事务内用模板列表整体替换数据库内容"""
+        conn.execute('DELETE FROM templates')
+        default_seen = False
+        for position, template in enumerate(templates):
+            is_default = bool(template.get('is_default', False)) and not default_seen
+            default_seen = default_seen or is_default
+            conn.execute(
+                'INSERT INTO templates (id, position, is_default, data) VALUES (?, ?, ?, ?)',
+                (template['id'], position, int(is_default), self._template_to_data(template))
+            )
+
+    def data_version(self):
+        """
+        获取数据版本号：其他连接（包括其他进程）提交写入后会变化
+
+        Returns:
+            int: 当前连接观察到的数据版本
+        """
+        with self._lock:
+            return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def load_all(self):
+        """
+        按创建顺序读取所有模板
+
+        Returns:
+            list: 模板列表
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT is_default, data FROM templates ORDER BY position'
+            ).fetchall()
+        return [self._row_to_template(row) for row in rows]
+
+    def get(self, template_id, conn=None):
+        """
+        按ID读取单个模板
+
+        Args:
+            template_id: 模板ID
+            conn: 事务中的连接（可选），用于在同一事务内读后写
+
+        Returns:
+            dict: 模板配置，如果不存在返回None
+        """
+        with self._lock:
+            row = (conn or self._conn).execute(
+                'SELECT is_default, data FROM templates WHERE id = ?', (template_id,)
+            ).fetchone()
+        return self._row_to_template(row) if row else None
+
+    def insert(self, conn, template):
+        """在事务内追加一个新模板（排在最后）"""
+        position = conn.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM templates').fetchone()[0]
+        conn.execute(
+            'INSERT INTO templates (id, position, is_default, data) VALUES (?, ?, 0, ?)',
+            (template['id'], position, self._template_to_data(template))
+        )
+
+    def update(self, conn, template):
+        """在事务内更新单个模板的内容（不改变顺序和默认标记）"""
+        conn.execute(
+            'UPDATE templates SET data = ? WHERE id = ?',
+            (self._template_to_data(template), template['id'])
+        )
+
+    def delete(self, conn, template_id):
+        """在事务内删除单个模板"""
+        conn.execute('DELETE FROM templates WHERE id = ?', (template_id,))
+
+    def set_default(self, conn, template_id):
+        """在事务内设置默认模板"""
+        conn.execute('UPDATE templates SET is_default = 0 WHERE is_default = 1')
+        conn.execute('UPDATE templates SET is_default = 1 WHERE id = ?', (template_id,))
+
+    def get_meta(self, conn, key):
+        """在事务内读取元数据（如一次性迁移的标记），不存在时返回 None"""
+        row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, conn, key, value):
+        """在事务内写入元数据"""
+        conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def replace_all(self, templates):
+        """用模板列表整体替换数据库内容（单个事务）"""
+        with self.transaction() as conn:
+            self._replace_all(conn, templates)
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,120 @@
+"""
+文本输入解析模块
+负责将"文本输入"标签页中粘贴的多行记录解析为 DataFrame
+"""
+import re
+import pandas as pd
+
+
+# 每行整体语法：城市 姓名 金额[万][x年] [缴费期间]，多余字段忽略
+LINE_PATTERN = re.compile(r'(\S+)\s+(\S+)\s+(\S+)(?:\s+(\S+))?')
+
+# 金额字段：普通格式（20万 / 20 / 20.5万）
+PLAIN_AMOUNT_PATTERN = re.compile(r'(\d+(?:\.\d+)?)万?')
+
+# 金额字段：包含缴费期间（20万x6年）
+AMOUNT_NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+AMOUNT_PERIOD_PATTERN = re.compile(r'[xX](\d+)年')
+
+# 缴费期间字段中的数字（6年 / 6年期）
+PERIOD_NUMBER_PATTERN = re.compile(r'\d+')
+
+# 最低金额（万元），低于此金额的记录不生成海报
+MIN_AMOUNT = 10
+
+# 拒绝原因
+REASON_TOO_FEW_FIELDS = '字段不足（至少需要：城市 姓名 金额）'
+REASON_BAD_AMOUNT = '金额无法解析'
+REASON_BELOW_MIN_AMOUNT = f'金额小于{MIN_AMOUNT}万'
+
+COLUMNS = ['城市', '姓名', '金额', '单位', '缴费期间', '描述']
+
+
+def parse_text(text):
+    """
+    一次遍历解析整段文本输入
+
+    Args:
+        text: 文本框中的原始内容，每行一条记录
+
+    Returns:
+        (DataFrame, list): 按金额从大到小排序的数据，以及被拒绝的行列表；
+        每个被拒绝的行为字典 {'行号', '内容', '原因'}，行号从 1 开始
+    """
+    line_match = LINE_PATTERN.match
+    plain_amount_match = PLAIN_AMOUNT_PATTERN.fullmatch
+    amount_number_search = AMOUNT_NUMBER_PATTERN.search
+    amount_period_search = AMOUNT_PERIOD_PATTERN.search
+    period_number_search = PERIOD_NUMBER_PATTERN.search
+
+    cities = []
+    names = []
+    amounts = []
+    periods = []
+    rejected = []
+
+    for line_no, raw_line in enumerate(text.splitlines(), start=1):
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        match = line_match(line)
+        if match is None:
+            rejected.append({'行号': line_no, '内容': line, '原因': REASON_TOO_FEW_FIELDS})
+            continue
+
+        city, name, amount_str, period_str = match.groups()
+        payment_period = 0
+
+        if 'x' in amount_str or 'X' in amount_str:
+            # 金额字段包含缴费期间（格式：20万x6年）
+            amount_match = amount_number_search(amount_str)
+            if amount_match is None:
+                rejected.append({'行号': line_no, '内容': line, '原因': REASON_BAD_AMOUNT})
+                continue
+            amount = float(amount_match.group())
+            period_match = amount_period_search(amount_str)
+            if period_match:
+                payment_period = int(period_match.group(1))
+        else:
+            amount_match = plain_amount_match(amount_str)
+            if amount_match is None:
+                rejected.append({'行号': line_no, '内容': line, '原因': REASON_BAD_AMOUNT})
+                continue
+            amount = float(amount_match.group(1))
+
+            # 第四个字段：趸交 / x年 / x年期
+            if period_str and '趸交' not in period_str and '年' in period_str:
+                period_match = period_number_search(period_str)
+                if period_match:
+                    payment_period = int(period_match.group())
+
+        if amount < MIN_AMOUNT:
+            rejected.append({'行号': line_no, '内容': line, '原因': REASON_BELOW_MIN_AMOUNT})
+            continue
+
+        cities.append(city)
+        names.append(name)
+        amounts.append(int(amount))
+        periods.append(payment_period)
+
+    if not amounts:
+        return pd.DataFrame(columns=COLUMNS), rejected
+
+    df = pd.DataFrame({
+        '城市': cities,
+        '姓名': names,
+        '金额': amounts,
+        '单位': '万',
+        '缴费期间': periods,
+    })
+    df['描述'] = [
+        "喜签趸交保单" if period == 0 else f"喜签{period}年期保单"
+        for period in periods
+    ]
+
+    # 按规保金额从大到小排序（稳定排序，金额相同时保持输入顺序）
+    df = df.sort_values('金额', ascending=False, kind='stable').reset_index(drop=True)
+    df['金额'] = df['金额'].astype(str)
+
+    return df[COLUMNS], rejected
@@ -0,0 +1,234 @@
+"""
+性能追踪模块
+记录带时间戳和属性的嵌套区间（span），每个任务写出一个 Chrome trace / Perfetto 兼容的 JSON 文件
+（在 chrome://tracing 或 https://ui.perfetto.dev 中打开）。
+
+追踪器保存在上下文变量中，只记录当前线程（Streamlit 会话的脚本线程）的区间；
+渲染进程中的区间在返回结果时一起带回。没有启用追踪时 span() 返回共享的空区间，几乎没有开销。
+"""
+import os
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# 设置此环境变量（如 POSTERGEN_TRACE=1）后，应用为每个任务写出追踪文件
+ENV_TRACE = 'POSTERGEN_TRACE'
+
+# 追踪文件名（写在任务目录中）
+TRACE_FILENAME = 'trace.json'
+
+# 每个追踪器最多保存的事件数，超过后丢弃新事件（避免长时间开启时占用过多内存）
+MAX_EVENTS = 500000
+
+_current_tracer = ContextVar('postergen_tracer', default=None)
+
+
+def env_enabled():
+    """是否通过环境变量启用了追踪"""
+    return os.environ.get(ENV_TRACE, '').strip().lower() not in ('', '0', 'false', 'no')
+
+
+def _now_us():
+    # perf_counter 在 Linux / Windows / macOS 上是系统级单调时钟，渲染进程和主进程的时间戳可以直接比较
+    return time.perf_counter_ns() / 1000
+
+
+class Tracer:
+    """追踪器：收集 Chrome trace 格式的事件"""
+
+    def __init__(self, metadata=None):
+        """
+        Args:
+            metadata: 写入追踪文件的附加信息（可选）
+        """
+        self.metadata = dict(metadata or {})
+        self.events = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add_events(self, events):
+        """添加事件（如渲染进程带回的事件）"""
+        with self._lock:
+            room = MAX_EVENTS - len(self.events)
+            if len(events) > room:
+                self.dropped += len(events) - max(room, 0)
+                events = events[:max(room, 0)]
+            self.events.extend(events)
+
+    def dumps(self):
+        """追踪数据 -> JSON 字节"""
+        with self._lock:
+            events = list(self.events)
+        process_names = {os.getpid(): 'PosterGenMaster'}
+        for event in events:
+            process_names.setdefault(event['pid'], '渲染进程')
+        metadata_events = [
+            {'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': name}}
+            for pid, name in process_names.items()
+        ]
+        other_data = dict(self.metadata)
+        if self.dropped:
+            other_data['dropped_events'] = self.dropped
+        return json.dumps(
+            {'traceEvents': metadata_events + events, 'displayTimeUnit': 'ms', 'otherData': other_data},
+            ensure_ascii=False, default=str
+        ).encode('utf-8')
+
+    def write(self, path):
+        """
+        写出追踪文件
+
+        Args:
+            path: 文件路径
+
+        Returns:
+            str: 文件路径
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(self.dumps())
+        return path
+
+
+class Span:
+    """一个区间：可以用作上下文管理器，也可以手动调用 end()"""
+
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = _now_us()
+
+    def set(self, **args):
+        """添加属性（如编码后的字节数）"""
+        self.args.update(args)
+
+    def end(self, **args):
+        """结束区间并记录事件"""
+        if args:
+            self.args.update(args)
+        self.tracer.add_events([{
+            'name': self.name,
+            'ph': 'X',
+            'ts': self.start,
+            'dur': _now_us() - self.start,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': self.args,
+        }])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = f"{exc_type.__name__}: {exc}"
+        self.end()
+
+
+class _NullSpan:
+    """没有启用追踪时使用的空区间"""
+
+    __slots__ = ()
+
+    def set(self, **args):
+        pass
+
+    def end(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **args):
+    """
+    开始一个区间
+
+    Args:
+        name: 区间名称
+        **args: 区间属性（如行索引、模板ID、字节数）
+
+    Returns:
+        Span 对象；当前线程没有启用追踪时返回空区间
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        return _NULL_SPAN
+    return Span(tracer, name, args)
+
+
+def traced(name):
+    """
+    装饰器：把函数的每次调用记录为一个区间（没有启用追踪时直接调用）
+
+    Args:
+        name: 区间名称
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _current_tracer.get()
+            if tracer is None:
+                return func(*args, **kwargs)
+            with Span(tracer, name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_tracer():
+    """当前线程的追踪器（没有启用追踪时为 None）"""
+    return _current_tracer.get()
+
+
+def enabled():
+    """当前线程是否启用了追踪"""
+    return _current_tracer.get() is not None
+
+
+def activate(tracer):
+    """
+    在当前线程启用追踪器（Streamlit 每次重新运行脚本时调用）
+
+    Args:
+        tracer: Tracer 对象，None 表示停用
+    """
+    _current_tracer.set(tracer)
+
+
+@contextmanager
+def tracing(tracer):
+    """在 with 块中启用追踪器，结束后恢复之前的追踪器"""
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+@contextmanager
+def collect():
+    """
+    在渲染进程中收集区间事件（随渲染结果一起返回给主进程）
+
+    Yields:
+        list: 事件列表，with 块结束后包含块内记录的所有事件
+    """
+    tracer = Tracer()
+    with tracing(tracer):
+        yield tracer.events
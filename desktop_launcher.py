@@ -6,10 +6,35 @@ import subprocess
 import sys
 import os
 import time
+import socket
+import logging
+import tempfile
+import multiprocessing
 import threading
 import webbrowser
+from collections import deque
+from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
+# 首选端口（被占用时改用系统分配的空闲端口）
+DEFAULT_PORT = 8501
+
+# 服务器日志：按大小轮转，保留最近几个文件
+LOG_FILENAME = 'postergen.log'
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+# 启动失败时在控制台显示的最近日志行数
+LOG_TAIL_LINES = 20
+
+# 就绪检测：从 HEALTH_FIRST_DELAY 开始按倍数增加检测间隔，最长 HEALTH_MAX_DELAY，总计等待 HEALTH_TIMEOUT 秒
+HEALTH_FIRST_DELAY = 0.05
+HEALTH_MAX_DELAY = 0.5
+HEALTH_TIMEOUT = 30
+
+# 启动器开始运行的时间（冷启动耗时从这里开始计算）
+LAUNCH_TIME = time.perf_counter()
+
 # 获取应用根目录
 if getattr(sys, 'frozen', False):
     # 如果是打包后的 exe，使用 PyInstaller 临时目录
@@ -41,8 +66,80 @@ if not APP_FILE.exists():
             BASE_DIR = exe_dir
             os.chdir(BASE_DIR)
 
-def start_streamlit():
-    """启动 Streamlit 服务器"""
+def find_free_port(preferred=DEFAULT_PORT):
+    """
+    选择服务器端口：首选端口空闲时使用首选端口，否则使用系统分配的空闲端口
+    
+    Args:
+        preferred: 首选端口
+    
+    Returns:
+        int: 端口号
+    """
+    for port in (preferred, 0):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            try:
+                sock.bind(('127.0.0.1', port))
+            except OSError:
+                continue
+            return sock.getsockname()[1]
+    raise OSError("没有可用的端口")
+
+def log_dir():
+    """日志目录：开发模式在应用目录下，打包后在 exe 所在目录下（临时目录退出时会被删除），不可写时使用系统临时目录"""
+    base = Path(sys.executable).parent if getattr(sys, 'frozen', False) else BASE_DIR
+    for directory in (base / 'logs', Path(tempfile.gettempdir()) / 'PosterGenMaster' / 'logs'):
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            return directory
+        except OSError:
+            continue
+    return Path(tempfile.gettempdir())
+
+def create_server_logger():
+    """服务器日志记录器（写入按大小轮转的日志文件）"""
+    logger = logging.getLogger('postergen.server')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = RotatingFileHandler(
+        log_dir() / LOG_FILENAME, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    logger.addHandler(handler)
+    return logger
+
+class LogPump:
+    """后台线程持续读取服务器输出并写入日志文件（不读取时管道写满会阻塞服务器），同时保留最近几行"""
+    
+    def __init__(self, stream, logger, tail_lines=LOG_TAIL_LINES):
+        self.stream = stream
+        self.logger = logger
+        self.tail = deque(maxlen=tail_lines)
+        self._thread = threading.Thread(target=self._run, name='streamlit-log', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        for raw_line in iter(self.stream.readline, b''):
+            line = raw_line.decode('utf-8', errors='replace').rstrip()
+            if line:
+                self.tail.append(line)
+                self.logger.info(line)
+        self.stream.close()
+    
+    def join(self, timeout=None):
+        """等待服务器输出结束"""
+        self._thread.join(timeout)
+
+def start_streamlit(port):
+    """
+    启动 Streamlit 服务器
+    
+    Args:
+        port: 服务器端口
+    
+    Returns:
+        subprocess.Popen: 服务器进程，启动失败时为 None
+    """
     try:
         # 构建 streamlit run 命令
         cmd = [
@@ -50,67 +147,121 @@ def start_streamlit():
             '-m', 'streamlit', 'run',
             str(APP_FILE),
             '--server.headless', 'true',
-            '--server.port', '8501',
+            '--server.port', str(port),
             '--server.address', 'localhost',
             '--browser.gatherUsageStats', 'false'
         ]
         
+        # 桌面版默认预热渲染进程池（打开页面时在后台启动渲染进程、加载字体和默认模板）
+        env = dict(os.environ)
+        env.setdefault('POSTERGEN_WARM_POOL', '1')
+        
+        # 标准输出和错误输出合并到一个管道，由 LogPump 持续读取
+        popen_args = {
+            'stdout': subprocess.PIPE,
+            'stderr': subprocess.STDOUT,
+            'cwd': str(BASE_DIR),
+            'env': env,
+        }
+        
         # 启动 Streamlit（不显示控制台窗口）
         if sys.platform == 'win32':
             # Windows: 隐藏控制台窗口
             startupinfo = subprocess.STARTUPINFO()
             startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
             startupinfo.wShowWindow = subprocess.SW_HIDE
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                startupinfo=startupinfo,
-                cwd=str(BASE_DIR)
-            )
-        else:
-            # macOS/Linux
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=str(BASE_DIR)
-            )
+            popen_args['startupinfo'] = startupinfo
         
-        return process
+        return subprocess.Popen(cmd, **popen_args)
     except Exception as e:
         print(f"启动 Streamlit 失败: {e}")
         return None
 
-def wait_for_server(max_wait=30):
-    """等待服务器启动"""
+def preload_file_cache():
+    """
+    服务器启动期间读一遍字体、底图和模板图片，只是把文件读入操作系统的文件缓存，
+    首次生成时服务器读取这些文件不再等待磁盘（打包后资源刚解压到临时目录时尤其明显）
+    
+    启动器与服务器是不同的进程，这里不会加载字体或解码底图；服务器进程内的预热
+    （启动渲染进程、加载字体和默认模板）由 POSTERGEN_WARM_POOL 在服务器中完成，见 start_streamlit()
+    
+    Returns:
+        (count, size): 读取的文件数和字节数
+    """
+    count = size = 0
+    patterns = [('assets', '*.ttf'), ('assets', '*.otf'), ('assets', '*.jpg'), ('assets', '*.png'),
+                ('templates', '*.*'), ('templates', '*/*.*')]
+    for directory, pattern in patterns:
+        for path in (BASE_DIR / directory).glob(pattern):
+            if path.suffix.lower() not in ('.ttf', '.otf', '.ttc', '.jpg', '.jpeg', '.png', '.raw', '.json'):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    while True:
+                        chunk = f.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                count += 1
+            except OSError:
+                continue
+    return count, size
+
+def wait_for_server(process, port, timeout=HEALTH_TIMEOUT):
+    """
+    等待服务器就绪：检测 /_stcore/health，间隔从 50 毫秒开始逐渐增加
+    
+    Args:
+        process: 服务器进程（提前退出时立即停止等待）
+        port: 服务器端口
+        timeout: 最长等待秒数
+    
+    Returns:
+        bool: 服务器是否就绪
+    """
     import urllib.request
     import urllib.error
     
-    url = 'http://localhost:8501'
-    start_time = time.time()
+    url = f'http://localhost:{port}/_stcore/health'
+    deadline = time.perf_counter() + timeout
+    delay = HEALTH_FIRST_DELAY
     
-    while time.time() - start_time < max_wait:
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            return False
         try:
-            urllib.request.urlopen(url, timeout=1)
-            return True
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
         except (urllib.error.URLError, OSError):
-            time.sleep(0.5)
+            pass
+        time.sleep(delay)
+        delay = min(delay * 2, HEALTH_MAX_DELAY)
     
     return False
 
-def open_browser():
-    """打开浏览器"""
-    url = 'http://localhost:8501'
-    # 等待服务器启动
-    if wait_for_server():
+def open_browser(process, port, log_pump, logger):
+    """等待服务器就绪后打开浏览器，并报告冷启动耗时"""
+    url = f'http://localhost:{port}'
+    if wait_for_server(process, port):
+        cold_start = time.perf_counter() - LAUNCH_TIME
+        logger.info(f"[launcher] 服务器就绪，冷启动耗时 {cold_start:.2f} 秒，端口 {port}")
         webbrowser.open(url)
-        print(f"应用已启动，请在浏览器中访问: {url}")
+        print(f"应用已启动（冷启动耗时 {cold_start:.1f} 秒），请在浏览器中访问: {url}")
+    elif process.poll() is not None:
+        print(f"错误: 服务器启动失败（退出码 {process.returncode}），最近的日志：")
+        log_pump.join(timeout=1)
+        for line in log_pump.tail:
+            print(f"  {line}")
     else:
-        print("警告: 服务器启动超时，请手动访问 http://localhost:8501")
+        print(f"警告: 服务器启动超时，请手动访问 {url}")
 
 def main():
     """主函数"""
+    # 打包后的 exe 中，渲染进程（spawn 方式启动，包括预热的进程池）通过重新运行 exe 启动，
+    # freeze_support() 识别出渲染进程后直接执行渲染任务并退出，不会再启动一个服务器
+    multiprocessing.freeze_support()
+    
     print("正在启动 PosterGenMaster...")
     
     # 检查 app.py 是否存在
@@ -119,16 +270,37 @@ def main():
         input("按回车键退出...")
         sys.exit(1)
     
-    # 启动 Streamlit 服务器
-    process = start_streamlit()
+    # 选择端口并启动 Streamlit 服务器
+    try:
+        port = find_free_port()
+    except OSError as e:
+        print(f"错误: {e}")
+        input("按回车键退出...")
+        sys.exit(1)
+    if port != DEFAULT_PORT:
+        print(f"端口 {DEFAULT_PORT} 已被占用，改用端口 {port}")
+    
+    process = start_streamlit(port)
     if process is None:
         print("无法启动应用")
         input("按回车键退出...")
         sys.exit(1)
     
+    # 服务器输出写入日志文件
+    logger = create_server_logger()
+    logger.info(f"[launcher] 启动服务器: 端口 {port}，应用 {APP_FILE}")
+    log_pump = LogPump(process.stdout, logger)
+    print(f"服务器日志: {log_dir() / LOG_FILENAME}")
+    
+    # 服务器启动期间把字体和底图读入系统文件缓存
+    def preload():
+        count, size = preload_file_cache()
+        logger.info(f"[launcher] 已将 {count} 个资源文件读入系统文件缓存（{size / 1024 / 1024:.1f} MB）")
+    threading.Thread(target=preload, name='preload-file-cache', daemon=True).start()
+    
     try:
         # 等待服务器启动并打开浏览器
-        open_browser()
+        open_browser(process, port, log_pump, logger)
         
         # 保持进程运行
         print("\n应用正在运行中...")
@@ -147,6 +319,7 @@ def main():
                 process.wait(timeout=5)
             except:
                 process.kill()
+        log_pump.join(timeout=1)
         print("应用已关闭")
 
 if __name__ == '__main__':